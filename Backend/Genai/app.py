@@ -1,6 +1,7 @@
 import os
 import re
 import logging
+from structured_logging import setup_logging
 from dotenv import load_dotenv
 from flask import (
     Flask,
@@ -17,9 +18,9 @@ from google.genai import types
 from prompts import *
 from utils import *
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+setup_logging()
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
@@ -34,8 +35,8 @@ gemini_model_1 = os.getenv("GEMINI_MODEL_1")
 def get_generated_code(problem_description, language):
     try:
         if language not in valid_languages:
-            logging.warning(
-                f"Unsupported language requested for generation: {language}"
+            logger.warning(
+                "Unsupported language requested for generation: %s", language
             )
             return "Error: Unsupported language."
 
@@ -59,7 +60,7 @@ def get_generated_code(problem_description, language):
         return Response(stream_with_context(stream()), mimetype="text/plain")
 
     except Exception as e:
-        logging.error(f"Error in get_generated_code function: {e}")
+        logger.error("Error in get_generated_code function: %s", e)
         return ""
 
 
@@ -70,7 +71,7 @@ def get_output(code, language):
                 code=code, time=utc_time_reference()
             )
         else:
-            logging.warning(f"Unsupported language for get_output: {language}")
+            logger.warning("Unsupported language for get_output: %s", language)
             return "Error: Language not supported."
 
         def stream():
@@ -90,7 +91,7 @@ def get_output(code, language):
 
         return Response(stream_with_context(stream()), mimetype="text/plain")
     except Exception as e:
-        logging.error(f"Error in get_output function: {e}")
+        logger.error("Error in get_output function: %s", e)
         return f"Error: Unable to process the code. {str(e)}"
 
 
@@ -129,7 +130,7 @@ def refactor_code(code, language, output, problem_description=None):
         return Response(stream_with_context(stream()), mimetype="text/plain")
 
     except Exception as e:
-        logging.error(f"Error in refactor_code function: {e}")
+        logger.error("Error in refactor_code function: %s", e)
         return ""
 
 
@@ -156,7 +157,7 @@ def refactor_code_html_css_js(language, prompt, params, problem_description=None
         result = response.text.strip()
         return result
     except Exception as e:
-        logging.error(f"Error in refactor_code_html_css_js function: {e}")
+        logger.error("Error in refactor_code_html_css_js function: %s", e)
         return f"Error: {e}"
 
 
@@ -234,76 +235,76 @@ def generate_js(html_content, css_content, project_description):
 
 @app.route("/")
 def index():
-    logging.info("Serving index page.")
+    logger.info("Serving index page.")
     return render_template("index.html")
 
 
 @app.route("/generate_code", methods=["POST"])
 @token_required
 def generate_code():
-    logging.info("Received request for /generate_code")
+    logger.info("Received request for /generate_code")
 
     try:
         token = request.headers.get("X-Recaptcha-Token")
 
         if not is_human(token):
-            logging.warning("reCAPTCHA verification failed for /generate_code.")
+            logger.warning("reCAPTCHA verification failed for /generate_code.")
             abort(403, description="reCAPTCHA verification failed.")
 
         problem_description = request.json["problem_description"]
         language = request.json["language"]
 
-        logging.info(f"Generating code for language: {language}")
+        logger.info("Generating code for language: %s", language)
         return get_generated_code(problem_description, language)
 
     except Exception as e:
-        logging.error(f"Error in /generate_code endpoint: {e}")
+        logger.error("Error in /generate_code endpoint: %s", e)
         return jsonify({"error": str(e)}), 400
 
 
 @app.route("/get-output", methods=["POST"])
 def get_output_api():
-    logging.info("Received request for /get-output")
+    logger.info("Received request for /get-output")
 
     try:
         token = request.headers.get("X-Recaptcha-Token")
 
         if not is_human(token):
-            logging.warning("reCAPTCHA verification failed for /get-output.")
+            logger.warning("reCAPTCHA verification failed for /get-output.")
             abort(403, description="reCAPTCHA verification failed.")
 
         code = request.json["code"]
         language = request.json["language"]
 
         if not code or not language:
-            logging.warning("Missing code or language in /get-output request.")
+            logger.warning("Missing code or language in /get-output request.")
             return jsonify({"error": "Missing code or language"}), 400
 
         if len(code.encode("utf-8")) > MAX_SIZE:
-            logging.warning("Code size exceeds maximum allowed limit.")
+            logger.warning("Code size exceeds maximum allowed limit.")
             return jsonify({"error": "Code size exceeds the 0.5 MB limit"}), 413
-        
+
         code = f"\n\n{code}\n\n"
 
-        logging.info(f"Getting output for language: {language}")
+        logger.info("Getting output for language: %s", language)
 
         return get_output(code, language)
 
     except Exception as e:
-        logging.error(f"Error in /get-output endpoint: {e}")
+        logger.error("Error in /get-output endpoint: %s", e)
         return jsonify({"error": str(e)}), 400
 
 
 @app.route("/refactor_code", methods=["POST"])
 @token_required
 def refactor_code_api():
-    logging.info("Received request for /refactor_code")
+    logger.info("Received request for /refactor_code")
 
     try:
         token = request.headers.get("X-Recaptcha-Token")
 
         if not is_human(token):
-            logging.warning("reCAPTCHA verification failed for /refactor_code.")
+            logger.warning("reCAPTCHA verification failed for /refactor_code.")
             abort(403, description="reCAPTCHA verification failed.")
 
         code = request.json["code"]
@@ -312,14 +313,14 @@ def refactor_code_api():
         output = request.json["output"]
 
         if not code or not language:
-            logging.warning("Missing code or language in /refactor_code request.")
+            logger.warning("Missing code or language in /refactor_code request.")
             return jsonify({"error": "Missing code or language"}), 400
 
         if len(code.encode("utf-8")) > MAX_SIZE:
-            logging.warning("Code size exceeds maximum allowed limit.")
+            logger.warning("Code size exceeds maximum allowed limit.")
             return jsonify({"error": "Code size exceeds the 0.5 MB limit"}), 413
 
-        logging.info(f"Refactoring code for language: {language}")
+        logger.info("Refactoring code for language: %s", language)
 
         if problem_description:
             return refactor_code(code, language, output, problem_description)
@@ -327,18 +328,18 @@ def refactor_code_api():
             return refactor_code(code, language, output)
 
     except Exception as e:
-        logging.error(f"Error in /refactor_code endpoint: {e}")
+        logger.error("Error in /refactor_code endpoint: %s", e)
         return jsonify({"error": str(e)}), 400
 
 
 @app.route("/improve-prompt", methods=["POST"])
 @token_required
 def improve_prompt():
-    logging.info("Received request for /improve-prompt")
+    logger.info("Received request for /improve-prompt")
     token = request.headers.get("X-Recaptcha-Token")
 
     if not is_human(token):
-        logging.warning("reCAPTCHA verification failed for /improve-prompt.")
+        logger.warning("reCAPTCHA verification failed for /improve-prompt.")
         abort(403, description="reCAPTCHA verification failed.")
 
     data = request.get_json()
@@ -370,29 +371,27 @@ def improve_prompt():
         is_valid, parsed = validate_json(gemini_output)
 
         if not is_valid:
-            logging.error("Invalid JSON response from Gemini for prompt improvement.")
+            logger.error("Invalid JSON response from Gemini for prompt improvement.")
             return jsonify({"error": "Invalid prompt format"}), 400
 
-        logging.info(f"Successfully improved prompts for topic")
+        logger.info("Successfully improved prompts for topic")
 
         return jsonify({"prompts": parsed})
 
     except Exception as e:
-        logging.error(f"Error in /improve-prompt endpoint: {e}")
+        logger.error("Error in /improve-prompt endpoint: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/htmlcssjsgenerate-code", methods=["POST"])
 @token_required
 def htmlcssjs_generate_stream():
-    logging.info("Received request for /htmlcssjsgenerate-code")
+    logger.info("Received request for /htmlcssjsgenerate-code")
 
     try:
         token = request.headers.get("X-Recaptcha-Token")
         if not is_human(token):
-            logging.warning(
-                "reCAPTCHA verification failed for /htmlcssjsgenerate-code."
-            )
+            logger.warning("reCAPTCHA verification failed for /htmlcssjsgenerate-code.")
             abort(403, description="reCAPTCHA verification failed.")
 
         data = request.get_json()
@@ -407,7 +406,7 @@ def htmlcssjs_generate_stream():
         if code_type not in {"html", "css", "js"}:
             return jsonify({"error": "Invalid or missing 'type' parameter"}), 400
 
-        logging.info(f"Generating {code_type} code")
+        logger.info("Generating %s code", code_type)
 
         generators = {
             "html": lambda: generate_html(prompt),
@@ -418,21 +417,19 @@ def htmlcssjs_generate_stream():
         return generators[code_type]()
 
     except Exception as e:
-        logging.error(f"Error in /htmlcssjsgenerate-code endpoint: {e}")
+        logger.error("Error in /htmlcssjsgenerate-code endpoint: %s", e)
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
 
 @app.route("/htmlcssjsrefactor-code", methods=["POST"])
 @token_required
 def htmlcssjs_refactor():
-    logging.info("Received request for /htmlcssjsrefactor-code")
+    logger.info("Received request for /htmlcssjsrefactor-code")
     try:
         token = request.headers.get("X-Recaptcha-Token")
 
         if not is_human(token):
-            logging.warning(
-                "reCAPTCHA verification failed for /htmlcssjsrefactor-code."
-            )
+            logger.warning("reCAPTCHA verification failed for /htmlcssjsrefactor-code.")
             abort(403, description="reCAPTCHA verification failed.")
 
         data = request.get_json()
@@ -442,15 +439,15 @@ def htmlcssjs_refactor():
         js_content = data.get("js") if len(data.get("js", "")) > 0 else ""
 
         if len(html_content.encode("utf-8")) > MAX_SIZE:
-            logging.warning("HTML content exceeds 0.5 MB limit.")
+            logger.warning("HTML content exceeds 0.5 MB limit.")
             return jsonify({"error": "HTML content exceeds the 0.5 MB limit."}), 413
 
         if len(css_content.encode("utf-8")) > MAX_SIZE:
-            logging.warning("CSS content exceeds 0.5 MB limit.")
+            logger.warning("CSS content exceeds 0.5 MB limit.")
             return jsonify({"error": "CSS content exceeds the 0.5 MB limit."}), 413
 
         if len(js_content.encode("utf-8")) > MAX_SIZE:
-            logging.warning("JS content exceeds 0.5 MB limit.")
+            logger.warning("JS content exceeds 0.5 MB limit.")
             return jsonify({"error": "JS content exceeds the 0.5 MB limit."}), 413
 
         code_type = data.get("type")
@@ -463,7 +460,7 @@ def htmlcssjs_refactor():
         if not code_type:
             return jsonify({"error": "Type is required."}), 400
 
-        logging.info(f"Refactoring htmlcssjs code for type: {code_type}")
+        logger.info("Refactoring htmlcssjs code for type: %s", code_type)
 
         if code_type == "html" and html_content and problem_description:
             html_content_refactored = refactor_code_html_css_js(
@@ -627,7 +624,7 @@ def htmlcssjs_refactor():
             )
 
     except Exception as e:
-        logging.error(f"Error in /htmlcssjsrefactor-code endpoint: {e}")
+        logger.error("Error in /htmlcssjsrefactor-code endpoint: %s", e)
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
 
@@ -0,0 +1,58 @@
+# Loaded automatically by `gunicorn app:app` from this folder. See serving.py
+# for the environment variables that size the workers.
+import os
+from serving import (
+    GUNICORN_WORKER_CLASSES,
+    WEB_BIND,
+    WEB_GRACEFUL_TIMEOUT,
+    WEB_KEEPALIVE,
+    WEB_MAX_REQUESTS,
+    WEB_TIMEOUT,
+    WEB_WORKER_CLASS,
+    log_plan,
+    worker_plan,
+)
+
+if WEB_WORKER_CLASS not in GUNICORN_WORKER_CLASSES:
+    raise ValueError(
+        f"WEB_WORKER_CLASS must be one of {', '.join(GUNICORN_WORKER_CLASSES)}"
+    )
+
+plan = worker_plan(WEB_WORKER_CLASS)
+
+if plan["worker_class"] == "gevent":
+    # The app is imported before forking, so its locks and sockets have to be
+    # created after patching.
+    try:
+        from gevent import monkey
+    except ImportError as e:
+        raise ImportError(
+            "WEB_WORKER_CLASS=gevent needs the optional gevent package: "
+            "pip install gevent"
+        ) from e
+
+    monkey.patch_all()
+
+bind = WEB_BIND
+worker_class = GUNICORN_WORKER_CLASSES[plan["worker_class"]]
+workers = plan["workers"]
+threads = plan["threads"]
+worker_connections = plan["worker_connections"]
+
+# Gemini clients are created per request, so the app can be imported once in
+# the master.
+preload_app = True
+
+timeout = WEB_TIMEOUT
+# On SIGHUP, SIGTERM or an upgrade, old workers get this long to finish the
+# generation streams they are serving before they are killed.
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+keepalive = WEB_KEEPALIVE
+max_requests = WEB_MAX_REQUESTS
+max_requests_jitter = WEB_MAX_REQUESTS // 10
+pidfile = os.getenv("WEB_PIDFILE")
+accesslog = os.getenv("WEB_ACCESS_LOG")
+
+
+def when_ready(server):
+    log_plan(plan)
@@ -0,0 +1,157 @@
+# Kept identical in Backend/TempFile and Backend/Genai.
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Comma-separated logger=rate pairs, e.g. "app=0.1,utils=0.5".
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+RESERVED_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {
+    "message",
+    "asctime",
+    "taskName",
+}
+
+
+def parse_sample_rates(value):
+    rates = {}
+    for part in value.split(","):
+        name, _, rate = part.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(record.name, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self._dropped_lock = threading.Lock()
+        self.dropped = 0
+        self._unreported = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the request thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+
+        if self._unreported:
+            with self._dropped_lock:
+                unreported, self._unreported = self._unreported, 0
+            if unreported:
+                self._report_dropped(unreported)
+
+    def _report_dropped(self, count):
+        record = logging.LogRecord(
+            __name__,
+            logging.WARNING,
+            __file__,
+            0,
+            "Dropped %d log records because the log queue was full.",
+            (count,),
+            None,
+        )
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self._unreported += count
+
+
+_queue_handler = None
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def start_listener():
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, stream_handler)
+    _listener.start()
+
+
+def stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def restart_listener_after_fork():
+    # The listener thread does not survive fork; records queued by the parent
+    # are discarded with it.
+    if _queue_handler is not None:
+        _queue_handler._dropped_lock = threading.Lock()
+        _queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+        start_listener()
+
+
+def setup_logging():
+    global _queue_handler
+    with _setup_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        start_listener()
+        atexit.register(stop_listener)
+        os.register_at_fork(after_in_child=restart_listener_after_fork)
+        return _queue_handler
+
+
+def dropped_log_records():
+    return _queue_handler.dropped if _queue_handler is not None else 0
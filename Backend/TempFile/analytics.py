@@ -0,0 +1,358 @@
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+from datetime import datetime, timezone
+import redis
+import utils
+from codec import BLOB_DIGEST_SIZE, CODEC_VERSION, unpack_header
+from shares import VALID_EXPIRY_TIMES, parse_share_id
+from sharding import share_id_for_key
+from store import (
+    blob_key,
+    blob_refs_key,
+    chunks_key,
+    meta_key,
+    render_key,
+    revisions_key,
+    scan_shares,
+)
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LANGUAGE = "unknown"
+NO_EXPIRY = "none"
+SIZE_BANDS = ((0.0, 0.5), (0.5, 0.9), (0.9, 0.99), (0.99, 1.0))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def batches(keys, size):
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Shares stored before the metadata hash existed only have their language in
+# legacy ids.
+def share_language(key, language):
+    if language:
+        return language.decode("utf-8")
+    try:
+        return parse_share_id(share_id_for_key(key))[0] or UNKNOWN_LANGUAGE
+    except ValueError:
+        return UNKNOWN_LANGUAGE
+
+
+# Shares only keep their expiry time, so they are grouped by the smallest
+# upload expiry that covers what they have left.
+def expiry_bucket(pttl):
+    if pttl < 0:
+        return NO_EXPIRY
+    for minutes in VALID_EXPIRY_TIMES:
+        if pttl <= minutes * 60 * 1000:
+            return f"<={minutes}m"
+    return f">{VALID_EXPIRY_TIMES[-1]}m"
+
+
+def share_keys(key):
+    return [key, chunks_key(key), meta_key(key), render_key(key), revisions_key(key)]
+
+
+def key_sizes(client, keys, samples, method):
+    """Returns the memory held by each key and the way it was measured.
+
+    Servers without MEMORY USAGE (older Redis, fakeredis) fall back to the
+    length of DUMP, which undercounts allocator and key overhead.
+    """
+    if method != "dump":
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key, samples=samples)
+        try:
+            return [size or 0 for size in pipe.execute()], "memory_usage"
+        except redis.ResponseError:
+            logger.warning("MEMORY USAGE is not available, measuring with DUMP.")
+
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.dump(key)
+    return [len(dumped) if dumped else 0 for dumped in pipe.execute()], "dump"
+
+
+# Only the fixed-size header is read. Version 1 records keep the digest in
+# their body and are counted without their blob.
+def blob_digest(prefix):
+    if prefix[:1] != bytes([CODEC_VERSION]):
+        return None
+    return unpack_header(prefix)[0].get("b")
+
+
+# A blob is shared by every share with the same code, so each of them is
+# charged an equal part of it.
+def blob_shares(client, digests, blobs, samples, method):
+    missing = [digest for digest in digests if digest not in blobs]
+    if missing:
+        keys = [
+            key
+            for digest in missing
+            for key in (blob_key(digest), blob_refs_key(digest))
+        ]
+        sizes, method = key_sizes(client, keys, samples, method)
+        refs = client.mget([blob_refs_key(digest) for digest in missing])
+        for index, (digest, count) in enumerate(zip(missing, refs)):
+            blobs[digest] = (sizes[2 * index] + sizes[2 * index + 1]) / max(
+                int(count or 1), 1
+            )
+    return method
+
+
+def measure_batch(client, keys, samples, method, blobs):
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.pttl(key)
+        pipe.hget(meta_key(key), "language")
+        pipe.getrange(key, 0, 1 + BLOB_DIGEST_SIZE)
+    results = pipe.execute()
+
+    related = [related_key for key in keys for related_key in share_keys(key)]
+    sizes, method = key_sizes(client, related, samples, method)
+    width = len(related) // len(keys)
+
+    digests = [blob_digest(prefix) for prefix in results[2::3]]
+    method = blob_shares(
+        client, {digest for digest in digests if digest}, blobs, samples, method
+    )
+
+    shares = []
+    for index, key in enumerate(keys):
+        pttl, language = results[3 * index], results[3 * index + 1]
+        if pttl == -2:
+            continue
+        size = sum(sizes[width * index : width * (index + 1)])
+        if digests[index]:
+            size += blobs[digests[index]]
+        shares.append((share_language(key, language), pttl, size))
+    return shares, method
+
+
+def collect(clients, batch_size=500, samples=5, sample=1.0, pause=0.0, seed=None):
+    rng = random.Random(seed)
+    shares = []
+    scanned = 0
+    method = None
+    for name, client in clients.items():
+        blobs = {}
+        for batch in batches(scan_shares(client, batch_size), batch_size):
+            scanned += len(batch)
+            if sample < 1.0:
+                batch = [key for key in batch if rng.random() < sample]
+            if batch:
+                measured, method = measure_batch(client, batch, samples, method, blobs)
+                shares += measured
+            if pause:
+                time.sleep(pause)
+        logger.info("Scanned %s share keys so far, finishing %s.", scanned, name)
+    return shares, scanned, method
+
+
+def group(shares, scale):
+    return {
+        "shares": round(len(shares) * scale),
+        "bytes": round(sum(size for _, _, size in shares) * scale),
+    }
+
+
+def summarize(shares, scanned, method, sample=1.0, horizon=3600):
+    scale = 1 / sample
+    sizes = sorted(size for _, _, size in shares)
+
+    by_language = {}
+    for share in shares:
+        by_language.setdefault(share[0], []).append(share)
+    languages = {
+        language: group(members, scale)
+        for language, members in sorted(
+            by_language.items(),
+            key=lambda item: sum(size for _, _, size in item[1]),
+            reverse=True,
+        )
+    }
+
+    labels = [f"<={minutes}m" for minutes in VALID_EXPIRY_TIMES]
+    labels += [f">{VALID_EXPIRY_TIMES[-1]}m", NO_EXPIRY]
+    expiry = {
+        label: group(
+            [share for share in shares if expiry_bucket(share[1]) == label], scale
+        )
+        for label in labels
+    }
+
+    bands = {}
+    for low, high in SIZE_BANDS:
+        start = math.floor(low * len(sizes))
+        stop = math.floor(high * len(sizes))
+        band = sizes[start:stop]
+        bands[f"p{low * 100:g}-p{high * 100:g}"] = {
+            "shares": round(len(band) * scale),
+            "bytes": round(sum(band) * scale),
+            "max_bytes": band[-1] if band else None,
+        }
+
+    expiring = [share for share in shares if 0 <= share[1] <= horizon * 1000]
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "method": method,
+        "sample": sample,
+        "scanned": scanned,
+        "measured": len(shares),
+        **group(shares, scale),
+        "languages": languages,
+        "expiry": expiry,
+        "size_percentiles": {
+            "p50": percentile(sizes, 0.50),
+            "p90": percentile(sizes, 0.90),
+            "p99": percentile(sizes, 0.99),
+            "max": sizes[-1] if sizes else None,
+        },
+        "size_bands": bands,
+        "expiring": {"within_s": horizon, **group(expiring, scale)},
+    }
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def print_table(title, rows, total):
+    print(f"\n{title:<16}{'shares':>10}{'bytes':>14}{'share':>9}")
+    for name, row in rows.items():
+        part = row["bytes"] / total * 100 if total else 0
+        print(
+            f"{name:<16}{row['shares']:>10}"
+            f"{format_bytes(row['bytes']):>14}{part:>8.1f}%"
+        )
+
+
+def print_report(report):
+    print(
+        f"{report['shares']} shares using {format_bytes(report['bytes'])} "
+        f"({report['method'] or 'no keys'}, sample {report['sample']:g}, "
+        f"{report['measured']} of {report['scanned']} keys measured)"
+    )
+    print_table("language", report["languages"], report["bytes"])
+    print_table("expires within", report["expiry"], report["bytes"])
+    print_table("size band", report["size_bands"], report["bytes"])
+
+    percentiles = report["size_percentiles"]
+    print(
+        "\nper-share size: "
+        + ", ".join(
+            f"{name} {format_bytes(size) if size is not None else '-'}"
+            for name, size in percentiles.items()
+        )
+    )
+
+    expiring = report["expiring"]
+    print(
+        f"freed in the next {expiring['within_s']}s: "
+        f"{format_bytes(expiring['bytes'])} across {expiring['shares']} shares"
+    )
+
+
+def connect(redis_url=None):
+    if redis_url:
+        return {"default": redis.StrictRedis.from_url(redis_url)}
+
+    if utils.init_redis_pool() is None:
+        raise ValueError("Could not connect to Redis")
+    return {
+        name: redis.StrictRedis(connection_pool=pool)
+        for name, pool in utils.all_redis_pools()
+    }
+
+
+def fraction(value):
+    value = float(value)
+    if not 0 < value <= 1:
+        raise argparse.ArgumentTypeError("The sample must be in (0, 1]")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report how much Redis memory shares use and when it is freed."
+    )
+    parser.add_argument(
+        "--redis-url",
+        help="Scan this Redis server instead of the configured node(s)",
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="Seconds to sleep after each batch"
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=5,
+        help="Nested values MEMORY USAGE samples per key (0 measures all)",
+    )
+    parser.add_argument(
+        "--sample",
+        type=fraction,
+        default=1.0,
+        help="Fraction of share keys to measure; totals are scaled up",
+    )
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--horizon",
+        type=int,
+        default=3600,
+        help="Seconds ahead to count memory freed by expiring shares",
+    )
+    parser.add_argument("--json", action="store_true", help="Print JSON to stdout")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        shares, scanned, method = collect(
+            connect(args.redis_url),
+            args.batch_size,
+            args.samples,
+            args.sample,
+            args.pause,
+            args.seed,
+        )
+    except (ValueError, redis.RedisError) as e:
+        logger.error("Analytics failed: %s", e)
+        sys.exit(1)
+
+    report = summarize(shares, scanned, method, args.sample, args.horizon)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
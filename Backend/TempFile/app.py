@@ -1,27 +1,41 @@
 from flask import (
     Flask,
+    Response,
     abort,
     request,
     jsonify,
     render_template,
     redirect,
     url_for,
+    stream_with_context,
+    g,
 )
 from flask_cors import CORS
 import os
-import uuid
-import json
+import time
 import redis
 from utils import *
-from datetime import datetime, timedelta
+from shares import *
+from store import idempotency_key
+from storage import NodeUnavailable
+from cache import share_cache
+from codec import RenderedShare, share_document, share_etag
+from render import (
+    SHARE_RENDER_MAX_SIZE,
+    render_available,
+    render_css,
+    render_share_html,
+)
+from metrics import observe_request, count_error, observe_payload, metrics_payload
 from dotenv import load_dotenv
 import logging
+from structured_logging import setup_logging
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
-)
+setup_logging()
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
@@ -29,201 +43,883 @@ CORS(app)
 TEMP_FILE_URL = os.getenv("TEMP_FILE_URL")
 
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else None
+        observe_request(route, request.method, response.status_code, started)
+    return response
+
+
 @app.route("/", methods=["GET"])
 def index():
-    logging.info("Serving index page.")
+    logger.info("Serving index page.")
     return render_template("index.html")
 
 
+@app.route("/health/redis", methods=["GET"])
+def redis_health():
+    stats = get_redis_pool_stats()
+    return jsonify(stats), 200 if stats["healthy"] else 503
+
+
+@app.route("/health/cache", methods=["GET"])
+def cache_health():
+    return jsonify(share_cache.stats()), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = metrics_payload()
+    return body, 200, {"Content-Type": content_type}
+
+
 @app.route("/temp-file-upload", methods=["POST"])
 @token_required
 def upload_file():
-    logging.info("Received request to /temp-file-upload")
+    logger.info("Received request to /temp-file-upload")
     token = request.headers.get("X-Recaptcha-Token")
 
     if not is_human(token):
-        logging.warning("reCAPTCHA verification failed for upload request.")
+        logger.warning("reCAPTCHA verification failed for upload request.")
         abort(403, description="reCAPTCHA verification failed.")
 
-    redis_client = get_redis_connection()
-    if not redis_client:
-        logging.error("Could not connect to Redis.")
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
         return jsonify({"error": "Failed to connect to Redis"}), 503
 
     try:
         data = request.get_json()
 
-        if (
-            not data
-            or not data.get("code")
-            or not data.get("language")
-            or not data.get("title")
-            or not data.get("expiryTime")
-        ):
-            logging.warning("Upload request missing required fields.")
-            return (
-                jsonify(
-                    {"error": "Code, language, title, and expiry time are required"}
-                ),
-                400,
+        error, status = validate_upload(data)
+        if error:
+            logger.warning("Rejected upload request: %s", error)
+            return jsonify({"error": error}), status
+
+        admission = storage.take_tokens(request.user_data.get("userId"), 1)
+        if not admission["allowed"]:
+            logger.warning(
+                "Upload rejected by the %s rate limit.", admission["limited_by"]
             )
+            count_error(request.endpoint, "rate_limited")
+            body, status, headers = rate_limited_response(admission)
+            return jsonify(body), status, headers
+
+        idempotency_token = request.headers.get("Idempotency-Key")
+        idem_key = (
+            idempotency_key(request.user_data.get("userId"), idempotency_token)
+            if idempotency_token
+            else None
+        )
+
+        share = build_share(
+            data, new_file_id(idem_key), request.user_data.get("userId")
+        )
+        observe_payload(share)
+        existing, response = save_upload(storage, share, idem_key, TEMP_FILE_URL)
+        if existing:
+            logger.info("Returning existing share for idempotent retry.")
+            return jsonify(existing)
+
+        user_id = request.user_data.get("userId")
+        if user_id:
+            storage.index_shares(user_id, [share])
+
+        logger.info("Successfully created file %s", share["share_id"])
+
+        return jsonify(response)
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during file upload: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to store code in Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during file upload: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
 
-        valid_expiry_times = (10, 30, 60, 1440, 10080)
-        expiry_time_minutes = int(data["expiryTime"])
 
-        if expiry_time_minutes not in valid_expiry_times:
-            logging.warning(f"Invalid expiry time received: {expiry_time_minutes}")
+@app.route("/temp-file-upload/batch", methods=["POST"])
+@token_required
+def upload_files_batch():
+    logger.info("Received request to /temp-file-upload/batch")
+    token = request.headers.get("X-Recaptcha-Token")
+
+    if not is_human(token):
+        logger.warning("reCAPTCHA verification failed for batch upload request.")
+        abort(403, description="reCAPTCHA verification failed.")
+
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        items = request.get_json()
+
+        if not isinstance(items, list) or not items:
+            logger.warning("Batch upload request without a list of files.")
+            return jsonify({"error": "A non-empty array of files is required"}), 400
+
+        batch_limit = upload_batch_limit()
+        if len(items) > batch_limit:
+            logger.warning("Batch upload of %s files exceeds the limit.", len(items))
             return (
-                jsonify({"error": "Invalid expiry time. Please choose a valid value."}),
-                400,
+                jsonify({"error": f"A batch can contain at most {batch_limit} files"}),
+                413,
             )
 
-        code = data["code"]
-        language = data["language"]
-        title = data["title"]
+        results, shares = prepare_batch(items, request.user_data.get("userId"))
 
-        current_time = datetime.utcnow()
-        expiry_time = current_time + timedelta(minutes=expiry_time_minutes)
-        formatted_expiry_time = expiry_time.strftime("%Y-%m-%d %H:%M:%S UTC")
-
-        file_id = str(uuid.uuid4())
+        # Only the files that passed validation are charged for.
+        admission = storage.take_tokens(request.user_data.get("userId"), len(shares))
+        if not admission["allowed"]:
+            logger.warning(
+                "Batch upload rejected by the %s rate limit.", admission["limited_by"]
+            )
+            count_error(request.endpoint, "rate_limited")
+            body, status, headers = rate_limited_response(admission)
+            return jsonify(body), status, headers
 
-        file_data = {
-            "title": title,
-            "code": code,
-            "language": language,
-            "expiry_time": formatted_expiry_time,
-        }
+        for _, share in shares:
+            observe_payload(share)
+        outcomes = save_batch(storage, [share for _, share in shares]) if shares else []
+        results = finish_batch(results, shares, outcomes, TEMP_FILE_URL)
 
-        redis_client.set(
-            f"file:{language}-{file_id}:data",
-            json.dumps(file_data),
-            ex=expiry_time_minutes * 60,
-        )
+        user_id = request.user_data.get("userId")
+        indexed = stored_shares(shares, outcomes)
+        if user_id and indexed:
+            storage.index_shares(user_id, indexed)
 
-        file_url = f"{TEMP_FILE_URL}/file/{language}-{file_id}"
+        stored = sum(1 for result in results if "fileUrl" in result)
+        logger.info("Stored %s of %s files from batch upload", stored, len(items))
 
-        logging.info(f"Successfully created file {language}-{file_id}")
+        return jsonify({"results": results})
 
-        return jsonify(
-            {
-                "message": "Code uploaded successfully",
-                "fileUrl": file_url,
-                "expiry_time": formatted_expiry_time,
-            }
-        )
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
 
     except redis.RedisError as e:
-        logging.error(f"Redis error during file upload: {e}")
+        logger.error("Redis error during batch upload: %s", e)
+        count_error(request.endpoint, "redis")
         return jsonify({"error": "Failed to store code in Redis"}), 500
 
     except Exception as e:
-        logging.error(f"Unexpected error during file upload: {e}")
+        logger.error("Unexpected error during batch upload: %s", e)
+        count_error(request.endpoint, "unexpected")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-    finally:
-        redis_client.close()
-
 
 @app.route("/file/<shareId>", methods=["GET"])
 def get_file(shareId):
-    logging.info(f"Received request to get file: {shareId}")
-    redis_client = get_redis_connection()
-    if not redis_client:
-        logging.error("Could not connect to Redis.")
+    logger.info("Received request to get file: %s", shareId)
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        header_shareId = request.headers.get("X-File-ID")
+
+        if not header_shareId or header_shareId != shareId:
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
+            )
+            return redirect(url_for("index"))
+
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+
+        if request.if_none_match:
+            validator, _ = storage.load_share_etag(file_key)
+            if validator and request.if_none_match.contains_weak(validator.etag):
+                logger.info("File not modified: %s", file_key)
+                return (
+                    "",
+                    304,
+                    validator_headers(*validator, request.accept_encodings),
+                )
+
+        share, ttl = storage.load_share(file_key, language)
+
+        if ttl == -2:
+            logger.info("File not found for key: %s", file_key)
+            return jsonify({"error": "File not found"}), 404
+        elif ttl == -1 or ttl == 0:
+            logger.info("File has expired for key: %s", file_key)
+            return jsonify({"error": "File has expired"}), 410
+
+        if share:
+            validator = response_validator(share)
+            headers = validator_headers(*validator, request.accept_encodings)
+
+            if request.if_none_match.contains_weak(validator.etag):
+                logger.info("File not modified: %s", file_key)
+                return "", 304, headers
+
+            logger.info("Successfully retrieved file: %s", file_key)
+            if isinstance(share, RenderedShare):
+                body, headers = negotiate_body(share, request.accept_encodings)
+                return Response(body, mimetype="application/json", headers=headers)
+
+            body = storage.iter_share_body(file_key, share)
+            return Response(
+                stream_with_context(iter_share_json(share, body)),
+                mimetype="application/json",
+                headers=headers,
+            )
+
+        logger.warning("File data was None for key: %s", file_key)
+        return jsonify({"error": "File not found"}), 404
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during file retrieval: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve code from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during file retrieval: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/file/<shareId>/meta", methods=["GET"])
+def get_file_meta(shareId):
+    logger.info("Received request to get file metadata: %s", shareId)
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        header_shareId = request.headers.get("X-File-ID")
+
+        if not header_shareId or header_shareId != shareId:
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
+            )
+            return redirect(url_for("index"))
+
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        metadata, ttl = storage.load_share_meta(file_key, language)
+
+        body, status = share_response(metadata, ttl)
+        if status != 200:
+            logger.info("Metadata request for %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        headers = {"ETag": f'"{metadata["etag"]}"', "Cache-Control": "no-cache"}
+        if request.if_none_match.contains_weak(metadata["etag"]):
+            logger.info("File not modified: %s", file_key)
+            return "", 304, headers
+
+        logger.info("Successfully retrieved metadata: %s", file_key)
+        return jsonify(public_metadata(metadata)), 200, headers
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during metadata retrieval: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve metadata from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during metadata retrieval: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/highlight.css", methods=["GET"])
+def highlight_css():
+    if not render_available():
+        return jsonify({"error": "Rendering is not available"}), 501
+    return render_css(), 200, {"Content-Type": "text/css"}
+
+
+@app.route("/file/<shareId>/html", methods=["GET"])
+def get_file_html(shareId):
+    logger.info("Received request to get rendered file: %s", shareId)
+    if not render_available():
+        logger.error("Pygments is not installed, shares cannot be rendered.")
+        return jsonify({"error": "Rendering is not available"}), 501
+
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
         return jsonify({"error": "Failed to connect to Redis"}), 503
 
     try:
         header_shareId = request.headers.get("X-File-ID")
 
         if not header_shareId or header_shareId != shareId:
-            logging.warning(
-                f"Redirecting unauthorized access attempt for file: {shareId}"
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
             )
             return redirect(url_for("index"))
 
-        try:
-            language, file_id = shareId.split("-", 1)
-        except ValueError:
-            logging.warning(f"Invalid shareId format received: {shareId}")
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        html, _ = storage.load_rendered(file_key)
+        if html is None:
+            share, ttl = storage.load_share(file_key, language)
+            body, status = share_response(share, ttl)
+            if status != 200:
+                logger.info("Render request for %s returned %s", file_key, status)
+                return jsonify(body), status
+
+            file_data = share_document(share)
+            if share_size(file_data) > SHARE_RENDER_MAX_SIZE:
+                logger.info("File too large to render: %s", file_key)
+                return jsonify({"error": "File is too large to render"}), 413
+
+            if "chunks" in file_data:
+                code = b"".join(storage.iter_share_body(file_key, file_data)).decode(
+                    "utf-8"
+                )
+            else:
+                code = file_data["code"]
+            html = render_share_html(code, file_data["language"])
+            storage.save_rendered(file_key, html)
+            logger.info("Rendered file: %s", file_key)
+
+        return Response(
+            html, mimetype="text/html", headers={"Cache-Control": "no-cache"}
+        )
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during file rendering: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve code from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during file rendering: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/file/<shareId>/raw", methods=["GET"])
+def get_file_raw(shareId):
+    logger.info("Received request to get raw file: %s", shareId)
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        header_shareId = request.headers.get("X-File-ID")
+
+        if not header_shareId or header_shareId != shareId:
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
+            )
+            return redirect(url_for("index"))
+
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        share, ttl = storage.load_share(file_key, language)
+
+        body, status = share_response(share, ttl)
+        if status != 200:
+            logger.info("Raw file request for %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        file_data = share_document(share)
+
+        size = share_size(file_data)
+        byte_range = request.range.range_for_length(size) if request.range else None
+
+        if request.range and byte_range is None:
+            logger.info("Unsatisfiable range requested for %s", file_key)
+            return (
+                jsonify({"error": "Requested range not satisfiable"}),
+                416,
+                {"Content-Range": f"bytes */{size}"},
+            )
+
+        start, stop = byte_range or (0, size)
+        body = storage.iter_share_body(file_key, file_data, start, stop)
+        response = Response(
+            stream_with_context(body),
+            status=206 if byte_range else 200,
+            mimetype="text/plain",
+            headers={"Accept-Ranges": "bytes"},
+        )
+        response.headers["Content-Length"] = str(stop - start)
+        if byte_range:
+            response.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+        logger.info("Streaming bytes %s-%s of %s", start, stop, file_key)
+        return response
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during raw file retrieval: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve code from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during raw file retrieval: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/files/batch", methods=["POST"])
+def get_files_batch():
+    logger.info("Received request to /files/batch")
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        data = request.get_json(silent=True)
+        share_ids = data.get("shareIds") if isinstance(data, dict) else None
+
+        if (
+            not isinstance(share_ids, list)
+            or not share_ids
+            or not all(isinstance(share_id, str) for share_id in share_ids)
+        ):
+            logger.warning("Batch retrieval request without a list of shareIds.")
+            return jsonify({"error": "A non-empty array of shareIds is required"}), 400
+
+        if len(share_ids) > SHARE_BATCH_MAX_SIZE:
+            logger.warning(
+                "Batch retrieval of %s files exceeds the limit.", len(share_ids)
+            )
             return (
                 jsonify(
                     {
-                        "error": "Invalid 'shareId' format. It should be 'language-file_id'."
+                        "error": f"A batch can contain at most {SHARE_BATCH_MAX_SIZE} files"
                     }
                 ),
-                400,
+                413,
             )
 
-        file_key = f"file:{language}-{file_id}:data"
-        file_data = redis_client.get(file_key)
-        ttl = redis_client.ttl(file_key)
+        header_shareIds = request.headers.get("X-File-ID")
 
-        if ttl == -2:
-            logging.info(f"File not found for key: {file_key}")
-            return jsonify({"error": "File not found"}), 404
-        elif ttl == -1 or ttl == 0:
-            logging.info(f"File has expired for key: {file_key}")
-            return jsonify({"error": "File has expired"}), 410
+        if not header_shareIds or header_shareIds != ",".join(share_ids):
+            logger.warning("Redirecting unauthorized batch access attempt.")
+            return redirect(url_for("index"))
 
-        if file_data:
-            logging.info(f"Successfully retrieved file: {file_key}")
-            file_data = json.loads(file_data)
-            return jsonify(file_data), 200
+        lookups = [share_lookup(share_id) for share_id in share_ids]
+        loaded = iter(storage.load_shares([lookup for lookup in lookups if lookup]))
 
-        logging.warning(f"File data was None for key: {file_key}")
-        return jsonify({"error": "File not found"}), 404
+        logger.info("Retrieved batch of %s files", len(share_ids))
+
+        def stream():
+            for share_id, lookup in zip(share_ids, lookups):
+                line = batch_line(share_id, lookup, next(loaded) if lookup else None)
+                yield line + b"\n"
+
+        return Response(stream_with_context(stream()), mimetype="application/x-ndjson")
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during batch retrieval: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve code from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during batch retrieval: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/file/<shareId>/revisions", methods=["POST"])
+@token_required
+def create_revision(shareId):
+    logger.info("Received request to revise file: %s", shareId)
+    token = request.headers.get("X-Recaptcha-Token")
+
+    if not is_human(token):
+        logger.warning("reCAPTCHA verification failed for revision request.")
+        abort(403, description="reCAPTCHA verification failed.")
+
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        data = request.get_json()
+
+        error, status = validate_revision(data)
+        if error:
+            logger.warning("Rejected revision request: %s", error)
+            return jsonify({"error": error}), status
+
+        admission = storage.take_tokens(request.user_data.get("userId"), 1)
+        if not admission["allowed"]:
+            logger.warning(
+                "Revision rejected by the %s rate limit.", admission["limited_by"]
+            )
+            count_error(request.endpoint, "rate_limited")
+            body, status, headers = rate_limited_response(admission)
+            return jsonify(body), status, headers
+
+        file_key, language = lookup
+        metadata, ttl = storage.load_share_meta(file_key, language)
+        if metadata is None:
+            body, status = share_response(None, ttl)
+            logger.info("Revision of %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        if not owns_share(metadata, request.user_data.get("userId")):
+            logger.warning(
+                "Rejected revision of %s by a user who does not own it.", file_key
+            )
+            return jsonify({"error": "Only the owner of a file can revise it"}), 403
+
+        info, ttl = storage.save_revision(
+            file_key, language, data["code"], data.get("title")
+        )
+        if info is None:
+            body, status = share_response(None, ttl)
+            logger.info("Revision of %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        logger.info("Created revision %s of %s", info["revision"], file_key)
+        return jsonify(revision_response(shareId, info, TEMP_FILE_URL))
+
+    except RevisionTooLarge as e:
+        logger.warning("Rejected revision of %s: %s", shareId, e)
+        return jsonify({"error": str(e)}), 413
+
+    except RevisionConflict as e:
+        logger.warning("Rejected revision of %s: %s", shareId, e)
+        return jsonify({"error": str(e)}), 409
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during file revision: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to store code in Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during file revision: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/file/<shareId>/revisions", methods=["GET"])
+def list_file_revisions(shareId):
+    logger.info("Received request to list revisions: %s", shareId)
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        header_shareId = request.headers.get("X-File-ID")
+
+        if not header_shareId or header_shareId != shareId:
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
+            )
+            return redirect(url_for("index"))
+
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        metadata, ttl = storage.load_share_meta(file_key, language)
+        if metadata is not None:
+            infos, ttl = storage.list_revisions(file_key)
+
+        body, status = share_response(metadata, ttl)
+        if status != 200:
+            logger.info("Revision list for %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        logger.info("Listed %s revisions of %s", len(infos), file_key)
+        return jsonify(revision_list(shareId, metadata, infos, TEMP_FILE_URL))
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error while listing revisions: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to retrieve revisions from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error while listing revisions: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/file/<shareId>/revisions/<int:revision>", methods=["GET"])
+def get_file_revision(shareId, revision):
+    logger.info("Received request to get revision %s of file: %s", revision, shareId)
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        header_shareId = request.headers.get("X-File-ID")
+
+        if not header_shareId or header_shareId != shareId:
+            logger.warning(
+                "Redirecting unauthorized access attempt for file: %s", shareId
+            )
+            return redirect(url_for("index"))
+
+        lookup = share_lookup(shareId)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", shareId)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        loaded, ttl = storage.load_revision(file_key, language, revision)
+
+        if loaded is None and ttl > 0:
+            logger.info("Revision %s of %s not found", revision, file_key)
+            return jsonify({"error": "Revision not found"}), 404
+
+        body, status = share_response(loaded, ttl)
+        if status != 200:
+            logger.info("Revision %s of %s returned %s", revision, file_key, status)
+            return jsonify(body), status
+
+        document = revision_document(loaded)
+        etag = share_etag(document)
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+        if request.if_none_match.contains_weak(etag):
+            logger.info("Revision not modified: %s", file_key)
+            return "", 304, headers
+
+        logger.info("Successfully retrieved revision %s of %s", revision, file_key)
+        return jsonify(document), 200, headers
+
+    except RevisionTooLarge as e:
+        logger.warning("Revision %s of %s is unavailable: %s", revision, shareId, e)
+        return jsonify({"error": str(e)}), 413
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
 
     except redis.RedisError as e:
-        logging.error(f"Redis error during file retrieval: {e}")
+        logger.error("Redis error during revision retrieval: %s", e)
+        count_error(request.endpoint, "redis")
         return jsonify({"error": "Failed to retrieve code from Redis"}), 500
 
     except Exception as e:
-        logging.error(f"Unexpected error during file retrieval: {e}")
+        logger.error("Unexpected error during revision retrieval: %s", e)
+        count_error(request.endpoint, "unexpected")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-    finally:
-        redis_client.close()
+
+@app.route("/my-shares", methods=["GET"])
+@token_required
+def list_my_shares():
+    logger.info("Received request to /my-shares")
+    user_id = request.user_data.get("userId")
+    if not user_id:
+        logger.warning("Share listing requested with a token without a userId.")
+        return jsonify({"error": "Token does not identify a user"}), 400
+
+    cursor, limit, error = parse_page_request(request.args)
+    if error:
+        logger.warning("Rejected share listing request: %s", error)
+        return jsonify({"error": error}), 400
+
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        entries, next_cursor, total = storage.list_user_shares(user_id, cursor, limit)
+        logger.info("Listed %s of %s shares for user", len(entries), total)
+        return jsonify(user_shares_page(entries, next_cursor, total, TEMP_FILE_URL))
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error during share listing: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to list shares from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error during share listing: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route("/admin/rate-limits", methods=["GET"])
+@token_required
+@admin_required
+def rate_limits():
+    logger.info("Received request to /admin/rate-limits")
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    try:
+        user_id = request.args.get("userId")
+        # A cost of 0 reads the buckets without taking anything.
+        state = storage.take_tokens(user_id, 0)
+        buckets = state["buckets"]
+        if not user_id:
+            buckets.pop("user")
+        return jsonify({"userId": user_id, "buckets": buckets})
+
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
+    except redis.RedisError as e:
+        logger.error("Redis error while reading rate limits: %s", e)
+        count_error(request.endpoint, "redis")
+        return jsonify({"error": "Failed to read rate limits from Redis"}), 500
+
+    except Exception as e:
+        logger.error("Unexpected error while reading rate limits: %s", e)
+        count_error(request.endpoint, "unexpected")
+        return jsonify({"error": "An unexpected error occurred"}), 500
 
 
 @app.route("/file/<file_id>/delete", methods=["DELETE"])
 @token_required
 def delete_file(file_id):
-    logging.info(f"Received request to delete file: {file_id}")
+    logger.info("Received request to delete file: %s", file_id)
     token = request.headers.get("X-Recaptcha-Token")
 
     if not is_human(token):
-        logging.warning("reCAPTCHA verification failed for delete request.")
+        logger.warning("reCAPTCHA verification failed for delete request.")
         abort(403, description="reCAPTCHA verification failed.")
 
-    redis_client = get_redis_connection()
-    if not redis_client:
-        logging.error("Could not connect to Redis.")
+    storage = get_storage()
+    if not storage:
+        logger.error("Could not connect to Redis.")
         return jsonify({"error": "Failed to connect to Redis"}), 503
 
     try:
-        language, file_id_part = file_id.split("-", 1)
-        file_key = f"file:{language}-{file_id_part}:data"
+        lookup = share_lookup(file_id)
+        if lookup is None:
+            logger.warning("Invalid shareId format received: %s", file_id)
+            body, status = invalid_share_id_response()
+            return jsonify(body), status
+
+        file_key, language = lookup
+        metadata, ttl = storage.load_share_meta(file_key, language)
+        if metadata is None:
+            body, status = share_response(None, ttl)
+            logger.info("Delete of %s returned %s", file_key, status)
+            return jsonify(body), status
+
+        if not owns_share(metadata, request.user_data.get("userId")):
+            logger.warning(
+                "Rejected delete of %s by a user who does not own it.", file_key
+            )
+            return jsonify({"error": "Only the owner of a file can delete it"}), 403
 
-        if redis_client.exists(file_key):
-            redis_client.delete(file_key)
-            logging.info(f"Successfully deleted file: {file_key}")
+        if storage.delete_share(file_key):
+            storage.unindex_share(metadata["owner"], file_id)
+            logger.info("Successfully deleted file: %s", file_key)
             return jsonify({"message": "File deleted successfully"}), 200
         else:
-            logging.warning(f"Attempted to delete a non-existent file: {file_key}")
+            logger.warning("Attempted to delete a non-existent file: %s", file_key)
             return jsonify({"error": "File not found"}), 404
 
+    except NodeUnavailable as e:
+        logger.error("Redis node unavailable: %s", e)
+        count_error(request.endpoint, "unavailable")
+        return jsonify({"error": "Failed to connect to Redis"}), 503
+
     except redis.RedisError as e:
-        logging.error(f"Redis error during file deletion: {e}")
+        logger.error("Redis error during file deletion: %s", e)
+        count_error(request.endpoint, "redis")
         return jsonify({"error": "Failed to delete file from Redis"}), 500
 
     except Exception as e:
-        logging.error(f"Unexpected error during file deletion: {e}")
+        logger.error("Unexpected error during file deletion: %s", e)
+        count_error(request.endpoint, "unexpected")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
-    finally:
-        redis_client.close()
-
 
 if __name__ == "__main__":
+    init_storage()
     app.run(debug=False)
@@ -0,0 +1,284 @@
+import os
+import jwt
+import time
+import httpx
+import asyncio
+import logging
+import redis.asyncio as aioredis
+from functools import wraps
+from quart import request, jsonify
+from metrics import observe_recaptcha
+from storage import (
+    STORAGE_BACKEND,
+    AsyncRedisStorage,
+    AsyncSQLiteStorage,
+    AsyncShardedRedisStorage,
+    init_sqlite_storage,
+)
+from sharding import node_urls
+from utils import (
+    ADMIN_USER_IDS,
+    SECRET_KEY,
+    RECAPTCHA_SECRET_KEY,
+    REDIS_POOL_SIZE,
+    REDIS_POOL_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_POOL_SATURATION_WARNING,
+    pool_stats,
+    shard_ring,
+    previous_shard_ring,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedConnectionPool(aioredis.BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+
+    async def get_connection(self, *args, **kwargs):
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except aioredis.ConnectionError:
+            self.timeouts += 1
+            raise
+
+        self.in_use += 1
+        self.checkouts += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return connection
+
+    async def release(self, connection):
+        try:
+            await super().release(connection)
+        finally:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def stats(self):
+        created = len(self._available_connections) + len(self._in_use_connections)
+        return pool_stats(self, created)
+
+
+redis_pool = None
+redis_healthy = False
+redis_node_pools = {}
+redis_node_health = {}
+http_client = None
+_health_task = None
+
+
+async def check_node_health(name, pool):
+    healthy = redis_node_health.get(name, False)
+    try:
+        await aioredis.StrictRedis(connection_pool=pool).ping()
+        if not healthy:
+            logger.info("Successfully connected to Redis node %s.", name)
+        healthy = True
+    except aioredis.RedisError as e:
+        if healthy:
+            logger.error("Redis health check failed for node %s: %s", name, e)
+        healthy = False
+
+    stats = pool.stats()
+    if stats["saturation"] >= REDIS_POOL_SATURATION_WARNING:
+        logger.warning(
+            "Redis connection pool for node %s is close to saturation: %s", name, stats
+        )
+
+    redis_node_health[name] = healthy
+    return healthy
+
+
+async def check_redis_health():
+    global redis_healthy
+    pools = redis_node_pools.items() or [("default", redis_pool)]
+    healthy = [await check_node_health(name, pool) for name, pool in pools]
+    redis_healthy = all(healthy)
+    return redis_healthy
+
+
+# Sharded storage checks a node synchronously, so a failed node is only
+# marked healthy again by the health loop.
+def redis_node_healthy(name):
+    return redis_node_health.get(name, False)
+
+
+async def redis_health_loop():
+    while True:
+        await asyncio.sleep(REDIS_HEALTH_CHECK_INTERVAL)
+        try:
+            await check_redis_health()
+        except Exception as e:
+            logger.error("Unexpected error in Redis health check: %s", e)
+
+
+def create_redis_pool(url=None):
+    if url:
+        return TrackedConnectionPool.from_url(
+            url,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=REDIS_POOL_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            socket_keepalive=True,
+        )
+
+    return TrackedConnectionPool(
+        connection_class=aioredis.SSLConnection,
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        password=os.getenv("REDIS_PASSWORD"),
+        max_connections=REDIS_POOL_SIZE,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_keepalive=True,
+    )
+
+
+async def init_async_clients():
+    global redis_pool, redis_node_pools, http_client, _health_task
+    http_client = httpx.AsyncClient(timeout=50)
+    if STORAGE_BACKEND == "sqlite":
+        init_sqlite_storage()
+        return
+
+    redis_node_pools = {
+        name: create_redis_pool(url) for name, url in node_urls().items()
+    }
+    redis_pool = (
+        next(iter(redis_node_pools.values()))
+        if redis_node_pools
+        else create_redis_pool()
+    )
+    await check_redis_health()
+    _health_task = asyncio.create_task(redis_health_loop())
+
+
+async def close_async_clients():
+    if _health_task:
+        _health_task.cancel()
+    if http_client:
+        await http_client.aclose()
+    for pool in redis_node_pools.values() or [redis_pool]:
+        if pool:
+            await pool.disconnect()
+
+
+async def get_redis_connection():
+    if redis_pool is None:
+        return None
+
+    if not redis_healthy and not await check_redis_health():
+        return None
+
+    return aioredis.StrictRedis(connection_pool=redis_pool)
+
+
+async def get_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return AsyncSQLiteStorage(init_sqlite_storage())
+
+    if shard_ring is not None:
+        if not redis_node_pools:
+            return None
+        clients = {
+            name: aioredis.StrictRedis(connection_pool=pool)
+            for name, pool in redis_node_pools.items()
+        }
+        return AsyncShardedRedisStorage(
+            clients, shard_ring, previous_shard_ring, redis_node_healthy
+        )
+
+    redis_client = await get_redis_connection()
+    return AsyncRedisStorage(redis_client) if redis_client else None
+
+
+def get_redis_pool_stats():
+    if redis_pool is None:
+        return {"healthy": False}
+
+    stats = {"healthy": redis_healthy, **redis_pool.stats()}
+    if redis_node_pools:
+        stats["nodes"] = {
+            name: {"healthy": redis_node_health.get(name, False), **pool.stats()}
+            for name, pool in redis_node_pools.items()
+        }
+    return stats
+
+
+async def is_human(recaptcha_token):
+    started = time.perf_counter()
+    if not recaptcha_token or not RECAPTCHA_SECRET_KEY:
+        logger.warning("reCAPTCHA check failed: Token or secret key is missing.")
+        observe_recaptcha("missing", started)
+        return False
+
+    payload = {"secret": RECAPTCHA_SECRET_KEY, "response": recaptcha_token}
+
+    try:
+        response = await http_client.post(
+            "https://www.google.com/recaptcha/api/siteverify", data=payload
+        )
+        response.raise_for_status()
+        result = response.json()
+
+        if result.get("success") and result.get("score", 0) > 0.5:
+            logger.info(
+                "reCAPTCHA verification successful. Score: %s", result.get("score")
+            )
+            observe_recaptcha("passed", started)
+            return True
+        else:
+            logger.warning(
+                "reCAPTCHA verification failed. Score: %s, errors: %s",
+                result.get("score"),
+                result.get("error-codes"),
+            )
+            observe_recaptcha("failed", started)
+            return False
+
+    except httpx.HTTPError as e:
+        logger.error("reCAPTCHA request to Google failed: %s", e)
+        observe_recaptcha("error", started)
+        return False
+
+
+def token_required(f):
+    @wraps(f)
+    async def decorator(*args, **kwargs):
+        token = None
+        if "Authorization" in request.headers:
+            auth_header = request.headers["Authorization"]
+            if auth_header.startswith("Bearer "):
+                token = auth_header.split(" ")[1]
+
+        if not token:
+            logger.warning("Access attempt without an Authorization token.")
+            return jsonify({"message": "Token is missing!"}), 403
+
+        try:
+            decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS512"])
+            request.user_data = decoded
+            logger.info("Token successfully decoded.")
+        except jwt.InvalidTokenError as e:
+            logger.warning("Invalid token received: %s", e)
+            return jsonify({"message": "Invalid token!"}), 401
+
+        return await f(*args, **kwargs)
+
+    return decorator
+
+
+def admin_required(f):
+    @wraps(f)
+    async def decorator(*args, **kwargs):
+        if request.user_data.get("userId") not in ADMIN_USER_IDS:
+            logger.warning("Non-admin access attempt to an admin endpoint.")
+            return jsonify({"message": "Admin access required!"}), 403
+
+        return await f(*args, **kwargs)
+
+    return decorator
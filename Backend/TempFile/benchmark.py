@@ -0,0 +1,467 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import logging
+import argparse
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+LANGUAGES = ["python", "javascript", "java", "cpp", "go", "rust", "typescript", "sql"]
+
+CODE_LINES = [
+    "def handle(request):",
+    "    payload = request.get_json()",
+    "    for index, item in enumerate(payload['items']):",
+    "        if item is None:",
+    "            continue",
+    "        total += item['price'] * item['quantity']",
+    "    return {'total': total, 'count': len(payload['items'])}",
+    "const result = await fetch(url, { method: 'POST', body: JSON.stringify(data) });",
+    "for (int i = 0; i < n; i++) { sum += values[i]; }",
+    "SELECT id, title, created_at FROM shares WHERE expires_at > NOW();",
+    "// TODO: handle the error path properly",
+    "",
+]
+
+BENCHMARK_JWT_SECRET = "benchmark-secret"
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        operation, _, weight = part.partition("=")
+        operation = operation.strip()
+        if operation not in ("read", "write", "delete"):
+            raise argparse.ArgumentTypeError(f"Unknown operation '{operation}'")
+        mix[operation] = float(weight)
+
+    if sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("The mix needs at least one positive weight")
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load benchmark for the TempFile upload/get/delete routes."
+    )
+    parser.add_argument(
+        "--redis-url",
+        help="Run against this Redis server instead of an in-process fakeredis",
+    )
+    parser.add_argument(
+        "--sqlite",
+        metavar="PATH",
+        help="Run against the embedded SQLite storage at PATH instead of Redis",
+    )
+    parser.add_argument(
+        "--flush",
+        action="store_true",
+        help="Flush the --redis-url database before running (required if not empty)",
+    )
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("read=70,write=20,delete=10"),
+        help="Operation weights, e.g. read=70,write=20,delete=10",
+    )
+    parser.add_argument(
+        "--preload", type=int, default=500, help="Shares written before timing"
+    )
+    parser.add_argument(
+        "--size-median",
+        type=int,
+        default=2048,
+        help="Median code size in bytes (log-normal distribution)",
+    )
+    parser.add_argument(
+        "--size-sigma",
+        type=float,
+        default=1.2,
+        help="Spread of the log-normal code size distribution, 0 for fixed sizes",
+    )
+    parser.add_argument("--size-max", type=int, default=1024 * 1024)
+    parser.add_argument(
+        "--expiry", type=int, default=60, help="Expiry time in minutes for uploads"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--output",
+        help="Where to write the JSON results (default: derived from commit)",
+    )
+    return parser.parse_args(argv)
+
+
+def configure_environment():
+    os.environ.setdefault("JWT_SECRET", BENCHMARK_JWT_SECRET)
+    os.environ.setdefault("RECAPTCHA_SECRET_KEY", "benchmark")
+    os.environ.setdefault("TEMP_FILE_URL", "http://benchmark")
+    # Every write runs as one user, so the upload rate limiter would turn
+    # most of them into 429s.
+    os.environ["RATE_LIMIT_USER_RATE"] = "0"
+    os.environ["RATE_LIMIT_GLOBAL_RATE"] = "0"
+
+
+def connect_backend(args):
+    if args.sqlite:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+        os.environ["STORAGE_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = args.sqlite
+        return None, "sqlite"
+
+    import redis
+    import utils
+
+    if args.redis_url:
+        client = redis.StrictRedis.from_url(args.redis_url)
+        if client.dbsize() and not args.flush:
+            sys.exit(
+                f"Refusing to benchmark against a non-empty database at {args.redis_url}; "
+                "pass --flush to clear it first."
+            )
+        if args.flush:
+            client.flushdb()
+
+        utils.create_redis_pool = lambda: utils.TrackedConnectionPool.from_url(
+            args.redis_url,
+            max_connections=utils.REDIS_POOL_SIZE,
+            timeout=utils.REDIS_POOL_TIMEOUT,
+        )
+        return client, "redis"
+
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit(
+            "fakeredis[lua] is required without --redis-url: pip install fakeredis[lua]"
+        )
+
+    server = fakeredis.FakeServer()
+    utils.create_redis_pool = lambda: utils.TrackedConnectionPool(
+        connection_class=fakeredis.FakeConnection,
+        server=server,
+        max_connections=utils.REDIS_POOL_SIZE,
+        timeout=utils.REDIS_POOL_TIMEOUT,
+    )
+    return fakeredis.FakeStrictRedis(server=server), "fakeredis"
+
+
+def load_app():
+    import jwt
+    import app as tempfile_app
+
+    tempfile_app.is_human = lambda token: True
+    logging.getLogger().setLevel(logging.WARNING)
+    token = jwt.encode(
+        {"userId": "benchmark"}, os.environ["JWT_SECRET"], algorithm="HS512"
+    )
+    headers = {"Authorization": f"Bearer {token}", "X-Recaptcha-Token": "benchmark"}
+    return tempfile_app.app, headers
+
+
+def code_size(rng, args):
+    if args.size_sigma <= 0:
+        return args.size_median
+    size = rng.lognormvariate(math.log(args.size_median), args.size_sigma)
+    return max(16, min(int(size), args.size_max))
+
+
+def make_code(rng, size):
+    lines = []
+    length = 0
+    while length < size:
+        line = rng.choice(CODE_LINES)
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+class SharePool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = []
+
+    def add(self, share_id):
+        with self._lock:
+            self._ids.append(share_id)
+
+    def pick(self, rng):
+        with self._lock:
+            return rng.choice(self._ids) if self._ids else None
+
+    def take(self, rng):
+        with self._lock:
+            if not self._ids:
+                return None
+            index = rng.randrange(len(self._ids))
+            self._ids[index], self._ids[-1] = self._ids[-1], self._ids[index]
+            return self._ids.pop()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+
+def upload(client, headers, rng, args, pool):
+    size = code_size(rng, args)
+    response = client.post(
+        "/temp-file-upload",
+        json={
+            "title": f"benchmark {size}",
+            "code": make_code(rng, size),
+            "language": rng.choice(LANGUAGES),
+            "expiryTime": args.expiry,
+        },
+        headers=headers,
+    )
+    if response.status_code == 200:
+        pool.add(response.get_json()["fileUrl"].rsplit("/", 1)[1])
+    return response.status_code
+
+
+def run_operation(operation, client, headers, rng, args, pool):
+    if operation == "read":
+        share_id = pool.pick(rng)
+        if share_id is not None:
+            response = client.get(f"/file/{share_id}", headers={"X-File-ID": share_id})
+            response.get_data()
+            return operation, response.status_code
+    elif operation == "delete":
+        share_id = pool.take(rng)
+        if share_id is not None:
+            response = client.delete(f"/file/{share_id}/delete", headers=headers)
+            return operation, response.status_code
+
+    return "write", upload(client, headers, rng, args, pool)
+
+
+def worker(app, headers, args, pool, seed, count, samples):
+    rng = random.Random(seed)
+    client = app.test_client()
+    operations = list(args.mix)
+    weights = [args.mix[operation] for operation in operations]
+
+    for _ in range(count):
+        operation = rng.choices(operations, weights)[0]
+        started = time.perf_counter()
+        operation, status = run_operation(operation, client, headers, rng, args, pool)
+        samples.append((operation, time.perf_counter() - started, status))
+
+
+def is_error(status):
+    # Reads can race with deletes from other workers, so a 404 is expected.
+    # Rate-limited requests are counted on their own.
+    return status >= 400 and status not in (404, 429)
+
+
+def is_throttled(status):
+    return status == 429
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if is_error(status)),
+        "throttled": sum(1 for status in statuses if is_throttled(status)),
+        "req_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def key_size(client, key):
+    try:
+        return client.memory_usage(key) or 0, "memory_usage"
+    except Exception:
+        dumped = client.dump(key)
+        return len(dumped) if dumped else 0, "dump"
+
+
+def measure_memory(client):
+    total = 0
+    keys = 0
+    shares = 0
+    method = None
+    for key in client.scan_iter(count=1000):
+        size, method = key_size(client, key)
+        total += size
+        keys += 1
+        if (key.startswith(b"file:") and key.endswith(b":data")) or (
+            key.startswith(b"s:") and key.count(b":") == 1
+        ):
+            shares += 1
+
+    return {
+        "method": method,
+        "keys": keys,
+        "shares": shares,
+        "bytes": total,
+        "bytes_per_share": round(total / shares, 1) if shares else None,
+    }
+
+
+def measure_sqlite(path):
+    import storage
+
+    storage.init_sqlite_storage().connection().execute("PRAGMA wal_checkpoint")
+    shares = (
+        storage.init_sqlite_storage()
+        .connection()
+        .execute("SELECT COUNT(*) FROM shares")
+        .fetchone()[0]
+    )
+    total = sum(
+        os.path.getsize(path + suffix)
+        for suffix in ("", "-wal")
+        if os.path.exists(path + suffix)
+    )
+    return {
+        "method": "file_size",
+        "keys": shares,
+        "shares": shares,
+        "bytes": total,
+        "bytes_per_share": round(total / shares, 1) if shares else None,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    print(
+        f"{results['backend']} @ {results['commit'] or 'unknown'}: "
+        f"{results['concurrency']} workers, {results['total']['requests']} requests"
+    )
+    print(
+        f"{'operation':<10}{'requests':>10}{'errors':>8}{'429s':>8}{'req/s':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    rows = {**results["operations"], "total": results["total"]}
+    for name, row in rows.items():
+        print(
+            f"{name:<10}{row['requests']:>10}{row['errors']:>8}{row['throttled']:>8}"
+            f"{row['req_per_s'] or 0:>10}{row['p50_ms'] or 0:>10}"
+            f"{row['p95_ms'] or 0:>10}{row['p99_ms'] or 0:>10}"
+        )
+    memory = results["memory"]
+    print(
+        f"memory: {memory['bytes']} bytes in {memory['keys']} keys, "
+        f"{memory['bytes_per_share']} bytes per share ({memory['method']})"
+    )
+    if results["total"]["throttled"]:
+        print(
+            f"WARNING: {results['total']['throttled']} requests were rate limited, "
+            "so these numbers do not measure storage. Check RATE_LIMIT_* settings."
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_environment()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    redis_client, backend = connect_backend(args)
+    app, headers = load_app()
+    pool = SharePool()
+
+    preload_rng = random.Random(args.seed)
+    preload_client = app.test_client()
+    for _ in range(args.preload):
+        upload(preload_client, headers, preload_rng, args, pool)
+
+    samples = []
+    per_worker, remainder = divmod(args.requests, args.concurrency)
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(
+                app,
+                headers,
+                args,
+                pool,
+                args.seed + index + 1,
+                per_worker + (1 if index < remainder else 0),
+                samples,
+            ),
+        )
+        for index in range(args.concurrency)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    for operation in ("write", "read", "delete"):
+        latencies = [latency for name, latency, _ in samples if name == operation]
+        statuses = [status for name, _, status in samples if name == operation]
+        operations[operation] = summarize(latencies, statuses, elapsed)
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "backend": backend,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "mix": args.mix,
+        "payload": {
+            "median": args.size_median,
+            "sigma": args.size_sigma,
+            "max": args.size_max,
+        },
+        "preload": args.preload,
+        "seed": args.seed,
+        "elapsed_s": round(elapsed, 3),
+        "operations": operations,
+        "total": summarize(
+            [latency for _, latency, _ in samples],
+            [status for _, _, status in samples],
+            elapsed,
+        ),
+        "live_shares": len(pool),
+        "memory": (
+            measure_sqlite(args.sqlite) if args.sqlite else measure_memory(redis_client)
+        ),
+    }
+
+    output = args.output or f"benchmark-{results['commit'] or 'local'}-{backend}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print_report(results)
+    print(f"Results written to {output}")
+    if results["total"]["throttled"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import redis
+import redis.asyncio as aioredis
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+SHARE_CACHE_MAX_BYTES = int(os.getenv("SHARE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+SHARE_CACHE_ENTRY_OVERHEAD = 256
+SHARE_CACHE_MAX_GENERATIONS = 10000
+INVALIDATION_CHANNEL = "share:invalidate"
+
+
+class ShareCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # A read takes generation(key) before going to Redis, and set drops
+        # its result if key was invalidated since, so a read that overlaps a
+        # delete cannot cache the deleted share again.
+        self.epoch = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+
+            share, expires_at, size = entry
+            remaining = int(expires_at - time.monotonic())
+            if remaining <= 0:
+                self._remove(key)
+                self.misses += 1
+                return None, None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return share, remaining
+
+    def generation(self, key):
+        with self.lock:
+            return self.epoch, self.generations.get(key, 0)
+
+    def set(self, key, share, ttl, generation):
+        if ttl <= 0:
+            return
+
+        size = len(share.body) + SHARE_CACHE_ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if generation != (self.epoch, self.generations.get(key, 0)):
+                return
+
+            self._remove(key)
+            self.entries[key] = (share, time.monotonic() + ttl, size)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self._remove(key)
+            # Starting a new epoch stops every read in flight from caching,
+            # which keeps the counters from growing with every deleted key.
+            if len(self.generations) >= SHARE_CACHE_MAX_GENERATIONS:
+                self._new_epoch()
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self._new_epoch()
+
+    def _new_epoch(self):
+        self.epoch += 1
+        self.generations.clear()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+share_cache = ShareCache(SHARE_CACHE_MAX_BYTES)
+
+_listener_pid = None
+_listener_pools = set()
+_listener_lock = threading.Lock()
+
+
+def subscriber_client(redis_client):
+    """Returns a client with its own connections to the same server, so the
+    subscription does not hold one of the connections requests are served
+    from, nor count towards its pool's stats."""
+    pool = redis_client.connection_pool
+    pool_class = (
+        aioredis.ConnectionPool
+        if isinstance(pool, aioredis.ConnectionPool)
+        else redis.ConnectionPool
+    )
+    return type(redis_client)(
+        connection_pool=pool_class(
+            connection_class=pool.connection_class, **pool.connection_kwargs
+        )
+    )
+
+
+def listen_for_invalidations(redis_client):
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything deleted while we were not subscribed may still be cached.
+            share_cache.clear()
+            for message in pubsub.listen():
+                share_cache.invalidate(message["data"].decode("utf-8"))
+        except Exception as e:
+            logger.error("Share cache invalidation listener failed: %s", e)
+            share_cache.clear()
+            time.sleep(1)
+
+
+def start_invalidation_listener(redis_client):
+    global _listener_pid
+    pool_id = id(redis_client.connection_pool)
+    if _listener_pid == os.getpid() and pool_id in _listener_pools:
+        return
+
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            _listener_pid = os.getpid()
+            _listener_pools.clear()
+        if pool_id in _listener_pools:
+            return
+
+        _listener_pools.add(pool_id)
+        threading.Thread(
+            target=listen_for_invalidations,
+            args=(subscriber_client(redis_client),),
+            name="share-cache-invalidation",
+            daemon=True,
+        ).start()
+
+
+async def listen_for_invalidations_async(redis_client):
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            share_cache.clear()
+            async for message in pubsub.listen():
+                share_cache.invalidate(message["data"].decode("utf-8"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Share cache invalidation listener failed: %s", e)
+            share_cache.clear()
+            await asyncio.sleep(1)
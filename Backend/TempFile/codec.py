@@ -0,0 +1,437 @@
+import os
+import gzip
+import json
+import zlib
+import struct
+import hashlib
+import msgpack
+import logging
+from collections import namedtuple
+from datetime import datetime, timezone
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+CODEC_VERSION = 2
+
+COMPRESSION_NONE = 0
+COMPRESSION_ZLIB = 1
+COMPRESSION_ZSTD = 2
+# Stored in a format clients accept as a Content-Encoding, so documents can be
+# sent without decompressing them.
+COMPRESSION_GZIP = 3
+COMPRESSION_BROTLI = 4
+# A raw deflate segment that ends on a full flush, after its length and its
+# CRC-32 carried on from JSON_CODE_PREFIX. Blobs use it so the shared code
+# can be spliced into a gzip stream between the compressed JSON prefix and
+# the share's own fields.
+COMPRESSION_DEFLATE = 5
+
+# Version 2 headers set this flag on the compression byte when the record
+# points at a deduplicated blob, followed by the hex digest. Keeping the
+# digest outside the msgpack body lets Lua scripts resolve the blob key.
+BLOB_REF_FLAG = 0x80
+BLOB_DIGEST_SIZE = 64
+
+# Shares written with an ETag set this flag and store the tag right after
+# the blob digest (if any), so it can be read with GETRANGE alone.
+ETAG_FLAG = 0x40
+ETAG_SIZE = 32
+
+# Shares written with this flag store the JSON document served by
+# /file/<shareId> (keys sorted), so reads hand the bytes to the response
+# without decoding them. When the code lives in a blob, the record keeps
+# everything after the code and the blob holds the escaped code string.
+JSON_DOCUMENT_FLAG = 0x20
+JSON_CODE_PREFIX = b'{"code":"'
+COMPRESSION_MASK = 0x1F
+
+SHARE_COMPRESSION_THRESHOLD = int(os.getenv("SHARE_COMPRESSION_THRESHOLD", "1024"))
+SHARE_COMPRESSION_LEVEL = int(os.getenv("SHARE_COMPRESSION_LEVEL", "3"))
+SHARE_CONTENT_ENCODING = os.getenv("SHARE_CONTENT_ENCODING", "gzip")
+SHARE_CONTENT_ENCODING_LEVEL = int(os.getenv("SHARE_CONTENT_ENCODING_LEVEL", "6"))
+
+CONTENT_ENCODINGS = {COMPRESSION_GZIP: "gzip", COMPRESSION_BROTLI: "br"}
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+SEGMENT_HEADER = struct.Struct("<II")
+
+EXPIRY_FORMAT = "%Y-%m-%d %H:%M:%S UTC"
+
+# body is sent as-is with Content-Encoding: encoding (None for plain JSON).
+RenderedShare = namedtuple(
+    "RenderedShare", ["body", "etag", "encoding"], defaults=[None]
+)
+# What a conditional GET needs to answer like the full response would.
+ShareValidator = namedtuple("ShareValidator", ["etag", "encoding"])
+
+
+def dumps_json(value):
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def format_expiry(expires_at):
+    return datetime.fromtimestamp(expires_at, timezone.utc).strftime(EXPIRY_FORMAT)
+
+
+def deflate(payload, final=True):
+    compressor = zlib.compressobj(SHARE_CONTENT_ENCODING_LEVEL, zlib.DEFLATED, -15)
+    flush = zlib.Z_FINISH if final else zlib.Z_FULL_FLUSH
+    return compressor.compress(payload) + compressor.flush(flush)
+
+
+def deflate_segment(payload, crc=0):
+    header = SEGMENT_HEADER.pack(zlib.crc32(payload, crc), len(payload))
+    return header + deflate(payload, final=False)
+
+
+JSON_CODE_PREFIX_CRC = zlib.crc32(JSON_CODE_PREFIX)
+JSON_CODE_PREFIX_SEGMENT = deflate(JSON_CODE_PREFIX, final=False)
+
+
+def compress(payload, method=None):
+    if len(payload) < SHARE_COMPRESSION_THRESHOLD:
+        return COMPRESSION_NONE, payload
+
+    if method == "segment":
+        return COMPRESSION_DEFLATE, deflate_segment(payload, JSON_CODE_PREFIX_CRC)
+    if method == "content":
+        if SHARE_CONTENT_ENCODING == "br" and brotli is not None:
+            return COMPRESSION_BROTLI, brotli.compress(
+                payload, quality=SHARE_CONTENT_ENCODING_LEVEL
+            )
+        if SHARE_CONTENT_ENCODING in ("gzip", "br"):
+            return COMPRESSION_GZIP, gzip.compress(
+                payload, SHARE_CONTENT_ENCODING_LEVEL, mtime=0
+            )
+
+    if zstandard is not None:
+        compressor = zstandard.ZstdCompressor(level=SHARE_COMPRESSION_LEVEL)
+        return COMPRESSION_ZSTD, compressor.compress(payload)
+
+    return COMPRESSION_ZLIB, zlib.compress(payload, SHARE_COMPRESSION_LEVEL)
+
+
+def decompress(compression, payload):
+    if compression == COMPRESSION_NONE:
+        return payload
+    if compression == COMPRESSION_ZLIB:
+        return zlib.decompress(payload)
+    if compression == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ValueError("Share is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(payload)
+    if compression == COMPRESSION_BROTLI:
+        if brotli is None:
+            raise ValueError("Share is brotli-compressed but brotli is not installed")
+        return brotli.decompress(payload)
+    if compression == COMPRESSION_DEFLATE:
+        return zlib.decompressobj(-15).decompress(payload[SEGMENT_HEADER.size :])
+
+    raise ValueError(f"Unknown share compression: {compression}")
+
+
+# The Content-Encoding a share is sent in, given the compression of its
+# record, or of its blob for blob-backed shares.
+def content_encoding(compression):
+    if compression == COMPRESSION_DEFLATE:
+        return "gzip"
+    encoding = CONTENT_ENCODINGS.get(compression)
+    if encoding == "br" and brotli is None:
+        return None
+    return encoding
+
+
+def share_etag(file_data):
+    digest = hashlib.sha256()
+    for field in ("title", "language", "expiry_time", "code"):
+        digest.update(file_data[field].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:ETAG_SIZE]
+
+
+def pack(payload, blob_hash=None, etag=None, json_document=False, method=None):
+    compression, payload = compress(payload, method)
+    flags = compression | (JSON_DOCUMENT_FLAG if json_document else 0)
+    header = b""
+
+    if blob_hash:
+        flags |= BLOB_REF_FLAG
+        header += blob_hash.encode("ascii")
+    if etag:
+        flags |= ETAG_FLAG
+        header += etag.encode("ascii")
+
+    return bytes((CODEC_VERSION, flags)) + header + payload
+
+
+def unpack_header(raw):
+    version, flags = raw[0], raw[1]
+    if version == 1:
+        return {}, flags, 2
+    if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported share codec version: {version}")
+
+    header = {}
+    offset = 2
+    if flags & BLOB_REF_FLAG:
+        header["b"] = raw[offset : offset + BLOB_DIGEST_SIZE].decode("ascii")
+        offset += BLOB_DIGEST_SIZE
+    if flags & ETAG_FLAG:
+        header["g"] = raw[offset : offset + ETAG_SIZE].decode("ascii")
+        offset += ETAG_SIZE
+    if flags & JSON_DOCUMENT_FLAG:
+        header["j"] = True
+
+    return header, flags & COMPRESSION_MASK, offset
+
+
+def unpack(raw):
+    header, compression, offset = unpack_header(raw)
+    return header, decompress(compression, raw[offset:])
+
+
+def render_share(file_data):
+    return dumps_json(
+        {key: file_data[key] for key in ("code", "expiry_time", "language", "title")}
+    )
+
+
+def encode_share(file_data, blob_hash=None, etag=None):
+    document = render_share(file_data if not blob_hash else {**file_data, "code": ""})
+    if blob_hash:
+        document = document[len(JSON_CODE_PREFIX) :]
+
+    etag = etag or share_etag(file_data)
+    # The fields after a blob's code are too small to be worth compressing
+    # for clients; they are deflated when the share is spliced together.
+    method = "content" if not blob_hash else None
+    return pack(document, blob_hash, etag, json_document=True, method=method)
+
+
+def encode_chunked_share(
+    file_data, expires_at, size, chunk_count, chunk_size, etag=None
+):
+    record = {
+        "t": file_data["title"],
+        "l": file_data["language"],
+        "e": int(expires_at),
+        "s": size,
+        "n": chunk_count,
+        "z": chunk_size,
+    }
+    etag = etag or share_etag(file_data)
+    return pack(msgpack.packb(record, use_bin_type=True), etag=etag)
+
+
+def encode_chunk(chunk):
+    return pack(chunk)
+
+
+def decode_chunk(raw):
+    return unpack(raw)[1]
+
+
+def encode_rendered(html):
+    return pack(html)
+
+
+def decode_rendered(raw):
+    return unpack(raw)[1]
+
+
+def decode_record(raw):
+    if raw[:1] == b"{":
+        return json.loads(raw)
+
+    header, payload = unpack(raw)
+    if header.get("j"):
+        record = loads_json(JSON_CODE_PREFIX + payload if "b" in header else payload)
+    else:
+        record = msgpack.unpackb(payload, raw=False)
+    record.update(header)
+    return record
+
+
+def share_header(raw):
+    if raw[:1] == b"{":
+        return {}
+    if raw[0] == 1:
+        # Version 1 records kept the blob digest inside the msgpack body.
+        return decode_record(raw)
+    return unpack_header(raw)[0]
+
+
+def share_blob_hash(raw):
+    return share_header(raw).get("b")
+
+
+def encode_blob(code):
+    return pack(dumps_json(code)[1:-1], json_document=True, method="segment")
+
+
+def decode_blob(raw):
+    header, payload = unpack(raw)
+    if header.get("j"):
+        return loads_json(b'"' + payload + b'"')
+    return payload.decode("utf-8")
+
+
+def blob_fragment(raw):
+    header, payload = unpack(raw)
+    if header.get("j"):
+        return payload
+    return dumps_json(payload.decode("utf-8"))[1:-1]
+
+
+def render_loaded(raw, language, blob=None):
+    if not share_header(raw).get("j"):
+        file_data = decode_share(raw, language, blob)
+        if "chunks" in file_data:
+            return file_data
+        return RenderedShare(render_share(file_data), share_etag(file_data))
+
+    header, compression, offset = unpack_header(raw)
+    if "b" not in header:
+        # Documents stored in a content encoding are served without decoding.
+        encoding = content_encoding(compression)
+        if encoding:
+            return RenderedShare(raw[offset:], header["g"], encoding)
+        return RenderedShare(decompress(compression, raw[offset:]), header["g"])
+
+    if blob is None:
+        raise ValueError(f"Missing blob {header['b']} for share")
+    tail = decompress(compression, raw[offset:])
+    _, blob_compression, blob_offset = unpack_header(blob)
+    if blob_compression == COMPRESSION_DEFLATE:
+        return RenderedShare(splice_gzip(blob[blob_offset:], tail), header["g"], "gzip")
+    return RenderedShare(JSON_CODE_PREFIX + blob_fragment(blob) + tail, header["g"])
+
+
+# Joins the precompressed prefix, the blob's deflate segment and the share's
+# freshly deflated fields into one gzip member (the technique of zlib's
+# gzjoin), so shared code is compressed once per blob, not per request.
+def splice_gzip(segment, tail):
+    crc, size = SEGMENT_HEADER.unpack_from(segment)
+    return b"".join(
+        (
+            GZIP_HEADER,
+            JSON_CODE_PREFIX_SEGMENT,
+            segment[SEGMENT_HEADER.size :],
+            deflate(tail),
+            struct.pack(
+                "<II",
+                zlib.crc32(tail, crc),
+                (len(JSON_CODE_PREFIX) + size + len(tail)) & 0xFFFFFFFF,
+            ),
+        )
+    )
+
+
+def decoded_body(share):
+    if share.encoding is None:
+        return share.body
+    return decompress(
+        COMPRESSION_GZIP if share.encoding == "gzip" else COMPRESSION_BROTLI,
+        share.body,
+    )
+
+
+def share_metadata(file_data, etag=None, owner=None):
+    metadata = {
+        "title": file_data["title"],
+        "language": file_data["language"],
+        "expiry_time": file_data["expiry_time"],
+        "size": len(file_data["code"].encode("utf-8")),
+        "etag": etag or share_etag(file_data),
+    }
+    if owner:
+        metadata["owner"] = owner
+    return metadata
+
+
+def loaded_share_metadata(share):
+    if isinstance(share, RenderedShare):
+        return share_metadata(loads_json(decoded_body(share)), share.etag)
+    return {
+        key: share[key] for key in ("title", "language", "expiry_time", "size", "etag")
+    }
+
+
+def encode_metadata(metadata):
+    return [str(value) for pair in metadata.items() for value in pair]
+
+
+def decode_metadata(fields):
+    metadata = {
+        fields[index].decode("utf-8"): fields[index + 1].decode("utf-8")
+        for index in range(0, len(fields), 2)
+    }
+    metadata["size"] = int(metadata["size"])
+    return metadata
+
+
+def share_document(share):
+    if isinstance(share, RenderedShare):
+        return loads_json(decoded_body(share))
+    return share
+
+
+def decode_share(raw, language, blob=None):
+    record = decode_record(raw)
+    if "expiry_time" in record:
+        if "b" in record:
+            if blob is None:
+                raise ValueError(f"Missing blob {record['b']} for share")
+            record["code"] = decode_blob(blob)
+        return {
+            key: record[key] for key in ("title", "code", "language", "expiry_time")
+        }
+
+    if "n" in record:
+        return {
+            "title": record["t"],
+            "language": record.get("l", language),
+            "expiry_time": format_expiry(record["e"]),
+            "size": record["s"],
+            "chunks": record["n"],
+            "chunk_size": record["z"],
+            "etag": record["g"],
+        }
+
+    if "b" in record:
+        if blob is None:
+            raise ValueError(f"Missing blob {record['b']} for share")
+        code = decode_blob(blob)
+    else:
+        code = record["c"]
+
+    return {
+        "title": record["t"],
+        "code": code,
+        "language": language,
+        "expiry_time": format_expiry(record["e"]),
+    }
@@ -0,0 +1,27 @@
+# Used with `hypercorn --config python:hypercorn_conf asgi_app:app`. See
+# serving.py for the environment variables that size the workers.
+from serving import (
+    WEB_BIND,
+    WEB_GRACEFUL_TIMEOUT,
+    WEB_KEEPALIVE,
+    WEB_MAX_REQUESTS,
+    log_plan,
+    worker_plan,
+)
+from structured_logging import setup_logging
+
+# Hypercorn loads this before the app, so logging is set up here for the
+# plan to be logged at all.
+setup_logging()
+plan = worker_plan("asgi")
+log_plan(plan)
+
+bind = [WEB_BIND]
+# Each worker runs one event loop, so every in-flight request shares a core.
+workers = plan["workers"]
+worker_class = "asyncio"
+# On SIGTERM, workers stop accepting and get this long to finish their
+# in-flight downloads and streams.
+graceful_timeout = WEB_GRACEFUL_TIMEOUT
+keep_alive_timeout = WEB_KEEPALIVE
+max_requests = WEB_MAX_REQUESTS or None
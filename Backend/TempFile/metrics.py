@@ -0,0 +1,101 @@
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+KNOWN_LANGUAGES = {
+    "c",
+    "cpp",
+    "csharp",
+    "dart",
+    "go",
+    "htmlcssjs",
+    "java",
+    "javascript",
+    "julia",
+    "kotlin",
+    "mongodb",
+    "perl",
+    "python",
+    "ruby",
+    "rust",
+    "scala",
+    "sql",
+    "swift",
+    "typescript",
+    "verilog",
+}
+
+REQUEST_LATENCY = Histogram(
+    "tempfile_request_duration_seconds",
+    "Time spent handling a request, up to the first byte of streamed bodies.",
+    ["route", "method", "status"],
+)
+REQUEST_ERRORS = Counter(
+    "tempfile_request_errors_total",
+    "Requests that ended in one of the route error handlers.",
+    ["route", "kind"],
+)
+REDIS_LATENCY = Histogram(
+    "tempfile_redis_operation_duration_seconds",
+    "Time spent on a Redis script or pipeline, by operation.",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+RECAPTCHA_LATENCY = Histogram(
+    "tempfile_recaptcha_duration_seconds",
+    "Time spent verifying a reCAPTCHA token, by outcome.",
+    ["outcome"],
+)
+PAYLOAD_SIZE = Histogram(
+    "tempfile_payload_bytes",
+    "Size of uploaded code, by language.",
+    ["language"],
+    buckets=tuple(2**exponent for exponent in range(8, 25, 2)),
+)
+
+
+def language_label(language):
+    return language if language in KNOWN_LANGUAGES else "other"
+
+
+def observe_request(route, method, status, started):
+    REQUEST_LATENCY.labels(route or "unmatched", method, status).observe(
+        time.perf_counter() - started
+    )
+
+
+def count_error(route, kind):
+    REQUEST_ERRORS.labels(route or "unmatched", kind).inc()
+
+
+def observe_redis(operation, started):
+    REDIS_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+def observe_recaptcha(outcome, started):
+    RECAPTCHA_LATENCY.labels(outcome).observe(time.perf_counter() - started)
+
+
+def observe_payload(share):
+    file_data = share["file_data"]
+    PAYLOAD_SIZE.labels(language_label(file_data["language"])).observe(
+        len(file_data["code"].encode("utf-8"))
+    )
+
+
+def metrics_payload():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,101 @@
+import os
+import math
+
+# Token buckets for uploads: every stored share takes one token from the
+# uploader's bucket and one from the global bucket. A rate of 0 turns the
+# bucket off.
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "0.5"))
+RATE_LIMIT_USER_BURST = int(os.getenv("RATE_LIMIT_USER_BURST", "100"))
+RATE_LIMIT_GLOBAL_RATE = float(os.getenv("RATE_LIMIT_GLOBAL_RATE", "100"))
+RATE_LIMIT_GLOBAL_BURST = int(os.getenv("RATE_LIMIT_GLOBAL_BURST", "1000"))
+
+GLOBAL_BUCKET = "global"
+ANONYMOUS_USER = "anonymous"
+BUCKET_NAMES = ("user", "global")
+
+
+def bucket_key(name):
+    return f"ratelimit:{name}"
+
+
+def user_bucket(user_id):
+    return f"user:{user_id or ANONYMOUS_USER}"
+
+
+def bucket_limits():
+    return (
+        (RATE_LIMIT_USER_RATE, RATE_LIMIT_USER_BURST),
+        (RATE_LIMIT_GLOBAL_RATE, RATE_LIMIT_GLOBAL_BURST),
+    )
+
+
+# The largest cost the enabled buckets can ever pay at once. Requests that
+# cost more have to be turned away before they reach the buckets.
+def max_cost():
+    return min((burst for rate, burst in bucket_limits() if rate > 0), default=None)
+
+
+# Time after which every enabled bucket is full again.
+def refill_ms():
+    return max(
+        (math.ceil(burst * 1000 / rate) for rate, burst in bucket_limits() if rate > 0),
+        default=0,
+    )
+
+
+def refill(tokens, updated_ms, now_ms, rate, burst):
+    if tokens is None:
+        return float(burst)
+    return min(float(burst), tokens + max(0, now_ms - updated_ms) * rate / 1000)
+
+
+# Mirrors the rate_limit script for backends that are not Redis.
+def admit(levels, cost):
+    wait, limited = 0, None
+    for index, (level, (rate, burst)) in enumerate(zip(levels, bucket_limits())):
+        if rate <= 0 or level is None:
+            continue
+        if level < cost:
+            bucket_wait = math.ceil((cost - level) * 1000 / rate)
+            if bucket_wait > wait:
+                wait, limited = bucket_wait, index
+    return limited is None, wait, limited
+
+
+def rate_limit_call(user_id, cost):
+    args = [cost]
+    for rate, burst in bucket_limits():
+        args += [rate, burst]
+    return (
+        "rate_limit",
+        [bucket_key(user_bucket(user_id)), bucket_key(GLOBAL_BUCKET)],
+        args,
+    )
+
+
+def rate_limit_result(allowed, wait_ms, limited, levels):
+    buckets = {
+        name: {
+            "tokens": round(level, 3) if level is not None else None,
+            "rate": rate,
+            "burst": burst,
+        }
+        for name, level, (rate, burst) in zip(BUCKET_NAMES, levels, bucket_limits())
+    }
+    return {
+        "allowed": bool(allowed),
+        "retry_after": max(1, math.ceil(wait_ms / 1000)) if not allowed else 0,
+        "limited_by": BUCKET_NAMES[limited] if limited is not None else None,
+        "buckets": buckets,
+    }
+
+
+def decode_rate_limit(result):
+    allowed, wait_ms, limited, user_level, global_level = result
+    levels = [
+        float(level) if level is not None else None
+        for level in (user_level, global_level)
+    ]
+    return rate_limit_result(
+        allowed, int(wait_ms), int(limited) - 1 if int(limited) else None, levels
+    )
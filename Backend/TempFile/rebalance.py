@@ -0,0 +1,139 @@
+import sys
+import math
+import time
+import logging
+import argparse
+import redis
+import utils
+from codec import share_blob_hash
+from scripts import run_script
+from sharding import build_rings
+from store import (
+    chunks_key,
+    meta_key,
+    blob_key,
+    blob_refs_key,
+    delete_share,
+    index_user_shares,
+    revisions_key,
+    scan_shares,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_share(source, target, key):
+    pipe = source.pipeline(transaction=True)
+    pipe.get(key)
+    pipe.dump(key)
+    pipe.pttl(key)
+    pipe.dump(chunks_key(key))
+    pipe.dump(meta_key(key))
+    pipe.dump(revisions_key(key))
+    raw, dumped, pttl, chunks, meta, revisions = pipe.execute()
+    if raw is None or pttl <= 0:
+        return False
+
+    digest = share_blob_hash(raw) or ""
+    blob = source.get(blob_key(digest)) if digest else None
+    if digest and blob is None:
+        logger.warning("Skipping %s: its blob %s is missing.", key, digest)
+        return False
+
+    # The share is written to its new node before it is removed from the old
+    # one, so readers that check both nodes always find it.
+    run_script(
+        target,
+        "share_restore",
+        [
+            key,
+            chunks_key(key),
+            blob_key(digest),
+            blob_refs_key(digest),
+            meta_key(key),
+            revisions_key(key),
+        ],
+        [dumped, pttl, chunks or "", blob or "", meta or "", revisions or ""],
+    )
+    delete_share(source, key)
+    return True
+
+
+def migrate_user_index(source, target, key):
+    pipe = source.pipeline(transaction=True)
+    pipe.zrange(key, 0, -1, withscores=True)
+    pipe.pttl(key)
+    entries, pttl = pipe.execute()
+    if not entries or pttl <= 0:
+        return False
+
+    user_id = key.removeprefix("user:").removesuffix(":shares")
+    index_user_shares(
+        target,
+        user_id,
+        [(share_id.decode("utf-8"), int(score)) for share_id, score in entries],
+        math.ceil(pttl / 1000),
+    )
+    source.delete(key)
+    return True
+
+
+def rebalance(batch_size=500, pause=0.0, dry_run=False):
+    ring, _ = build_rings()
+    if ring is None:
+        raise ValueError("REDIS_NODES is not configured")
+
+    utils.init_redis_pool()
+    clients = {
+        name: redis.StrictRedis(connection_pool=pool)
+        for name, pool in utils.redis_node_pools.items()
+    }
+
+    moved = {}
+    for name, client in clients.items():
+        for key in client.scan_iter(match="user:*:shares", count=batch_size):
+            key = key.decode("utf-8")
+            owner = ring.node_for(key.removesuffix(":shares"))
+            if owner != name and not dry_run:
+                migrate_user_index(client, clients[owner], key)
+
+        for key in scan_shares(client, batch_size):
+            owner = ring.node_for_key(key)
+            if owner == name:
+                continue
+
+            if dry_run or migrate_share(client, clients[owner], key):
+                route = f"{name} -> {owner}"
+                moved[route] = moved.get(route, 0) + 1
+                if pause and sum(moved.values()) % batch_size == 0:
+                    time.sleep(pause)
+
+    for route, count in moved.items():
+        logger.info(
+            "%s %s shares %s", "Would move" if dry_run else "Moved", count, route
+        )
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Move shares to the Redis node that owns them under REDIS_NODES."
+    )
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--pause", type=float, default=0.0, help="Seconds to sleep after each batch"
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    try:
+        moved = rebalance(args.batch_size, args.pause, args.dry_run)
+    except (ValueError, redis.RedisError) as e:
+        logger.error("Rebalance failed: %s", e)
+        sys.exit(1)
+
+    logger.info("Rebalance finished, %s shares affected.", sum(moved.values()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import logging
+
+try:
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.lexers.special import TextLexer
+    from pygments.util import ClassNotFound
+except ImportError:
+    highlight = None
+
+logger = logging.getLogger(__name__)
+
+SHARE_RENDER_MAX_SIZE = int(os.getenv("SHARE_RENDER_MAX_SIZE", str(1024 * 1024)))
+SHARE_RENDER_STYLE = os.getenv("SHARE_RENDER_STYLE", "default")
+RENDER_CSS_CLASS = "highlight"
+
+
+def render_available():
+    return highlight is not None
+
+
+def share_lexer(language):
+    try:
+        return get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        logger.info("No lexer for %s, rendering as plain text.", language)
+        return TextLexer(stripnl=False, ensurenl=False)
+
+
+def render_share_html(code, language):
+    formatter = HtmlFormatter(cssclass=RENDER_CSS_CLASS, linenos="table")
+    return highlight(code, share_lexer(language), formatter).encode("utf-8")
+
+
+def render_css():
+    formatter = HtmlFormatter(style=SHARE_RENDER_STYLE, cssclass=RENDER_CSS_CLASS)
+    return formatter.get_style_defs(f".{RENDER_CSS_CLASS}")
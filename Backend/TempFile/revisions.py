@@ -0,0 +1,106 @@
+import os
+import difflib
+import msgpack
+from codec import decode_share, loads_json, pack, unpack
+
+# Revision 0 is the share as uploaded; each later revision is stored as the
+# line edits that turn the previous revision into it. Every
+# SHARE_REVISION_SNAPSHOT_INTERVAL revisions, or when the edits are no
+# smaller than the code, the full code is stored instead, so reading any
+# revision replays fewer than that many deltas.
+SHARE_REVISION_SNAPSHOT_INTERVAL = int(
+    os.getenv("SHARE_REVISION_SNAPSHOT_INTERVAL", "10")
+)
+SHARE_REVISION_MAX = int(os.getenv("SHARE_REVISION_MAX", "100"))
+SHARE_REVISION_MAX_SIZE = int(os.getenv("SHARE_REVISION_MAX_SIZE", str(1024 * 1024)))
+SHARE_REVISION_ATTEMPTS = 3
+
+
+class RevisionConflict(Exception):
+    """Raised when a share has no room for another revision, or other
+    revisions kept being written first."""
+
+
+class RevisionTooLarge(Exception):
+    """Raised for shares stored in chunks, which cannot be revised."""
+
+
+# Copies are [start, stop) line ranges of the previous revision; strings are
+# inserted as-is.
+def line_delta(base, code):
+    base_lines = base.splitlines(keepends=True)
+    lines = code.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines)
+    for tag, start, stop, first, last in matcher.get_opcodes():
+        if tag == "equal":
+            delta.append([start, stop])
+        elif first < last:
+            delta.append("".join(lines[first:last]))
+    return delta
+
+
+def apply_delta(base, delta):
+    lines = base.splitlines(keepends=True)
+    return "".join(
+        op if isinstance(op, str) else "".join(lines[op[0] : op[1]]) for op in delta
+    )
+
+
+def encode_revision(code, base=None):
+    """Returns the record for code and whether it is a full snapshot."""
+    if base is not None:
+        delta = msgpack.packb({"d": line_delta(base, code)}, use_bin_type=True)
+        if len(delta) < len(code.encode("utf-8")):
+            return pack(delta), False
+    return pack(msgpack.packb({"c": code}, use_bin_type=True)), True
+
+
+def revision_code(code, records):
+    for raw in records:
+        record = msgpack.unpackb(unpack(raw)[1], raw=False)
+        code = record["c"] if "c" in record else apply_delta(code, record["d"])
+    return code
+
+
+def revisable_share(raw, language, blob=None):
+    file_data = decode_share(raw, language, blob)
+    if "chunks" in file_data:
+        raise RevisionTooLarge("File is too large for revisions")
+    return file_data
+
+
+def loaded_revision(raw, blob, info, records, language):
+    """Rebuilds a revision from its info and the records from the snapshot it
+    starts at. raw is the share record when that snapshot is revision 0."""
+    if info is None:
+        return {**revisable_share(raw, language, blob), "revision": 0, "snapshot": 0}
+
+    revision = loads_json(info)
+    code = revisable_share(raw, language, blob)["code"] if raw is not None else None
+    revision["code"] = revision_code(code, records)
+    return revision
+
+
+def new_revision(latest, code, title=None):
+    """Returns the record and info of the revision after latest."""
+    revision = latest["revision"] + 1
+    if revision > SHARE_REVISION_MAX:
+        raise RevisionConflict(
+            f"A share can have at most {SHARE_REVISION_MAX} revisions"
+        )
+
+    snapshot = latest["snapshot"]
+    base = latest["code"]
+    if revision - snapshot >= SHARE_REVISION_SNAPSHOT_INTERVAL:
+        base = None
+    record, full = encode_revision(code, base)
+
+    return record, {
+        "revision": revision,
+        "snapshot": revision if full else snapshot,
+        "title": title or latest["title"],
+        "language": latest["language"],
+        "expiry_time": latest["expiry_time"],
+        "size": len(code.encode("utf-8")),
+    }
@@ -0,0 +1,537 @@
+import time
+import hashlib
+import redis
+from metrics import observe_redis
+
+SCRIPTS = {}
+
+
+def register_script(name, source):
+    SCRIPTS[name] = (source, hashlib.sha1(source.encode("utf-8")).hexdigest())
+
+
+def run_script(redis_client, name, keys=(), args=()):
+    source, sha = SCRIPTS[name]
+    started = time.perf_counter()
+    try:
+        return redis_client.evalsha(sha, len(keys), *keys, *args)
+    except redis.exceptions.NoScriptError:
+        redis_client.script_load(source)
+        return redis_client.evalsha(sha, len(keys), *keys, *args)
+    finally:
+        observe_redis(name, started)
+
+
+async def run_script_async(redis_client, name, keys=(), args=()):
+    source, sha = SCRIPTS[name]
+    started = time.perf_counter()
+    try:
+        return await redis_client.evalsha(sha, len(keys), *keys, *args)
+    except redis.exceptions.NoScriptError:
+        await redis_client.script_load(source)
+        return await redis_client.evalsha(sha, len(keys), *keys, *args)
+    finally:
+        observe_redis(name, started)
+
+
+def queue_scripts(pipe, calls):
+    for name, keys, args in calls:
+        _, sha = SCRIPTS[name]
+        pipe.evalsha(sha, len(keys), *keys, *args)
+
+
+def missing_script_calls(calls, results):
+    return [
+        (index, call)
+        for index, (call, result) in enumerate(zip(calls, results))
+        if isinstance(result, redis.exceptions.NoScriptError)
+    ]
+
+
+def pipeline_name(calls):
+    names = {name for name, _, _ in calls}
+    return f"pipeline:{names.pop()}" if len(names) == 1 else "pipeline:mixed"
+
+
+def run_scripts(redis_client, calls, transaction=True):
+    started = time.perf_counter()
+    pipe = redis_client.pipeline(transaction=transaction)
+    queue_scripts(pipe, calls)
+    results = pipe.execute(raise_on_error=False)
+
+    missing = missing_script_calls(calls, results)
+    if missing:
+        load_scripts(redis_client)
+        pipe = redis_client.pipeline(transaction=transaction)
+        queue_scripts(pipe, [call for _, call in missing])
+        for (index, _), result in zip(missing, pipe.execute(raise_on_error=False)):
+            results[index] = result
+
+    observe_redis(pipeline_name(calls), started)
+    return results
+
+
+async def run_scripts_async(redis_client, calls, transaction=True):
+    started = time.perf_counter()
+    async with redis_client.pipeline(transaction=transaction) as pipe:
+        queue_scripts(pipe, calls)
+        results = await pipe.execute(raise_on_error=False)
+
+    missing = missing_script_calls(calls, results)
+    if missing:
+        for source, _ in SCRIPTS.values():
+            await redis_client.script_load(source)
+        async with redis_client.pipeline(transaction=transaction) as pipe:
+            queue_scripts(pipe, [call for _, call in missing])
+            retried = await pipe.execute(raise_on_error=False)
+        for (index, _), result in zip(missing, retried):
+            results[index] = result
+
+    observe_redis(pipeline_name(calls), started)
+    return results
+
+
+def load_scripts(redis_client):
+    for source, _ in SCRIPTS.values():
+        redis_client.script_load(source)
+
+
+# Blob-backed records (codec version 2) carry the blob digest in bytes 3-66
+# and set the 0x80 flag on byte 2. See codec.BLOB_REF_FLAG.
+BLOB_REF_LUA = """
+local function blob_ref(raw)
+    if string.byte(raw, 1) == 2 and string.byte(raw, 2) >= 128 then
+        return string.sub(raw, 3, 66)
+    end
+    return false
+end
+
+local function extend_ttl(key, ttl)
+    if redis.call('TTL', key) < ttl then
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+
+local function put_meta(key, ttl, first)
+    redis.call('DEL', key)
+    redis.call('HSET', key, unpack(ARGV, first))
+    redis.call('EXPIRE', key, ttl)
+end
+"""
+
+# Share metadata lives in a hash next to the record so previews never read
+# the body. Put scripts take its field/value pairs as the trailing ARGV.
+# They return a stored idempotent response, 1 if the share id is already
+# taken, or nil once the share is written.
+
+# KEYS: share, meta[, idempotency]  ARGV: record, ttl, response, meta...
+register_script(
+    "share_put",
+    BLOB_REF_LUA + """
+if KEYS[3] then
+    local existing = redis.call('GET', KEYS[3])
+    if existing then
+        return existing
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 1
+end
+
+local ttl = tonumber(ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+put_meta(KEYS[2], ttl, 4)
+if KEYS[3] then
+    redis.call('SET', KEYS[3], ARGV[3], 'EX', ttl)
+end
+return false
+""",
+)
+
+# KEYS: share, meta, blob, blob refs[, idempotency]
+# ARGV: record, ttl, blob, response, meta...
+# A blob lives as long as the longest-lived share that references it. Its
+# refs count uploads minus deletes: shares that simply expire are never
+# subtracted, so refs is an upper bound on the live referrers, and a blob
+# whose referrers all expired goes with its own TTL.
+register_script(
+    "share_put_blob",
+    BLOB_REF_LUA + """
+if KEYS[5] then
+    local existing = redis.call('GET', KEYS[5])
+    if existing then
+        return existing
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 1
+end
+
+local ttl = tonumber(ARGV[2])
+redis.call('SET', KEYS[3], ARGV[3], 'NX', 'EX', ttl)
+extend_ttl(KEYS[3], ttl)
+redis.call('INCR', KEYS[4])
+extend_ttl(KEYS[4], ttl)
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+put_meta(KEYS[2], ttl, 5)
+if KEYS[5] then
+    redis.call('SET', KEYS[5], ARGV[4], 'EX', ttl)
+end
+return false
+""",
+)
+
+# KEYS: share, meta, chunks[, idempotency]
+# ARGV: record, ttl, response, chunk count, chunks..., meta...
+register_script(
+    "share_put_chunked",
+    BLOB_REF_LUA + """
+if KEYS[4] then
+    local existing = redis.call('GET', KEYS[4])
+    if existing then
+        return existing
+    end
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 1
+end
+
+local ttl = tonumber(ARGV[2])
+local last_chunk = 4 + tonumber(ARGV[4])
+for index = 5, last_chunk do
+    redis.call('HSET', KEYS[3], index - 5, ARGV[index])
+end
+redis.call('EXPIRE', KEYS[3], ttl)
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ttl)
+put_meta(KEYS[2], ttl, last_chunk + 1)
+if KEYS[4] then
+    redis.call('SET', KEYS[4], ARGV[3], 'EX', ttl)
+end
+return false
+""",
+)
+
+# Scripts only touch the keys passed to them, as EVAL requires. A blob's key
+# is only known once the record has been read, so readers fetch the blob of
+# a blob-backed share with a second command.
+
+# KEYS: share  ->  {record, ttl}
+register_script(
+    "share_get",
+    """
+return {redis.call('GET', KEYS[1]), redis.call('TTL', KEYS[1])}
+""",
+)
+
+# KEYS: share, meta  ->  {meta fields, ttl}
+# Shares written before the metadata hash existed return no fields.
+register_script(
+    "share_meta",
+    """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    return {false, ttl}
+end
+return {redis.call('HGETALL', KEYS[2]), ttl}
+""",
+)
+
+# KEYS: share, rendered html  ->  {html, ttl}
+register_script(
+    "share_render_get",
+    """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    return {false, ttl}
+end
+return {redis.call('GET', KEYS[2]), ttl}
+""",
+)
+
+# KEYS: share, rendered html  ARGV: html
+# The render expires with the share and is dropped if the share is gone.
+register_script(
+    "share_render_put",
+    """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl <= 0 then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[1], 'PX', pttl, 'NX')
+return 1
+""",
+)
+
+# Revisions 1..n of a share live in one hash: field n holds the record and
+# field n:i its JSON info, whose "snapshot" is the revision its chain of
+# deltas starts from (0 for the share record itself).
+
+# KEYS: share, revisions  ARGV: revision (-1 for the latest)
+#   ->  {record, ttl, info, records}
+# The share record is only returned when the chain starts at it.
+# Records run from the chain's snapshot (or revision 1) to the revision.
+register_script(
+    "share_revision_get",
+    """
+local ttl = redis.call('TTL', KEYS[1])
+local latest = math.floor(redis.call('HLEN', KEYS[2]) / 2)
+local revision = tonumber(ARGV[1])
+if revision < 0 then
+    revision = latest
+end
+if ttl < 0 or revision > latest then
+    return {false, ttl, false, {}}
+end
+
+local info = false
+local snapshot = 0
+if revision > 0 then
+    info = redis.call('HGET', KEYS[2], revision .. ':i')
+    snapshot = cjson.decode(info)['snapshot']
+end
+
+local records = {}
+if revision > 0 then
+    local fields = {}
+    for index = math.max(snapshot, 1), revision do
+        fields[#fields + 1] = tostring(index)
+    end
+    records = redis.call('HMGET', KEYS[2], unpack(fields))
+end
+if snapshot > 0 then
+    return {false, ttl, info, records}
+end
+return {redis.call('GET', KEYS[1]), ttl, info, records}
+""",
+)
+
+# KEYS: share, revisions  ARGV: revision, record, info
+#   ->  1 once written, 0 if the revision was written first, -1 if the share
+#   is gone. Revisions expire with their share.
+register_script(
+    "share_revision_put",
+    """
+local pttl = redis.call('PTTL', KEYS[1])
+if pttl <= 0 then
+    return -1
+end
+local latest = math.floor(redis.call('HLEN', KEYS[2]) / 2)
+if latest + 1 ~= tonumber(ARGV[1]) then
+    return 0
+end
+
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2], ARGV[1] .. ':i', ARGV[3])
+redis.call('PEXPIRE', KEYS[2], pttl)
+return 1
+""",
+)
+
+# KEYS: share, revisions  ->  {revision infos, ttl}
+register_script(
+    "share_revision_list",
+    """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    return {false, ttl}
+end
+
+local fields = {}
+for index = 1, math.floor(redis.call('HLEN', KEYS[2]) / 2) do
+    fields[#fields + 1] = index .. ':i'
+end
+if #fields == 0 then
+    return {{}, ttl}
+end
+return {redis.call('HMGET', KEYS[2], unpack(fields)), ttl}
+""",
+)
+
+# KEYS: share  ->  {etag, ttl, compression, blob digest}
+# Reads only the record header so a conditional GET never touches the body.
+# Blob-backed shares are sent in their blob's compression, which the caller
+# reads from the blob's header.
+register_script(
+    "share_etag",
+    """
+local ttl = redis.call('TTL', KEYS[1])
+if ttl < 0 then
+    return {false, ttl, 0, false}
+end
+
+local head = redis.call('GETRANGE', KEYS[1], 0, 97)
+if string.byte(head, 1) ~= 2 then
+    return {false, ttl, 0, false}
+end
+
+local flags = string.byte(head, 2)
+local compression = flags % 32
+local offset = 3
+local digest = false
+if flags >= 128 then
+    digest = string.sub(head, 3, 66)
+    offset = offset + 64
+    flags = flags - 128
+end
+if flags >= 64 then
+    return {string.sub(head, offset, offset + 31), ttl, compression, digest}
+end
+return {false, ttl, 0, false}
+""",
+)
+
+# KEYS: share, chunks, meta, rendered html, revisions[, blob, blob refs]
+# ARGV: invalidation channel, blob digest the caller read ('' for none)
+#   ->  1 once deleted, 0 if there was no share, -1 if the share's blob is not
+#   the one the caller read, so it has to read the record again.
+# The share and its blob reference go in one step, so no crash in between can
+# leak a ref. Version 1 records keep their digest inside the compressed body,
+# so for those the caller's digest is taken as is.
+register_script(
+    "share_delete",
+    BLOB_REF_LUA + """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return 0
+end
+
+local digest = blob_ref(raw) or ''
+if string.byte(raw, 1) == 1 then
+    digest = ARGV[2]
+end
+if digest ~= ARGV[2] then
+    return -1
+end
+
+redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5])
+redis.call('PUBLISH', ARGV[1], KEYS[1])
+if digest ~= '' and redis.call('DECR', KEYS[7]) <= 0 then
+    redis.call('DEL', KEYS[6], KEYS[7])
+end
+return 1
+""",
+)
+
+# KEYS: share, chunks, blob, blob refs, meta, revisions
+# ARGV: share dump, pttl, chunks dump, blob, meta dump, revisions dump
+# (empty strings when absent)
+register_script(
+    "share_restore",
+    BLOB_REF_LUA + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+
+local pttl = tonumber(ARGV[2])
+if ARGV[4] ~= '' then
+    local ttl = math.ceil(pttl / 1000)
+    redis.call('SET', KEYS[3], ARGV[4], 'NX', 'EX', ttl)
+    extend_ttl(KEYS[3], ttl)
+    redis.call('INCR', KEYS[4])
+    extend_ttl(KEYS[4], ttl)
+end
+if ARGV[3] ~= '' then
+    redis.call('RESTORE', KEYS[2], pttl, ARGV[3], 'REPLACE')
+end
+if ARGV[5] ~= '' then
+    redis.call('RESTORE', KEYS[5], pttl, ARGV[5], 'REPLACE')
+end
+if ARGV[6] ~= '' then
+    redis.call('RESTORE', KEYS[6], pttl, ARGV[6], 'REPLACE')
+end
+redis.call('RESTORE', KEYS[1], pttl, ARGV[1], 'REPLACE')
+return 1
+""",
+)
+
+# KEYS: user index  ARGV: ttl, score, share id[, score, share id...]
+register_script(
+    "user_index_add",
+    BLOB_REF_LUA + """
+for index = 2, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[index], ARGV[index + 1])
+end
+extend_ttl(KEYS[1], tonumber(ARGV[1]))
+return true
+""",
+)
+
+# KEYS: user index  ARGV: now, limit, cursor score, cursor share id
+#   ->  {total, {share id, score, ...}}
+register_script(
+    "user_index_page",
+    """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+
+local limit = tonumber(ARGV[2])
+if ARGV[4] == '' then
+    local page = redis.call('ZRANGE', KEYS[1], 0, limit - 1, 'WITHSCORES')
+    return {redis.call('ZCARD', KEYS[1]), page}
+end
+
+-- Resume after (cursor score, cursor share id) in the set's own order, which
+-- breaks ties on the member, so this works even once that share is gone.
+-- A probe member sorting just after the cursor gives its rank without
+-- walking the shares tied with it; share ids never contain NUL.
+local probe = ARGV[4] .. '\0'
+redis.call('ZADD', KEYS[1], ARGV[3], probe)
+local start = redis.call('ZRANK', KEYS[1], probe)
+redis.call('ZREM', KEYS[1], probe)
+local page = redis.call('ZRANGE', KEYS[1], start, start + limit - 1, 'WITHSCORES')
+return {redis.call('ZCARD', KEYS[1]), page}
+""",
+)
+
+# KEYS: user bucket, global bucket
+# ARGV: cost, user rate, user burst, global rate, global burst
+#   ->  {allowed, wait ms, limiting bucket (1-based, 0 if none), levels...}
+# Tokens are only taken when both buckets can pay; a cost of 0 just reads them.
+# Callers keep the cost within the bursts (see ratelimit.max_cost).
+register_script(
+    "rate_limit",
+    """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local cost = tonumber(ARGV[1])
+
+local levels = {false, false}
+local wait, limited = 0, 0
+for index = 1, 2 do
+    local rate = tonumber(ARGV[index * 2])
+    local burst = tonumber(ARGV[index * 2 + 1])
+    if rate > 0 then
+        local state = redis.call('HMGET', KEYS[index], 'tokens', 'ts')
+        local level = burst
+        if state[1] then
+            local elapsed = math.max(0, now - tonumber(state[2]))
+            level = math.min(burst, tonumber(state[1]) + elapsed * rate / 1000)
+        end
+        levels[index] = level
+
+        if level < cost then
+            local bucket_wait = math.ceil((cost - level) * 1000 / rate)
+            if bucket_wait > wait then
+                wait, limited = bucket_wait, index
+            end
+        end
+    end
+end
+
+if limited == 0 and cost > 0 then
+    for index = 1, 2 do
+        if levels[index] then
+            local rate = tonumber(ARGV[index * 2])
+            local burst = tonumber(ARGV[index * 2 + 1])
+            levels[index] = levels[index] - cost
+            redis.call('HSET', KEYS[index], 'tokens', tostring(levels[index]), 'ts', now)
+            redis.call('PEXPIRE', KEYS[index], math.ceil(burst * 1000 / rate) + 1000)
+        end
+    end
+end
+
+local replies = {limited == 0 and 1 or 0, wait, limited}
+for index = 1, 2 do
+    replies[index + 3] = levels[index] and tostring(levels[index]) or false
+end
+return replies
+""",
+)
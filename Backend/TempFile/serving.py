@@ -0,0 +1,72 @@
+import os
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Worker sizing for gunicorn.conf.py and hypercorn_conf.py. WEB_IO_FRACTION
+# is the share of a request's time spent waiting on Redis, reCAPTCHA or the
+# client rather than running Python; the closer it is to 1, the more requests
+# each core can keep in flight.
+WEB_WORKER_CLASS = os.getenv("WEB_WORKER_CLASS", "threaded")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))
+WEB_IO_FRACTION = float(os.getenv("WEB_IO_FRACTION", "0.75"))
+WEB_MAX_WORKERS = int(os.getenv("WEB_MAX_WORKERS", "32"))
+WEB_MAX_THREADS = int(os.getenv("WEB_MAX_THREADS", "64"))
+WEB_GEVENT_CONNECTIONS = int(os.getenv("WEB_GEVENT_CONNECTIONS", "1000"))
+WEB_BIND = os.getenv("WEB_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "30"))
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "5"))
+WEB_MAX_REQUESTS = int(os.getenv("WEB_MAX_REQUESTS", "0"))
+
+GUNICORN_WORKER_CLASSES = {"sync": "sync", "threaded": "gthread", "gevent": "gevent"}
+MAX_IO_FRACTION = 0.95
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Requests that wait on I/O for a fraction f of their time need 1 / (1 - f)
+# of them in flight to keep one core busy.
+def inflight_per_core(io_fraction=WEB_IO_FRACTION):
+    io_fraction = min(max(io_fraction, 0.0), MAX_IO_FRACTION)
+    return math.ceil(round(1 / (1 - io_fraction), 6))
+
+
+def worker_plan(worker_class=WEB_WORKER_CLASS, cpus=None):
+    if worker_class not in (*GUNICORN_WORKER_CLASSES, "asgi"):
+        raise ValueError(f"Unknown WEB_WORKER_CLASS '{worker_class}'")
+
+    cpus = cpus or cpu_count()
+    per_core = inflight_per_core()
+    if worker_class == "sync":
+        # Every sync worker is a process serving one request at a time.
+        workers, threads = cpus * per_core, 1
+    else:
+        # Threads share a GIL and event loops run on one core, so one
+        # process per core; threads cover the requests waiting on I/O.
+        workers, threads = cpus, per_core if worker_class == "threaded" else 1
+
+    return {
+        "worker_class": worker_class,
+        "workers": min(WEB_CONCURRENCY or workers, WEB_MAX_WORKERS),
+        "threads": min(threads, WEB_MAX_THREADS),
+        "worker_connections": WEB_GEVENT_CONNECTIONS,
+        "cpus": cpus,
+    }
+
+
+def log_plan(plan):
+    logger.info(
+        "Serving with %s %s workers (%s threads, %s CPUs, I/O fraction %s)",
+        plan["workers"],
+        plan["worker_class"],
+        plan["threads"],
+        plan["cpus"],
+        WEB_IO_FRACTION,
+    )
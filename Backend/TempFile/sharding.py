@@ -0,0 +1,73 @@
+import os
+import bisect
+import hashlib
+from urllib.parse import urlsplit
+
+# Comma-separated redis:// or rediss:// URLs. While a rebalance is running,
+# REDIS_NODES_PREVIOUS holds the membership the keys are being moved from.
+REDIS_NODES = os.getenv("REDIS_NODES", "")
+REDIS_NODES_PREVIOUS = os.getenv("REDIS_NODES_PREVIOUS", "")
+REDIS_RING_REPLICAS = int(os.getenv("REDIS_RING_REPLICAS", "160"))
+
+
+def parse_nodes(value):
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+def node_name(url):
+    parts = urlsplit(url)
+    return f"{parts.hostname}:{parts.port or 6379}{parts.path or '/0'}"
+
+
+def ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+def user_index_id(user_id):
+    return f"user:{user_id}"
+
+
+def share_id_for_key(key):
+    if key.startswith("s:"):
+        return key.removeprefix("s:")
+    return key.removeprefix("file:").removesuffix(":data")
+
+
+# Legacy ids carry their language, which does not decide where they live.
+def share_file_id(key):
+    return share_id_for_key(key).split("-", 1)[-1]
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=REDIS_RING_REPLICAS):
+        self.nodes = list(nodes)
+        points = sorted(
+            (ring_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def node_for(self, file_id):
+        index = bisect.bisect(self.hashes, ring_hash(file_id)) % len(self.hashes)
+        return self.owners[index]
+
+    def node_for_key(self, key):
+        return self.node_for(share_file_id(key))
+
+
+def node_urls():
+    urls = {}
+    for url in parse_nodes(REDIS_NODES) + parse_nodes(REDIS_NODES_PREVIOUS):
+        urls.setdefault(node_name(url), url)
+    return urls
+
+
+def build_rings():
+    if not parse_nodes(REDIS_NODES):
+        return None, None
+
+    ring = HashRing(node_name(url) for url in parse_nodes(REDIS_NODES))
+    previous = parse_nodes(REDIS_NODES_PREVIOUS)
+    return ring, HashRing(node_name(url) for url in previous) if previous else None
@@ -0,0 +1,446 @@
+import os
+import hmac
+import time
+import string
+import hashlib
+import secrets
+import codecs
+import logging
+from codec import (
+    RenderedShare,
+    ShareValidator,
+    decoded_body,
+    dumps_json,
+    format_expiry,
+)
+from store import ShareIdTaken
+from ratelimit import max_cost
+from revisions import SHARE_REVISION_MAX_SIZE, RevisionConflict, RevisionTooLarge
+
+logger = logging.getLogger(__name__)
+
+VALID_EXPIRY_TIMES = (10, 30, 60, 1440, 10080)
+SHARE_BATCH_MAX_SIZE = int(os.getenv("SHARE_BATCH_MAX_SIZE", "100"))
+SHARE_MAX_SIZE = int(os.getenv("SHARE_MAX_SIZE", str(10 * 1024 * 1024)))
+USER_SHARES_PAGE_SIZE = int(os.getenv("USER_SHARES_PAGE_SIZE", "20"))
+USER_SHARES_PAGE_MAX = 100
+FILE_ID_SECRET = os.getenv("JWT_SECRET", "").encode("utf-8")
+
+# Share ids are random base62 strings stored under s:<id>. Links from before
+# this scheme look like <language>-<uuid4> and still resolve to their
+# original file:<language>-<uuid4>:data keys until they expire.
+SHARE_ID_ALPHABET = string.digits + string.ascii_letters
+SHARE_ID_LENGTH = 10
+SHARE_ID_ATTEMPTS = 5
+
+
+# Every share in an upload batch takes a rate-limit token, so a batch larger
+# than the smallest enabled burst could never be admitted.
+def upload_batch_limit():
+    cost = max_cost()
+    return SHARE_BATCH_MAX_SIZE if cost is None else min(SHARE_BATCH_MAX_SIZE, cost)
+
+
+def validate_upload(data):
+    if (
+        not isinstance(data, dict)
+        or not data.get("code")
+        or not isinstance(data["code"], str)
+        or not data.get("language")
+        or not data.get("title")
+        or not data.get("expiryTime")
+    ):
+        return "Code, language, title, and expiry time are required", 400
+
+    try:
+        expiry_time_minutes = int(data["expiryTime"])
+    except (TypeError, ValueError):
+        expiry_time_minutes = None
+
+    if expiry_time_minutes not in VALID_EXPIRY_TIMES:
+        return "Invalid expiry time. Please choose a valid value.", 400
+
+    if len(data["code"].encode("utf-8")) > SHARE_MAX_SIZE:
+        limit = SHARE_MAX_SIZE / (1024 * 1024)
+        return f"Code size exceeds the {limit:g} MB limit", 413
+
+    return None, None
+
+
+def validate_revision(data):
+    if (
+        not isinstance(data, dict)
+        or not data.get("code")
+        or not isinstance(data["code"], str)
+    ):
+        return "Code is required", 400
+
+    if data.get("title") is not None and not isinstance(data["title"], str):
+        return "Title must be a string", 400
+
+    if len(data["code"].encode("utf-8")) > SHARE_REVISION_MAX_SIZE:
+        limit = SHARE_REVISION_MAX_SIZE / (1024 * 1024)
+        return f"Revisions are limited to {limit:g} MB", 413
+
+    return None, None
+
+
+def base62(number, length):
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, len(SHARE_ID_ALPHABET))
+        digits.append(SHARE_ID_ALPHABET[digit])
+    return "".join(digits)
+
+
+def new_file_id(idem_key=None, attempt=0):
+    if not idem_key:
+        return "".join(
+            secrets.choice(SHARE_ID_ALPHABET) for _ in range(SHARE_ID_LENGTH)
+        )
+
+    # Retries with the same idempotency key map to the same share id, so they
+    # land on the same shard as the stored response.
+    message = f"{idem_key}:{attempt}" if attempt else idem_key
+    digest = hmac.new(FILE_ID_SECRET, message.encode("utf-8"), hashlib.sha256)
+    return base62(int.from_bytes(digest.digest(), "big"), SHARE_ID_LENGTH)
+
+
+def is_compact_share_id(share_id):
+    return len(share_id) == SHARE_ID_LENGTH and all(
+        char in SHARE_ID_ALPHABET for char in share_id
+    )
+
+
+def build_share(data, file_id, owner=None):
+    expiry_time_minutes = int(data["expiryTime"])
+    language = data["language"]
+
+    ttl = expiry_time_minutes * 60
+    expires_at = int(time.time()) + ttl
+
+    return {
+        "share_id": file_id,
+        "key": share_key(file_id),
+        "owner": owner,
+        "ttl": ttl,
+        "expires_at": expires_at,
+        "file_data": {
+            "title": data["title"],
+            "code": data["code"],
+            "language": language,
+            "expiry_time": format_expiry(expires_at),
+        },
+    }
+
+
+def parse_share_id(share_id):
+    if is_compact_share_id(share_id):
+        return None, share_id
+
+    language, file_id = share_id.split("-", 1)
+    return language, file_id
+
+
+def share_key(share_id):
+    language, file_id = parse_share_id(share_id)
+    if language is None:
+        return f"s:{file_id}"
+    return f"file:{language}-{file_id}:data"
+
+
+def share_lookup(share_id):
+    try:
+        return share_key(share_id), parse_share_id(share_id)[0]
+    except ValueError:
+        return None
+
+
+def assign_share_id(share, file_id):
+    share["share_id"] = file_id
+    share["key"] = share_key(file_id)
+
+
+def upload_response(share, base_url):
+    return {
+        "message": "Code uploaded successfully",
+        "fileUrl": f"{base_url}/file/{share['share_id']}",
+        "expiry_time": share["file_data"]["expiry_time"],
+    }
+
+
+def save_upload(storage, share, idem_key, base_url):
+    for attempt in range(SHARE_ID_ATTEMPTS):
+        response = upload_response(share, base_url)
+        try:
+            return storage.save_share(share, idem_key, response), response
+        except ShareIdTaken:
+            logger.warning("Share id collision, drawing a new id.")
+            assign_share_id(share, new_file_id(idem_key, attempt + 1))
+    raise ShareIdTaken(share["share_id"])
+
+
+async def save_upload_async(storage, share, idem_key, base_url):
+    for attempt in range(SHARE_ID_ATTEMPTS):
+        response = upload_response(share, base_url)
+        try:
+            return await storage.save_share(share, idem_key, response), response
+        except ShareIdTaken:
+            logger.warning("Share id collision, drawing a new id.")
+            assign_share_id(share, new_file_id(idem_key, attempt + 1))
+    raise ShareIdTaken(share["share_id"])
+
+
+def taken_shares(outcomes):
+    return [
+        index
+        for index, outcome in enumerate(outcomes)
+        if isinstance(outcome, ShareIdTaken)
+    ]
+
+
+def save_batch(storage, shares):
+    outcomes = storage.save_shares(shares)
+    for _ in range(SHARE_ID_ATTEMPTS - 1):
+        taken = taken_shares(outcomes)
+        if not taken:
+            break
+        for index in taken:
+            assign_share_id(shares[index], new_file_id())
+        retried = storage.save_shares([shares[index] for index in taken])
+        for index, outcome in zip(taken, retried):
+            outcomes[index] = outcome
+    return outcomes
+
+
+async def save_batch_async(storage, shares):
+    outcomes = await storage.save_shares(shares)
+    for _ in range(SHARE_ID_ATTEMPTS - 1):
+        taken = taken_shares(outcomes)
+        if not taken:
+            break
+        for index in taken:
+            assign_share_id(shares[index], new_file_id())
+        retried = await storage.save_shares([shares[index] for index in taken])
+        for index, outcome in zip(taken, retried):
+            outcomes[index] = outcome
+    return outcomes
+
+
+def invalid_share_id_response():
+    return {"error": "Invalid 'shareId' format."}, 400
+
+
+def rate_limited_response(admission):
+    return (
+        {"error": "Too many uploads. Please try again later."},
+        429,
+        {"Retry-After": str(admission["retry_after"])},
+    )
+
+
+def share_response(file_data, ttl):
+    if ttl == -2:
+        return {"error": "File not found"}, 404
+    elif ttl == -1 or ttl == 0:
+        return {"error": "File has expired"}, 410
+
+    if file_data:
+        return file_data, 200
+
+    return {"error": "File not found"}, 404
+
+
+def batch_line(share_id, lookup, loaded):
+    if lookup is None:
+        body, status = invalid_share_id_response()
+    else:
+        body, status = share_response(*loaded)
+
+    if status == 200 and not isinstance(body, RenderedShare):
+        body = {"error": "File is too large for batch retrieval"}
+        status = 413
+
+    if status == 200:
+        # Splice the stored document in as-is instead of decoding it.
+        head = dumps_json({"shareId": share_id, "status": status})
+        return head[:-1] + b',"file":' + decoded_body(body) + b"}"
+    return dumps_json({"shareId": share_id, "status": status, **body})
+
+
+def prepare_batch(items, owner=None):
+    results = [None] * len(items)
+    shares = []
+
+    for index, data in enumerate(items):
+        error, _ = validate_upload(data)
+        if error:
+            results[index] = {"error": error}
+        else:
+            shares.append((index, build_share(data, new_file_id(), owner)))
+
+    return results, shares
+
+
+def finish_batch(results, shares, outcomes, base_url):
+    for (index, share), outcome in zip(shares, outcomes):
+        if isinstance(outcome, Exception):
+            results[index] = {"error": "Failed to store code in Redis"}
+        else:
+            results[index] = {
+                "fileUrl": f"{base_url}/file/{share['share_id']}",
+                "expiry_time": share["file_data"]["expiry_time"],
+            }
+
+    return results
+
+
+def stored_shares(shares, outcomes):
+    return [
+        share
+        for (_, share), outcome in zip(shares, outcomes)
+        if not isinstance(outcome, Exception)
+    ]
+
+
+def share_json_head(file_data):
+    head = {key: file_data[key] for key in ("title", "language", "expiry_time")}
+    return dumps_json(head)[:-1] + b',"code":"'
+
+
+def iter_share_json(file_data, body):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    yield share_json_head(file_data)
+    for chunk in body:
+        yield dumps_json(decoder.decode(chunk))[1:-1]
+    yield dumps_json(decoder.decode(b"", final=True))[1:-1] + b'"}'
+
+
+async def iter_share_json_async(file_data, body):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    yield share_json_head(file_data)
+    async for chunk in body:
+        yield dumps_json(decoder.decode(chunk))[1:-1]
+    yield dumps_json(decoder.decode(b"", final=True))[1:-1] + b'"}'
+
+
+def share_size(file_data):
+    if "chunks" in file_data:
+        return file_data["size"]
+    return len(file_data["code"].encode("utf-8"))
+
+
+# Shares stored without an owner (before it was recorded, or by tokens
+# without a userId) cannot be revised by anyone.
+def owns_share(metadata, user_id):
+    return bool(user_id) and metadata.get("owner") == user_id
+
+
+def revision_url(base_url, share_id, revision):
+    return f"{base_url}/file/{share_id}/revisions/{revision}"
+
+
+def revision_response(share_id, info, base_url):
+    return {
+        "message": "Revision created successfully",
+        "revision": info["revision"],
+        "fileUrl": revision_url(base_url, share_id, info["revision"]),
+        "expiry_time": info["expiry_time"],
+    }
+
+
+# Revision 0 is the share itself, described by its metadata.
+def revision_list(share_id, metadata, infos, base_url):
+    revisions = [{"revision": 0, **metadata, "snapshot": 0}, *infos]
+    return {
+        "shareId": share_id,
+        "expiry_time": metadata["expiry_time"],
+        "latest": revisions[-1]["revision"],
+        "revisions": [
+            {
+                "revision": revision["revision"],
+                "fileUrl": revision_url(base_url, share_id, revision["revision"]),
+                "title": revision["title"],
+                "size": revision["size"],
+                "snapshot": revision["snapshot"] == revision["revision"],
+            }
+            for revision in revisions
+        ],
+    }
+
+
+def revision_document(revision):
+    return {
+        key: revision[key]
+        for key in ("code", "title", "language", "expiry_time", "revision")
+    }
+
+
+def public_metadata(metadata):
+    return {key: metadata[key] for key in ("title", "language", "expiry_time", "size")}
+
+
+def sends_encoded(encoding, accept_encodings):
+    return encoding is not None and bool(accept_encodings[encoding])
+
+
+# Headers shared by a share's 200 and 304 responses. Encoded bytes are a
+# different representation, so their ETag is only weak.
+def validator_headers(etag, encoding, accept_encodings):
+    weak = sends_encoded(encoding, accept_encodings)
+    return {
+        "ETag": f'W/"{etag}"' if weak else f'"{etag}"',
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+
+
+# Precompressed documents go out as stored when the client accepts their
+# encoding; everyone else gets them decoded here.
+def negotiate_body(share, accept_encodings):
+    headers = validator_headers(share.etag, share.encoding, accept_encodings)
+    if sends_encoded(share.encoding, accept_encodings):
+        headers["Content-Encoding"] = share.encoding
+        return share.body, headers
+    return decoded_body(share), headers
+
+
+def response_validator(share):
+    if isinstance(share, RenderedShare):
+        return ShareValidator(share.etag, share.encoding)
+    return ShareValidator(share["etag"], None)
+
+
+def parse_page_request(args):
+    try:
+        limit = int(args.get("limit", USER_SHARES_PAGE_SIZE))
+    except ValueError:
+        return None, None, "'limit' must be an integer"
+    if not 1 <= limit <= USER_SHARES_PAGE_MAX:
+        return None, None, f"'limit' must be between 1 and {USER_SHARES_PAGE_MAX}"
+
+    cursor = args.get("cursor")
+    if not cursor:
+        return None, limit, None
+
+    expires_at, _, share_id = cursor.partition(":")
+    if not expires_at.isdigit() or not share_id:
+        return None, None, "Invalid 'cursor'"
+    return (int(expires_at), share_id), limit, None
+
+
+def user_shares_page(entries, next_cursor, total, base_url):
+    shares = [
+        {
+            "shareId": share_id,
+            "fileUrl": f"{base_url}/file/{share_id}",
+            "language": language or parse_share_id(share_id)[0],
+            "expiry_time": format_expiry(expires_at),
+        }
+        for share_id, expires_at, language in entries
+    ]
+    return {
+        "shares": shares,
+        "nextCursor": f"{next_cursor[1]}:{next_cursor[0]}" if next_cursor else None,
+        "total": total,
+    }
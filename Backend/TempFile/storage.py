@@ -0,0 +1,1073 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import redis
+import store
+from codec import (
+    decode_rendered,
+    dumps_json,
+    encode_rendered,
+    encode_share,
+    loads_json,
+    loaded_share_metadata,
+    render_loaded,
+    share_header,
+    share_metadata,
+    unpack_header,
+    content_encoding,
+    ShareValidator,
+)
+from shares import share_key
+from store import ShareIdTaken
+from revisions import loaded_revision, new_revision
+from ratelimit import (
+    GLOBAL_BUCKET,
+    admit,
+    bucket_key,
+    bucket_limits,
+    rate_limit_result,
+    refill,
+    refill_ms,
+    user_bucket,
+)
+from sharding import user_index_id
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "redis")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "tempfile.db")
+SQLITE_PURGE_INTERVAL = int(os.getenv("SQLITE_PURGE_INTERVAL", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+def index_entries(shares):
+    return [(share["share_id"], share["expires_at"]) for share in shares]
+
+
+def split_missing(entries, languages):
+    present = [
+        (*entry, language)
+        for entry, language in zip(entries, languages)
+        if language is not False
+    ]
+    missing = [
+        share_id
+        for (share_id, _), language in zip(entries, languages)
+        if language is False
+    ]
+    return present, missing
+
+
+# During a rebalance a user's index can sit on both its old and its new node
+# until it is moved, so pages from both are merged in index order. The total
+# counts shares on both until then.
+def merge_index_pages(pages, limit):
+    if len(pages) == 1:
+        return pages[0]
+
+    entries = {entry for _, page in pages for entry in page}
+    entries = sorted(entries, key=lambda entry: (entry[1], entry[0]))
+    return sum(total for total, _ in pages), entries[:limit]
+
+
+class UserIndexMixin:
+    def index_clients(self, user_id):
+        return [self.index_client(user_id)]
+
+    def index_shares(self, user_id, shares):
+        try:
+            store.index_user_shares(
+                self.index_client(user_id),
+                user_id,
+                index_entries(shares),
+                max(share["ttl"] for share in shares),
+            )
+        except redis.RedisError as e:
+            logger.warning("Failed to index shares for user %s: %s", user_id, e)
+
+    def unindex_share(self, user_id, share_id):
+        try:
+            for client in self.index_clients(user_id):
+                store.unindex_user_shares(client, user_id, [share_id])
+        except redis.RedisError as e:
+            logger.warning("Failed to unindex share for user %s: %s", user_id, e)
+
+    def list_user_shares(self, user_id, cursor, limit):
+        clients = self.index_clients(user_id)
+        pages = [
+            store.load_user_index(client, user_id, cursor, limit) for client in clients
+        ]
+        total, entries = merge_index_pages(pages, limit)
+        languages = self.share_languages(
+            [share_key(share_id) for share_id, _ in entries]
+        )
+
+        # Shares deleted by someone else are only noticed here.
+        present, missing = split_missing(entries, languages)
+        for client in clients if missing else []:
+            store.unindex_user_shares(client, user_id, missing)
+
+        next_cursor = entries[-1] if len(entries) == limit else None
+        return present, next_cursor, total - len(missing)
+
+
+class AsyncUserIndexMixin(UserIndexMixin):
+    async def index_shares(self, user_id, shares):
+        try:
+            await store.index_user_shares_async(
+                self.index_client(user_id),
+                user_id,
+                index_entries(shares),
+                max(share["ttl"] for share in shares),
+            )
+        except redis.RedisError as e:
+            logger.warning("Failed to index shares for user %s: %s", user_id, e)
+
+    async def unindex_share(self, user_id, share_id):
+        try:
+            for client in self.index_clients(user_id):
+                await store.unindex_user_shares_async(client, user_id, [share_id])
+        except redis.RedisError as e:
+            logger.warning("Failed to unindex share for user %s: %s", user_id, e)
+
+    async def list_user_shares(self, user_id, cursor, limit):
+        clients = self.index_clients(user_id)
+        pages = [
+            await store.load_user_index_async(client, user_id, cursor, limit)
+            for client in clients
+        ]
+        total, entries = merge_index_pages(pages, limit)
+        languages = await self.share_languages(
+            [share_key(share_id) for share_id, _ in entries]
+        )
+
+        present, missing = split_missing(entries, languages)
+        for client in clients if missing else []:
+            await store.unindex_user_shares_async(client, user_id, missing)
+
+        next_cursor = entries[-1] if len(entries) == limit else None
+        return present, next_cursor, total - len(missing)
+
+
+class RedisStorage(UserIndexMixin):
+    name = "redis"
+
+    def __init__(self, redis_client):
+        self.client = redis_client
+
+    def save_share(self, share, idem_key=None, response=None):
+        return store.save_share(self.client, share, idem_key, response)
+
+    def save_shares(self, shares):
+        return store.save_shares(self.client, shares)
+
+    def load_share(self, key, language):
+        return store.load_share(self.client, key, language)
+
+    def load_share_etag(self, key):
+        return store.load_share_etag(self.client, key)
+
+    def load_share_meta(self, key, language):
+        return store.load_share_meta(self.client, key, language)
+
+    def load_rendered(self, key):
+        return store.load_rendered(self.client, key)
+
+    def save_rendered(self, key, html):
+        store.save_rendered(self.client, key, html)
+
+    def load_shares(self, lookups):
+        return store.load_shares(self.client, lookups)
+
+    def iter_share_body(self, key, file_data, start=0, stop=None):
+        return store.iter_share_body(self.client, key, file_data, start, stop)
+
+    def delete_share(self, key):
+        return store.delete_share(self.client, key)
+
+    def load_revision(self, key, language, revision):
+        return store.load_revision(self.client, key, language, revision)
+
+    def save_revision(self, key, language, code, title=None):
+        return store.save_revision(self.client, key, language, code, title)
+
+    def list_revisions(self, key):
+        return store.list_revisions(self.client, key)
+
+    def index_client(self, user_id):
+        return self.client
+
+    def share_languages(self, keys):
+        return store.share_languages(self.client, keys) if keys else []
+
+    def take_tokens(self, user_id, cost):
+        return store.take_tokens(self.client, user_id, cost)
+
+
+class AsyncRedisStorage(AsyncUserIndexMixin):
+    name = "redis"
+
+    def __init__(self, redis_client):
+        self.client = redis_client
+
+    async def save_share(self, share, idem_key=None, response=None):
+        return await store.save_share_async(self.client, share, idem_key, response)
+
+    async def save_shares(self, shares):
+        return await store.save_shares_async(self.client, shares)
+
+    async def load_share(self, key, language):
+        return await store.load_share_async(self.client, key, language)
+
+    async def load_share_etag(self, key):
+        return await store.load_share_etag_async(self.client, key)
+
+    async def load_share_meta(self, key, language):
+        return await store.load_share_meta_async(self.client, key, language)
+
+    async def load_rendered(self, key):
+        return await store.load_rendered_async(self.client, key)
+
+    async def save_rendered(self, key, html):
+        await store.save_rendered_async(self.client, key, html)
+
+    async def load_shares(self, lookups):
+        return await store.load_shares_async(self.client, lookups)
+
+    def iter_share_body(self, key, file_data, start=0, stop=None):
+        return store.iter_share_body_async(self.client, key, file_data, start, stop)
+
+    async def delete_share(self, key):
+        return await store.delete_share_async(self.client, key)
+
+    async def load_revision(self, key, language, revision):
+        return await store.load_revision_async(self.client, key, language, revision)
+
+    async def save_revision(self, key, language, code, title=None):
+        return await store.save_revision_async(self.client, key, language, code, title)
+
+    async def list_revisions(self, key):
+        return await store.list_revisions_async(self.client, key)
+
+    def index_client(self, user_id):
+        return self.client
+
+    async def take_tokens(self, user_id, cost):
+        return await store.take_tokens_async(self.client, user_id, cost)
+
+    async def share_languages(self, keys):
+        return await store.share_languages_async(self.client, keys) if keys else []
+
+
+class NodeUnavailable(redis.ConnectionError):
+    pass
+
+
+class ShardedRedisStorage(UserIndexMixin):
+    name = "redis"
+
+    def __init__(self, clients, ring, previous_ring=None, node_healthy=None):
+        self.clients = clients
+        self.ring = ring
+        self.previous_ring = previous_ring
+        self.node_healthy = node_healthy
+
+    # Only the nodes a request touches have to be up, so one failed node
+    # fails just the keys it owns.
+    def node_client(self, node):
+        if self.node_healthy is not None and not self.node_healthy(node):
+            raise NodeUnavailable(f"Redis node {node} is unavailable")
+        return self.clients[node]
+
+    def owners(self, key):
+        owner = self.ring.node_for_key(key)
+        if self.previous_ring is None:
+            return [owner]
+
+        previous = self.previous_ring.node_for_key(key)
+        if previous == owner:
+            return [owner]
+        # The second look at the new owner catches a key that was moved
+        # between the first two reads.
+        return [owner, previous, owner]
+
+    def client_for(self, key):
+        return self.node_client(self.ring.node_for_key(key))
+
+    def group_by_node(self, keys):
+        groups = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(self.ring.node_for_key(key), []).append(index)
+        return groups
+
+    def save_share(self, share, idem_key=None, response=None):
+        client = self.client_for(share["key"])
+        return store.save_share(client, share, idem_key, response)
+
+    def save_shares(self, shares):
+        results = [None] * len(shares)
+        groups = self.group_by_node([share["key"] for share in shares])
+        for node, indices in groups.items():
+            outcomes = store.save_shares(
+                self.node_client(node), [shares[index] for index in indices]
+            )
+            for index, outcome in zip(indices, outcomes):
+                results[index] = outcome
+        return results
+
+    def load_share(self, key, language):
+        for node in self.owners(key):
+            file_data, ttl = store.load_share(self.node_client(node), key, language)
+            if ttl != -2:
+                return file_data, ttl
+        return None, -2
+
+    def load_share_etag(self, key):
+        for node in self.owners(key):
+            validator, ttl = store.load_share_etag(self.node_client(node), key)
+            if ttl != -2:
+                return validator, ttl
+        return None, -2
+
+    def load_share_meta(self, key, language):
+        for node in self.owners(key):
+            metadata, ttl = store.load_share_meta(self.node_client(node), key, language)
+            if ttl != -2:
+                return metadata, ttl
+        return None, -2
+
+    def load_rendered(self, key):
+        for node in self.owners(key):
+            html, ttl = store.load_rendered(self.node_client(node), key)
+            if ttl != -2:
+                return html, ttl
+        return None, -2
+
+    def save_rendered(self, key, html):
+        # Only the node that still holds the share keeps the render.
+        for node in dict.fromkeys(self.owners(key)):
+            store.save_rendered(self.node_client(node), key, html)
+
+    def load_shares(self, lookups):
+        loaded = [None] * len(lookups)
+        groups = self.group_by_node([key for key, _ in lookups])
+        for node, indices in groups.items():
+            results = store.load_shares(
+                self.node_client(node), [lookups[index] for index in indices]
+            )
+            for index, result in zip(indices, results):
+                loaded[index] = result
+
+        if self.previous_ring is not None:
+            for index, (key, language) in enumerate(lookups):
+                if loaded[index][1] == -2:
+                    loaded[index] = self.load_share(key, language)
+        return loaded
+
+    def body_client(self, key, file_data):
+        owners = self.owners(key)
+        if "chunks" in file_data:
+            for node in owners[:2]:
+                if self.node_client(node).exists(store.chunks_key(key)):
+                    return self.node_client(node)
+        return self.node_client(owners[0])
+
+    def iter_share_body(self, key, file_data, start=0, stop=None):
+        client = self.body_client(key, file_data)
+        return store.iter_share_body(client, key, file_data, start, stop)
+
+    def delete_share(self, key):
+        deleted = False
+        for node in dict.fromkeys(self.owners(key)):
+            deleted = store.delete_share(self.node_client(node), key) or deleted
+        return deleted
+
+    def load_revision(self, key, language, revision):
+        for node in self.owners(key):
+            loaded, ttl = store.load_revision(
+                self.node_client(node), key, language, revision
+            )
+            if ttl != -2:
+                return loaded, ttl
+        return None, -2
+
+    # Revisions are written next to the share, wherever it is found.
+    def save_revision(self, key, language, code, title=None):
+        for node in self.owners(key):
+            info, ttl = store.save_revision(
+                self.node_client(node), key, language, code, title
+            )
+            if ttl != -2:
+                return info, ttl
+        return None, -2
+
+    def list_revisions(self, key):
+        for node in self.owners(key):
+            infos, ttl = store.list_revisions(self.node_client(node), key)
+            if ttl != -2:
+                return infos, ttl
+        return None, -2
+
+    def index_client(self, user_id):
+        return self.node_client(self.ring.node_for(user_index_id(user_id)))
+
+    # New entries go to the index's current node; until the rebalance moves
+    # the rest, older ones are still on its previous node.
+    def index_clients(self, user_id):
+        node = self.ring.node_for(user_index_id(user_id))
+        if self.previous_ring is None:
+            return [self.node_client(node)]
+
+        previous = self.previous_ring.node_for(user_index_id(user_id))
+        return [self.node_client(name) for name in dict.fromkeys([node, previous])]
+
+    def rate_limit_client(self):
+        # Both buckets must live on one node for the script to check them
+        # together, so every user's bucket sits with the global one.
+        return self.node_client(self.ring.node_for(GLOBAL_BUCKET))
+
+    def take_tokens(self, user_id, cost):
+        return store.take_tokens(self.rate_limit_client(), user_id, cost)
+
+    def share_languages(self, keys):
+        found = [False] * len(keys)
+        for node, indices in self.group_by_node(keys).items():
+            results = store.share_languages(
+                self.node_client(node), [keys[index] for index in indices]
+            )
+            for index, language in zip(indices, results):
+                found[index] = language
+
+        if self.previous_ring is not None:
+            for index, key in enumerate(keys):
+                for node in self.owners(key)[1:]:
+                    if found[index] is False:
+                        found[index] = store.share_languages(
+                            self.node_client(node), [key]
+                        )[0]
+        return found
+
+
+class AsyncShardedRedisStorage(AsyncUserIndexMixin, ShardedRedisStorage):
+    async def save_share(self, share, idem_key=None, response=None):
+        client = self.client_for(share["key"])
+        return await store.save_share_async(client, share, idem_key, response)
+
+    async def save_shares(self, shares):
+        results = [None] * len(shares)
+        groups = self.group_by_node([share["key"] for share in shares])
+        for node, indices in groups.items():
+            outcomes = await store.save_shares_async(
+                self.node_client(node), [shares[index] for index in indices]
+            )
+            for index, outcome in zip(indices, outcomes):
+                results[index] = outcome
+        return results
+
+    async def load_share(self, key, language):
+        for node in self.owners(key):
+            file_data, ttl = await store.load_share_async(
+                self.node_client(node), key, language
+            )
+            if ttl != -2:
+                return file_data, ttl
+        return None, -2
+
+    async def load_share_etag(self, key):
+        for node in self.owners(key):
+            validator, ttl = await store.load_share_etag_async(
+                self.node_client(node), key
+            )
+            if ttl != -2:
+                return validator, ttl
+        return None, -2
+
+    async def load_share_meta(self, key, language):
+        for node in self.owners(key):
+            metadata, ttl = await store.load_share_meta_async(
+                self.node_client(node), key, language
+            )
+            if ttl != -2:
+                return metadata, ttl
+        return None, -2
+
+    async def load_rendered(self, key):
+        for node in self.owners(key):
+            html, ttl = await store.load_rendered_async(self.node_client(node), key)
+            if ttl != -2:
+                return html, ttl
+        return None, -2
+
+    async def save_rendered(self, key, html):
+        for node in dict.fromkeys(self.owners(key)):
+            await store.save_rendered_async(self.node_client(node), key, html)
+
+    async def load_shares(self, lookups):
+        loaded = [None] * len(lookups)
+        groups = self.group_by_node([key for key, _ in lookups])
+        for node, indices in groups.items():
+            results = await store.load_shares_async(
+                self.node_client(node), [lookups[index] for index in indices]
+            )
+            for index, result in zip(indices, results):
+                loaded[index] = result
+
+        if self.previous_ring is not None:
+            for index, (key, language) in enumerate(lookups):
+                if loaded[index][1] == -2:
+                    loaded[index] = await self.load_share(key, language)
+        return loaded
+
+    async def body_client(self, key, file_data):
+        owners = self.owners(key)
+        if "chunks" in file_data:
+            for node in owners[:2]:
+                if await self.node_client(node).exists(store.chunks_key(key)):
+                    return self.node_client(node)
+        return self.node_client(owners[0])
+
+    async def iter_share_body(self, key, file_data, start=0, stop=None):
+        client = await self.body_client(key, file_data)
+        async for chunk in store.iter_share_body_async(
+            client, key, file_data, start, stop
+        ):
+            yield chunk
+
+    async def delete_share(self, key):
+        deleted = False
+        for node in dict.fromkeys(self.owners(key)):
+            deleted = (
+                await store.delete_share_async(self.node_client(node), key) or deleted
+            )
+        return deleted
+
+    async def load_revision(self, key, language, revision):
+        for node in self.owners(key):
+            loaded, ttl = await store.load_revision_async(
+                self.node_client(node), key, language, revision
+            )
+            if ttl != -2:
+                return loaded, ttl
+        return None, -2
+
+    async def save_revision(self, key, language, code, title=None):
+        for node in self.owners(key):
+            info, ttl = await store.save_revision_async(
+                self.node_client(node), key, language, code, title
+            )
+            if ttl != -2:
+                return info, ttl
+        return None, -2
+
+    async def list_revisions(self, key):
+        for node in self.owners(key):
+            infos, ttl = await store.list_revisions_async(self.node_client(node), key)
+            if ttl != -2:
+                return infos, ttl
+        return None, -2
+
+    async def take_tokens(self, user_id, cost):
+        return await store.take_tokens_async(self.rate_limit_client(), user_id, cost)
+
+    async def share_languages(self, keys):
+        found = [False] * len(keys)
+        for node, indices in self.group_by_node(keys).items():
+            results = await store.share_languages_async(
+                self.node_client(node), [keys[index] for index in indices]
+            )
+            for index, language in zip(indices, results):
+                found[index] = language
+
+        if self.previous_ring is not None:
+            for index, key in enumerate(keys):
+                for node in self.owners(key)[1:]:
+                    if found[index] is False:
+                        languages = await store.share_languages_async(
+                            self.node_client(node), [key]
+                        )
+                        found[index] = languages[0]
+        return found
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shares (
+    key TEXT PRIMARY KEY,
+    record BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shares_expires_at ON shares (expires_at);
+CREATE TABLE IF NOT EXISTS share_meta (
+    key TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS share_meta_expires_at ON share_meta (expires_at);
+CREATE TABLE IF NOT EXISTS share_html (
+    key TEXT PRIMARY KEY,
+    html BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS share_revisions (
+    key TEXT NOT NULL,
+    revision INTEGER NOT NULL,
+    record BLOB NOT NULL,
+    info TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (key, revision)
+);
+CREATE INDEX IF NOT EXISTS share_revisions_expires_at
+    ON share_revisions (expires_at);
+CREATE TABLE IF NOT EXISTS idempotency (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idempotency_expires_at ON idempotency (expires_at);
+CREATE TABLE IF NOT EXISTS user_shares (
+    user_id TEXT NOT NULL,
+    share_id TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (user_id, share_id)
+);
+CREATE INDEX IF NOT EXISTS user_shares_page
+    ON user_shares (user_id, expires_at, share_id);
+CREATE TABLE IF NOT EXISTS rate_limits (
+    bucket TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_ms INTEGER NOT NULL
+);
+"""
+
+
+def remaining_ttl(expires_at, now):
+    return max(math.ceil(expires_at - now), 0)
+
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.executescript(SQLITE_SCHEMA)
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.create_function("share_key", 1, share_key, deterministic=True)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def insert_share(self, connection, share):
+        metadata = share_metadata(share["file_data"], owner=share.get("owner"))
+        # Expired rows linger until the next purge, so only those may be reused.
+        inserted = connection.execute(
+            "INSERT INTO shares (key, record, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "record = excluded.record, expires_at = excluded.expires_at "
+            "WHERE shares.expires_at <= ?",
+            (
+                share["key"],
+                encode_share(share["file_data"], etag=metadata["etag"]),
+                share["expires_at"],
+                time.time(),
+            ),
+        ).rowcount
+        if not inserted:
+            raise ShareIdTaken(share["share_id"])
+        # Revisions of an expired share that used this key are not its own.
+        connection.execute("DELETE FROM share_revisions WHERE key = ?", (share["key"],))
+        # Kept out of the shares row so reading it never pages in the body.
+        connection.execute(
+            "INSERT OR REPLACE INTO share_meta (key, meta, expires_at) "
+            "VALUES (?, ?, ?)",
+            (
+                share["key"],
+                dumps_json(metadata).decode("utf-8"),
+                share["expires_at"],
+            ),
+        )
+
+    def save_share(self, share, idem_key=None, response=None):
+        now = time.time()
+        with self.connection() as connection:
+            if idem_key:
+                row = connection.execute(
+                    "SELECT response FROM idempotency WHERE key = ? AND expires_at > ?",
+                    (idem_key, now),
+                ).fetchone()
+                if row:
+                    return loads_json(row[0])
+
+                connection.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, response, expires_at) "
+                    "VALUES (?, ?, ?)",
+                    (
+                        idem_key,
+                        dumps_json(response).decode("utf-8"),
+                        share["expires_at"],
+                    ),
+                )
+            self.insert_share(connection, share)
+
+        return None
+
+    def save_shares(self, shares):
+        outcomes = []
+        with self.connection() as connection:
+            for share in shares:
+                try:
+                    self.insert_share(connection, share)
+                    outcomes.append(None)
+                except ShareIdTaken as e:
+                    outcomes.append(e)
+        return outcomes
+
+    def load_record(self, key):
+        now = time.time()
+        row = (
+            self.connection()
+            .execute(
+                "SELECT record, expires_at FROM shares WHERE key = ? AND expires_at > ?",
+                (key, now),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None, -2
+        return row[0], remaining_ttl(row[1], now)
+
+    def load_share(self, key, language):
+        raw, ttl = self.load_record(key)
+        if raw is None:
+            return None, ttl
+        return render_loaded(raw, language), ttl
+
+    def load_share_etag(self, key):
+        raw, ttl = self.load_record(key)
+        etag = share_header(raw).get("g") if raw is not None else None
+        if etag is None:
+            return None, ttl
+        return ShareValidator(etag, content_encoding(unpack_header(raw)[1])), ttl
+
+    def load_share_meta(self, key, language):
+        now = time.time()
+        row = (
+            self.connection()
+            .execute(
+                "SELECT meta, expires_at FROM share_meta "
+                "WHERE key = ? AND expires_at > ?",
+                (key, now),
+            )
+            .fetchone()
+        )
+        if row is not None:
+            return loads_json(row[0]), remaining_ttl(row[1], now)
+
+        share, ttl = self.load_share(key, language)
+        return (loaded_share_metadata(share) if share else None), ttl
+
+    def load_rendered(self, key):
+        now = time.time()
+        row = (
+            self.connection()
+            .execute(
+                "SELECT html, expires_at FROM share_html "
+                "WHERE key = ? AND expires_at > ?",
+                (key, now),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None, -2
+        return decode_rendered(row[0]), remaining_ttl(row[1], now)
+
+    def save_rendered(self, key, html):
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO share_html (key, html, expires_at) "
+                "SELECT key, ?, expires_at FROM shares WHERE key = ? AND expires_at > ?",
+                (encode_rendered(html), key, time.time()),
+            )
+
+    def load_shares(self, lookups):
+        return [self.load_share(key, language) for key, language in lookups]
+
+    def iter_share_body(self, key, file_data, start=0, stop=None):
+        yield file_data["code"].encode("utf-8")[start:stop]
+
+    def delete_share(self, key):
+        with self.connection() as connection:
+            deleted = connection.execute(
+                "DELETE FROM shares WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).rowcount
+            connection.execute("DELETE FROM share_meta WHERE key = ?", (key,))
+            connection.execute("DELETE FROM share_html WHERE key = ?", (key,))
+            connection.execute("DELETE FROM share_revisions WHERE key = ?", (key,))
+        return deleted > 0
+
+    def load_revision(self, key, language, revision):
+        raw, ttl = self.load_record(key)
+        if raw is None:
+            return None, ttl
+
+        connection = self.connection()
+        if revision < 0:
+            revision = connection.execute(
+                "SELECT COALESCE(MAX(revision), 0) FROM share_revisions WHERE key = ?",
+                (key,),
+            ).fetchone()[0]
+
+        info = None
+        snapshot = 0
+        if revision > 0:
+            row = connection.execute(
+                "SELECT info FROM share_revisions WHERE key = ? AND revision = ?",
+                (key, revision),
+            ).fetchone()
+            if row is None:
+                return None, ttl
+            info = row[0]
+            snapshot = loads_json(info)["snapshot"]
+
+        records = [
+            row[0]
+            for row in connection.execute(
+                "SELECT record FROM share_revisions "
+                "WHERE key = ? AND revision BETWEEN ? AND ? ORDER BY revision",
+                (key, max(snapshot, 1), revision),
+            )
+        ]
+        raw = raw if snapshot == 0 else None
+        return loaded_revision(raw, None, info, records, language), ttl
+
+    def save_revision(self, key, language, code, title=None):
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            latest, ttl = self.load_revision(key, language, -1)
+            if latest is None:
+                return None, ttl
+
+            record, info = new_revision(latest, code, title)
+            connection.execute(
+                "INSERT INTO share_revisions "
+                "(key, revision, record, info, expires_at) "
+                "SELECT key, ?, ?, ?, expires_at FROM shares WHERE key = ?",
+                (info["revision"], record, dumps_json(info).decode("utf-8"), key),
+            )
+        return info, ttl
+
+    def list_revisions(self, key):
+        now = time.time()
+        connection = self.connection()
+        row = connection.execute(
+            "SELECT expires_at FROM shares WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None, -2
+
+        infos = connection.execute(
+            "SELECT info FROM share_revisions WHERE key = ? ORDER BY revision",
+            (key,),
+        ).fetchall()
+        return [loads_json(info) for info, in infos], remaining_ttl(row[0], now)
+
+    def index_shares(self, user_id, shares):
+        with self.connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO user_shares (user_id, share_id, expires_at) "
+                "VALUES (?, ?, ?)",
+                [(user_id, *entry) for entry in index_entries(shares)],
+            )
+
+    def unindex_share(self, user_id, share_id):
+        with self.connection() as connection:
+            connection.execute(
+                "DELETE FROM user_shares WHERE user_id = ? AND share_id = ?",
+                (user_id, share_id),
+            )
+
+    def list_user_shares(self, user_id, cursor, limit):
+        now = time.time()
+        expires_at, share_id = cursor or (now, "")
+        connection = self.connection()
+        entries = connection.execute(
+            "SELECT user_shares.share_id, CAST(user_shares.expires_at AS INTEGER), "
+            "json_extract(share_meta.meta, '$.language') "
+            "FROM user_shares "
+            "JOIN shares ON shares.key = share_key(user_shares.share_id) "
+            "LEFT JOIN share_meta ON share_meta.key = shares.key "
+            "WHERE user_id = ? AND user_shares.expires_at > ? "
+            "AND (user_shares.expires_at, user_shares.share_id) > (?, ?) "
+            "ORDER BY user_shares.expires_at, user_shares.share_id LIMIT ?",
+            (user_id, now, expires_at, share_id, limit),
+        ).fetchall()
+        total = connection.execute(
+            "SELECT COUNT(*) FROM user_shares WHERE user_id = ? AND expires_at > ?",
+            (user_id, now),
+        ).fetchone()[0]
+
+        next_cursor = entries[-1] if len(entries) == limit else None
+        return entries, next_cursor, total
+
+    def take_tokens(self, user_id, cost):
+        now_ms = int(time.time() * 1000)
+        buckets = [bucket_key(user_bucket(user_id)), bucket_key(GLOBAL_BUCKET)]
+        with self.connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            levels = []
+            for bucket, (rate, burst) in zip(buckets, bucket_limits()):
+                if rate <= 0:
+                    levels.append(None)
+                    continue
+                row = connection.execute(
+                    "SELECT tokens, updated_ms FROM rate_limits WHERE bucket = ?",
+                    (bucket,),
+                ).fetchone()
+                tokens, updated_ms = row or (None, now_ms)
+                levels.append(refill(tokens, updated_ms, now_ms, rate, burst))
+
+            allowed, wait_ms, limited = admit(levels, cost)
+            if allowed and cost > 0:
+                for index, level in enumerate(levels):
+                    if level is None:
+                        continue
+                    levels[index] -= cost
+                    connection.execute(
+                        "INSERT OR REPLACE INTO rate_limits (bucket, tokens, updated_ms) "
+                        "VALUES (?, ?, ?)",
+                        (buckets[index], levels[index], now_ms),
+                    )
+
+        return rate_limit_result(allowed, wait_ms, limited, levels)
+
+    def purge_expired(self):
+        now = time.time()
+        with self.connection() as connection:
+            shares = connection.execute(
+                "DELETE FROM shares WHERE expires_at <= ?", (now,)
+            ).rowcount
+            connection.execute("DELETE FROM share_meta WHERE expires_at <= ?", (now,))
+            connection.execute("DELETE FROM share_html WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "DELETE FROM share_revisions WHERE expires_at <= ?", (now,)
+            )
+            connection.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+            connection.execute("DELETE FROM user_shares WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "DELETE FROM rate_limits WHERE updated_ms <= ?",
+                (int(now * 1000) - refill_ms(),),
+            )
+            connection.execute(
+                "DELETE FROM user_shares WHERE NOT EXISTS (SELECT 1 FROM shares "
+                "WHERE shares.key = share_key(user_shares.share_id))"
+            )
+        self.connection().execute("PRAGMA incremental_vacuum")
+        return shares
+
+    def purge_loop(self):
+        while True:
+            time.sleep(SQLITE_PURGE_INTERVAL)
+            try:
+                purged = self.purge_expired()
+                if purged:
+                    logger.info("Purged %s expired shares from SQLite.", purged)
+            except sqlite3.Error as e:
+                logger.error("Failed to purge expired shares from SQLite: %s", e)
+
+
+class AsyncSQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def save_share(self, share, idem_key=None, response=None):
+        return await asyncio.to_thread(
+            self.storage.save_share, share, idem_key, response
+        )
+
+    async def save_shares(self, shares):
+        return await asyncio.to_thread(self.storage.save_shares, shares)
+
+    async def load_share(self, key, language):
+        return await asyncio.to_thread(self.storage.load_share, key, language)
+
+    async def load_share_etag(self, key):
+        return await asyncio.to_thread(self.storage.load_share_etag, key)
+
+    async def load_share_meta(self, key, language):
+        return await asyncio.to_thread(self.storage.load_share_meta, key, language)
+
+    async def load_rendered(self, key):
+        return await asyncio.to_thread(self.storage.load_rendered, key)
+
+    async def save_rendered(self, key, html):
+        await asyncio.to_thread(self.storage.save_rendered, key, html)
+
+    async def load_shares(self, lookups):
+        return await asyncio.to_thread(self.storage.load_shares, lookups)
+
+    async def iter_share_body(self, key, file_data, start=0, stop=None):
+        yield file_data["code"].encode("utf-8")[start:stop]
+
+    async def delete_share(self, key):
+        return await asyncio.to_thread(self.storage.delete_share, key)
+
+    async def load_revision(self, key, language, revision):
+        return await asyncio.to_thread(
+            self.storage.load_revision, key, language, revision
+        )
+
+    async def save_revision(self, key, language, code, title=None):
+        return await asyncio.to_thread(
+            self.storage.save_revision, key, language, code, title
+        )
+
+    async def list_revisions(self, key):
+        return await asyncio.to_thread(self.storage.list_revisions, key)
+
+    async def index_shares(self, user_id, shares):
+        return await asyncio.to_thread(self.storage.index_shares, user_id, shares)
+
+    async def unindex_share(self, user_id, share_id):
+        return await asyncio.to_thread(self.storage.unindex_share, user_id, share_id)
+
+    async def list_user_shares(self, user_id, cursor, limit):
+        return await asyncio.to_thread(
+            self.storage.list_user_shares, user_id, cursor, limit
+        )
+
+    async def take_tokens(self, user_id, cost):
+        return await asyncio.to_thread(self.storage.take_tokens, user_id, cost)
+
+
+sqlite_storage = None
+_sqlite_storage_lock = threading.Lock()
+_sqlite_storage_pid = None
+
+
+def init_sqlite_storage():
+    global sqlite_storage, _sqlite_storage_pid
+    with _sqlite_storage_lock:
+        if sqlite_storage is not None and _sqlite_storage_pid == os.getpid():
+            return sqlite_storage
+
+        sqlite_storage = SQLiteStorage(SQLITE_PATH)
+        _sqlite_storage_pid = os.getpid()
+        threading.Thread(
+            target=sqlite_storage.purge_loop, name="sqlite-purge", daemon=True
+        ).start()
+        logger.info("Using embedded SQLite storage at %s", SQLITE_PATH)
+        return sqlite_storage
@@ -0,0 +1,678 @@
+import os
+import time
+import asyncio
+import hashlib
+from codec import (
+    encode_share,
+    encode_chunked_share,
+    encode_chunk,
+    encode_blob,
+    decode_chunk,
+    decode_rendered,
+    decode_metadata,
+    dumps_json,
+    encode_metadata,
+    encode_rendered,
+    loaded_share_metadata,
+    loads_json,
+    render_loaded,
+    share_blob_hash,
+    share_metadata,
+    BLOB_DIGEST_SIZE,
+    content_encoding,
+    ShareValidator,
+    COMPRESSION_MASK,
+)
+from scripts import run_script, run_script_async, run_scripts, run_scripts_async
+from metrics import observe_redis
+from ratelimit import rate_limit_call, decode_rate_limit
+from revisions import (
+    SHARE_REVISION_ATTEMPTS,
+    RevisionConflict,
+    loaded_revision,
+    new_revision,
+)
+from cache import (
+    INVALIDATION_CHANNEL,
+    share_cache,
+    start_invalidation_listener,
+)
+
+SHARE_DEDUP_MIN_SIZE = int(os.getenv("SHARE_DEDUP_MIN_SIZE", "512"))
+SHARE_CHUNK_THRESHOLD = int(os.getenv("SHARE_CHUNK_THRESHOLD", str(1024 * 1024)))
+SHARE_CHUNK_SIZE = int(os.getenv("SHARE_CHUNK_SIZE", str(256 * 1024)))
+SHARE_DELETE_ATTEMPTS = 3
+# Version and flag bytes, then the blob digest of blob-backed records.
+SHARE_BLOB_HEADER_SIZE = 2 + BLOB_DIGEST_SIZE
+
+
+def blob_hash(code):
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+def blob_key(digest):
+    return f"blob:{digest}"
+
+
+def blob_refs_key(digest):
+    return f"blob:{digest}:refs"
+
+
+class ShareIdTaken(Exception):
+    """Raised when a new share id is already in use by a live share."""
+
+
+class ShareChanged(Exception):
+    """Raised when a share kept being replaced while it was being deleted."""
+
+
+# Matches share records but not their chunks, metadata or rendered HTML.
+SHARE_KEY_PATTERNS = ("file:*:data", "s:??????????")
+
+
+# Shares stored under file:<language>-<uuid>:data keep their long suffixes;
+# compact s:<id> shares use one-letter ones.
+def related_key(key, legacy_suffix, suffix):
+    if key.endswith(":data"):
+        return key.removesuffix(":data") + legacy_suffix
+    return key + suffix
+
+
+def chunks_key(key):
+    return related_key(key, ":chunks", ":c")
+
+
+def meta_key(key):
+    return related_key(key, ":meta", ":m")
+
+
+def render_key(key):
+    return related_key(key, ":html", ":h")
+
+
+def revisions_key(key):
+    return related_key(key, ":revisions", ":r")
+
+
+def idempotency_key(user_id, key):
+    return f"idem:{user_id}:{key}"
+
+
+def user_index_key(user_id):
+    return f"user:{user_id}:shares"
+
+
+def share_put_call(share, idem_key=None, response=None):
+    file_data = share["file_data"]
+    ttl = share["ttl"]
+    idem_keys = [idem_key] if idem_key else []
+    response = dumps_json(response) if idem_key else ""
+
+    metadata = share_metadata(file_data, owner=share.get("owner"))
+    meta = encode_metadata(metadata)
+    keys = [share["key"], meta_key(share["key"])]
+
+    body = file_data["code"].encode("utf-8")
+    if len(body) > SHARE_CHUNK_THRESHOLD:
+        chunks = [
+            encode_chunk(body[offset : offset + SHARE_CHUNK_SIZE])
+            for offset in range(0, len(body), SHARE_CHUNK_SIZE)
+        ]
+        record = encode_chunked_share(
+            file_data,
+            share["expires_at"],
+            len(body),
+            len(chunks),
+            SHARE_CHUNK_SIZE,
+            metadata["etag"],
+        )
+        return (
+            "share_put_chunked",
+            [*keys, chunks_key(share["key"]), *idem_keys],
+            [record, ttl, response, len(chunks), *chunks, *meta],
+        )
+
+    if len(file_data["code"]) < SHARE_DEDUP_MIN_SIZE:
+        record = encode_share(file_data, etag=metadata["etag"])
+        return (
+            "share_put",
+            [*keys, *idem_keys],
+            [record, ttl, response, *meta],
+        )
+
+    digest = blob_hash(file_data["code"])
+    record = encode_share(file_data, digest, metadata["etag"])
+    return (
+        "share_put_blob",
+        [*keys, blob_key(digest), blob_refs_key(digest), *idem_keys],
+        [record, ttl, encode_blob(file_data["code"]), response, *meta],
+    )
+
+
+def user_index_call(user_id, entries, ttl):
+    args = [ttl]
+    for share_id, expires_at in entries:
+        args += [expires_at, share_id]
+    return "user_index_add", [user_index_key(user_id)], args
+
+
+def user_index_page_call(user_id, cursor, limit):
+    expires_at, share_id = cursor or ("", "")
+    return (
+        "user_index_page",
+        [user_index_key(user_id)],
+        [int(time.time()), limit, expires_at, share_id],
+    )
+
+
+def decode_user_index_page(result):
+    total, page = result
+    entries = [
+        (page[index].decode("utf-8"), int(float(page[index + 1])))
+        for index in range(0, len(page), 2)
+    ]
+    return total, entries
+
+
+# Batch reads fetch every blob they need with one MGET once the records are
+# in, instead of a GET per blob-backed share.
+def loaded_blob_hashes(results):
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return [share_blob_hash(raw) if raw is not None else None for raw, _ in results]
+
+
+def blob_keys(digests):
+    return [blob_key(digest) for digest in digests if digest]
+
+
+def loaded_blobs(digests, blobs):
+    blobs = iter(blobs)
+    return [next(blobs) if digest else None for digest in digests]
+
+
+def loaded_blob_share(key, result, digest, blob, language, generation):
+    raw, ttl = result
+    if digest and blob is None:
+        return None, -2
+    return render_loaded_share(key, (raw, ttl, blob), language, generation)
+
+
+def render_loaded_share(key, result, language, generation):
+    raw, ttl, blob = result
+    if raw is None:
+        return None, ttl
+
+    share = render_loaded(raw, language, blob)
+    if not isinstance(share, dict):
+        share_cache.set(key, share, ttl, generation)
+    return share, ttl
+
+
+def revision_get_call(key, revision):
+    return "share_revision_get", [key, revisions_key(key)], [revision]
+
+
+def revision_put_call(key, latest, code, title):
+    record, info = new_revision(latest, code, title)
+    return (
+        "share_revision_put",
+        [key, revisions_key(key)],
+        [info["revision"], record, dumps_json(info)],
+    ), info
+
+
+def decode_revision_list(result):
+    infos, ttl = result
+    return ([loads_json(info) for info in infos] if infos is not None else None), ttl
+
+
+# Blob-backed shares are sent in their blob's compression, which is the low
+# bits of its flag byte.
+def blob_compression(head):
+    return head[1] & COMPRESSION_MASK if len(head) > 1 else 0
+
+
+def share_validator(etag, ttl, compression):
+    if not etag:
+        return None, ttl
+    return ShareValidator(etag.decode("ascii"), content_encoding(compression)), ttl
+
+
+def chunk_range(file_data, start, stop):
+    chunk_size = file_data["chunk_size"]
+    return range(start // chunk_size, (stop - 1) // chunk_size + 1)
+
+
+def slice_chunk(file_data, index, chunk, start, stop):
+    offset = index * file_data["chunk_size"]
+    return chunk[max(start - offset, 0) : stop - offset]
+
+
+def iter_share_body(redis_client, key, file_data, start=0, stop=None):
+    if "chunks" not in file_data:
+        yield file_data["code"].encode("utf-8")[start:stop]
+        return
+
+    stop = file_data["size"] if stop is None else stop
+    for index in chunk_range(file_data, start, stop):
+        started = time.perf_counter()
+        chunk = redis_client.hget(chunks_key(key), index)
+        observe_redis("chunk_read", started)
+        if chunk is None:
+            raise ValueError(f"Missing chunk {index} for {key}")
+        yield slice_chunk(file_data, index, decode_chunk(chunk), start, stop)
+
+
+def saved_share(share, existing):
+    if existing == 1:
+        raise ShareIdTaken(share["share_id"])
+    return loads_json(existing) if existing else None
+
+
+def saved_shares(shares, results):
+    return [
+        ShareIdTaken(share["share_id"]) if result == 1 else result
+        for share, result in zip(shares, results)
+    ]
+
+
+def save_share(redis_client, share, idem_key=None, response=None):
+    existing = run_script(redis_client, *share_put_call(share, idem_key, response))
+    return saved_share(share, existing)
+
+
+def save_shares(redis_client, shares):
+    results = run_scripts(redis_client, [share_put_call(share) for share in shares])
+    return saved_shares(shares, results)
+
+
+def load_share(redis_client, key, language):
+    start_invalidation_listener(redis_client)
+    share, ttl = share_cache.get(key)
+    if share:
+        return share, ttl
+
+    generation = share_cache.generation(key)
+    raw, ttl = run_script(redis_client, "share_get", [key])
+    digest = share_blob_hash(raw) if raw is not None else None
+    blob = redis_client.get(blob_key(digest)) if digest else None
+    if digest and blob is None:
+        return None, -2
+
+    return render_loaded_share(key, (raw, ttl, blob), language, generation)
+
+
+def load_share_etag(redis_client, key):
+    share, ttl = share_cache.get(key)
+    if share:
+        return ShareValidator(share.etag, share.encoding), ttl
+
+    etag, ttl, compression, digest = run_script(redis_client, "share_etag", [key])
+    if etag and digest:
+        head = redis_client.getrange(blob_key(digest.decode("ascii")), 0, 1)
+        compression = blob_compression(head)
+    return share_validator(etag, ttl, compression)
+
+
+def load_share_meta(redis_client, key, language):
+    fields, ttl = run_script(redis_client, "share_meta", [key, meta_key(key)])
+    if fields:
+        return decode_metadata(fields), ttl
+    if ttl < 0:
+        return None, ttl
+
+    share, ttl = load_share(redis_client, key, language)
+    return (loaded_share_metadata(share) if share else None), ttl
+
+
+def load_rendered(redis_client, key):
+    raw, ttl = run_script(redis_client, "share_render_get", [key, render_key(key)])
+    return (decode_rendered(raw) if raw else None), ttl
+
+
+def save_rendered(redis_client, key, html):
+    run_script(
+        redis_client,
+        "share_render_put",
+        [key, render_key(key)],
+        [encode_rendered(html)],
+    )
+
+
+def load_shares(redis_client, lookups):
+    start_invalidation_listener(redis_client)
+    loaded = [share_cache.get(key) for key, _ in lookups]
+    misses = [index for index, (share, _) in enumerate(loaded) if not share]
+    generations = [share_cache.generation(lookups[index][0]) for index in misses]
+
+    results = run_scripts(
+        redis_client,
+        [("share_get", [lookups[index][0]], []) for index in misses],
+        transaction=False,
+    )
+
+    digests = loaded_blob_hashes(results)
+    blobs = redis_client.mget(blob_keys(digests)) if any(digests) else []
+    for index, generation, result, digest, blob in zip(
+        misses, generations, results, digests, loaded_blobs(digests, blobs)
+    ):
+        key, language = lookups[index]
+        loaded[index] = loaded_blob_share(
+            key, result, digest, blob, language, generation
+        )
+
+    return loaded
+
+
+def share_delete_call(key, digest):
+    keys = [key, chunks_key(key), meta_key(key), render_key(key), revisions_key(key)]
+    if digest:
+        keys += [blob_key(digest), blob_refs_key(digest)]
+    return "share_delete", keys, [INVALIDATION_CHANNEL, digest or ""]
+
+
+# The blob key has to be passed to share_delete, so its digest is read from
+# the record's header first; version 1 records need the whole record.
+def stored_blob_hash(redis_client, key):
+    head = redis_client.getrange(key, 0, SHARE_BLOB_HEADER_SIZE - 1)
+    if head[:1] == b"\x01":
+        head = redis_client.get(key)
+    return share_blob_hash(head) if head else None
+
+
+def deleted_share(key, deleted):
+    if deleted < 0:
+        return None
+    share_cache.invalidate(key)
+    return bool(deleted)
+
+
+def delete_share(redis_client, key):
+    for _ in range(SHARE_DELETE_ATTEMPTS):
+        digest = stored_blob_hash(redis_client, key)
+        call = share_delete_call(key, digest)
+        deleted = deleted_share(key, run_script(redis_client, *call))
+        if deleted is not None:
+            return deleted
+    raise ShareChanged(key)
+
+
+def load_revision(redis_client, key, language, revision):
+    raw, ttl, info, records = run_script(
+        redis_client, *revision_get_call(key, revision)
+    )
+    if raw is None and info is None:
+        return None, ttl
+
+    digest = share_blob_hash(raw) if raw is not None else None
+    blob = redis_client.get(blob_key(digest)) if digest else None
+    if digest and blob is None:
+        return None, -2
+    return loaded_revision(raw, blob, info, records, language), ttl
+
+
+# Revisions are numbered in order, so a writer that loses the race for the
+# next number rebuilds the delta against the revision that won.
+def save_revision(redis_client, key, language, code, title=None):
+    for _ in range(SHARE_REVISION_ATTEMPTS):
+        latest, ttl = load_revision(redis_client, key, language, -1)
+        if latest is None:
+            return None, ttl
+
+        call, info = revision_put_call(key, latest, code, title)
+        written = run_script(redis_client, *call)
+        if written < 0:
+            return None, -2
+        if written:
+            return info, ttl
+    raise RevisionConflict("The file is being revised by someone else")
+
+
+def list_revisions(redis_client, key):
+    return decode_revision_list(
+        run_script(redis_client, "share_revision_list", [key, revisions_key(key)])
+    )
+
+
+def index_user_shares(redis_client, user_id, entries, ttl):
+    run_script(redis_client, *user_index_call(user_id, entries, ttl))
+
+
+def unindex_user_shares(redis_client, user_id, share_ids):
+    redis_client.zrem(user_index_key(user_id), *share_ids)
+
+
+def load_user_index(redis_client, user_id, cursor, limit):
+    result = run_script(redis_client, *user_index_page_call(user_id, cursor, limit))
+    return decode_user_index_page(result)
+
+
+def take_tokens(redis_client, user_id, cost):
+    return decode_rate_limit(run_script(redis_client, *rate_limit_call(user_id, cost)))
+
+
+def share_language_calls(pipe, keys):
+    for key in keys:
+        pipe.exists(key)
+        pipe.hget(meta_key(key), "language")
+
+
+# False for shares that are gone, otherwise the language from the metadata
+# hash (None for shares stored before it existed).
+def decode_share_languages(results):
+    return [
+        (language.decode("utf-8") if language else None) if found else False
+        for found, language in zip(results[::2], results[1::2])
+    ]
+
+
+def scan_shares(redis_client, batch_size):
+    for pattern in SHARE_KEY_PATTERNS:
+        for key in redis_client.scan_iter(match=pattern, count=batch_size):
+            yield key.decode("utf-8")
+
+
+def share_languages(redis_client, keys):
+    pipe = redis_client.pipeline(transaction=False)
+    share_language_calls(pipe, keys)
+    return decode_share_languages(pipe.execute())
+
+
+async def save_share_async(redis_client, share, idem_key=None, response=None):
+    existing = await run_script_async(
+        redis_client, *share_put_call(share, idem_key, response)
+    )
+    return saved_share(share, existing)
+
+
+async def save_shares_async(redis_client, shares):
+    results = await run_scripts_async(
+        redis_client, [share_put_call(share) for share in shares]
+    )
+    return saved_shares(shares, results)
+
+
+async def load_share_async(redis_client, key, language):
+    share, ttl = share_cache.get(key)
+    if share:
+        return share, ttl
+
+    generation = share_cache.generation(key)
+    raw, ttl = await run_script_async(redis_client, "share_get", [key])
+    digest = share_blob_hash(raw) if raw is not None else None
+    blob = await redis_client.get(blob_key(digest)) if digest else None
+    if digest and blob is None:
+        return None, -2
+
+    return render_loaded_share(key, (raw, ttl, blob), language, generation)
+
+
+async def load_share_etag_async(redis_client, key):
+    share, ttl = share_cache.get(key)
+    if share:
+        return ShareValidator(share.etag, share.encoding), ttl
+
+    etag, ttl, compression, digest = await run_script_async(
+        redis_client, "share_etag", [key]
+    )
+    if etag and digest:
+        head = await redis_client.getrange(blob_key(digest.decode("ascii")), 0, 1)
+        compression = blob_compression(head)
+    return share_validator(etag, ttl, compression)
+
+
+async def load_share_meta_async(redis_client, key, language):
+    fields, ttl = await run_script_async(
+        redis_client, "share_meta", [key, meta_key(key)]
+    )
+    if fields:
+        return decode_metadata(fields), ttl
+    if ttl < 0:
+        return None, ttl
+
+    share, ttl = await load_share_async(redis_client, key, language)
+    return (loaded_share_metadata(share) if share else None), ttl
+
+
+async def load_rendered_async(redis_client, key):
+    raw, ttl = await run_script_async(
+        redis_client, "share_render_get", [key, render_key(key)]
+    )
+    return (decode_rendered(raw) if raw else None), ttl
+
+
+async def save_rendered_async(redis_client, key, html):
+    await run_script_async(
+        redis_client,
+        "share_render_put",
+        [key, render_key(key)],
+        [encode_rendered(html)],
+    )
+
+
+async def load_shares_async(redis_client, lookups):
+    loaded = [share_cache.get(key) for key, _ in lookups]
+    misses = [index for index, (share, _) in enumerate(loaded) if not share]
+    generations = [share_cache.generation(lookups[index][0]) for index in misses]
+
+    results = await run_scripts_async(
+        redis_client,
+        [("share_get", [lookups[index][0]], []) for index in misses],
+        transaction=False,
+    )
+
+    digests = loaded_blob_hashes(results)
+    blobs = await redis_client.mget(blob_keys(digests)) if any(digests) else []
+    for index, generation, result, digest, blob in zip(
+        misses, generations, results, digests, loaded_blobs(digests, blobs)
+    ):
+        key, language = lookups[index]
+        loaded[index] = loaded_blob_share(
+            key, result, digest, blob, language, generation
+        )
+
+    return loaded
+
+
+async def iter_share_body_async(redis_client, key, file_data, start=0, stop=None):
+    if "chunks" not in file_data:
+        yield file_data["code"].encode("utf-8")[start:stop]
+        return
+
+    stop = file_data["size"] if stop is None else stop
+    for index in chunk_range(file_data, start, stop):
+        started = time.perf_counter()
+        chunk = await redis_client.hget(chunks_key(key), index)
+        observe_redis("chunk_read", started)
+        if chunk is None:
+            raise ValueError(f"Missing chunk {index} for {key}")
+        yield slice_chunk(file_data, index, decode_chunk(chunk), start, stop)
+
+
+async def stored_blob_hash_async(redis_client, key):
+    head = await redis_client.getrange(key, 0, SHARE_BLOB_HEADER_SIZE - 1)
+    if head[:1] == b"\x01":
+        head = await redis_client.get(key)
+    return share_blob_hash(head) if head else None
+
+
+async def delete_share_async(redis_client, key):
+    for _ in range(SHARE_DELETE_ATTEMPTS):
+        digest = await stored_blob_hash_async(redis_client, key)
+        call = share_delete_call(key, digest)
+        deleted = deleted_share(key, await run_script_async(redis_client, *call))
+        if deleted is not None:
+            return deleted
+    raise ShareChanged(key)
+
+
+async def load_revision_async(redis_client, key, language, revision):
+    raw, ttl, info, records = await run_script_async(
+        redis_client, *revision_get_call(key, revision)
+    )
+    if raw is None and info is None:
+        return None, ttl
+
+    digest = share_blob_hash(raw) if raw is not None else None
+    blob = await redis_client.get(blob_key(digest)) if digest else None
+    if digest and blob is None:
+        return None, -2
+    # Replaying deltas and diffing are CPU-bound, so they run off the loop.
+    loaded = await asyncio.to_thread(
+        loaded_revision, raw, blob, info, records, language
+    )
+    return loaded, ttl
+
+
+async def save_revision_async(redis_client, key, language, code, title=None):
+    for _ in range(SHARE_REVISION_ATTEMPTS):
+        latest, ttl = await load_revision_async(redis_client, key, language, -1)
+        if latest is None:
+            return None, ttl
+
+        call, info = await asyncio.to_thread(
+            revision_put_call, key, latest, code, title
+        )
+        written = await run_script_async(redis_client, *call)
+        if written < 0:
+            return None, -2
+        if written:
+            return info, ttl
+    raise RevisionConflict("The file is being revised by someone else")
+
+
+async def list_revisions_async(redis_client, key):
+    return decode_revision_list(
+        await run_script_async(
+            redis_client, "share_revision_list", [key, revisions_key(key)]
+        )
+    )
+
+
+async def index_user_shares_async(redis_client, user_id, entries, ttl):
+    await run_script_async(redis_client, *user_index_call(user_id, entries, ttl))
+
+
+async def unindex_user_shares_async(redis_client, user_id, share_ids):
+    await redis_client.zrem(user_index_key(user_id), *share_ids)
+
+
+async def load_user_index_async(redis_client, user_id, cursor, limit):
+    result = await run_script_async(
+        redis_client, *user_index_page_call(user_id, cursor, limit)
+    )
+    return decode_user_index_page(result)
+
+
+async def take_tokens_async(redis_client, user_id, cost):
+    return decode_rate_limit(
+        await run_script_async(redis_client, *rate_limit_call(user_id, cost))
+    )
+
+
+async def share_languages_async(redis_client, keys):
+    pipe = redis_client.pipeline(transaction=False)
+    share_language_calls(pipe, keys)
+    return decode_share_languages(await pipe.execute())
@@ -0,0 +1,190 @@
+import os
+import sys
+import asyncio
+
+os.environ.setdefault("JWT_SECRET", "test-secret-" + "x" * 64)
+os.environ.setdefault("RECAPTCHA_SECRET_KEY", "test-recaptcha")
+os.environ.setdefault("TEMP_FILE_URL", "http://tempfile.test")
+os.environ.setdefault("REDIS_HEALTH_CHECK_INTERVAL", "3600")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+import jwt
+import pytest
+
+import ratelimit
+from cache import share_cache
+from storage import RedisStorage, SQLiteStorage
+
+FAKE_CONNECTION = getattr(fakeredis, "FakeRedisConnection", fakeredis.FakeConnection)
+FAKE_ASYNC_CONNECTION = getattr(
+    fakeredis, "FakeAsyncRedisConnection", fakeredis.FakeAsyncConnection
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_share_cache():
+    share_cache.clear()
+    yield
+    share_cache.clear()
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def redis_client(redis_server):
+    return fakeredis.FakeStrictRedis(server=redis_server)
+
+
+@pytest.fixture(params=["redis", "sqlite"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteStorage(str(tmp_path / "shares.db"))
+    return RedisStorage(request.getfixturevalue("redis_client"))
+
+
+@pytest.fixture
+def rate_limits(monkeypatch):
+    def configure(user_rate, user_burst, global_rate, global_burst):
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_USER_RATE", user_rate)
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_USER_BURST", user_burst)
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_GLOBAL_RATE", global_rate)
+        monkeypatch.setattr(ratelimit, "RATE_LIMIT_GLOBAL_BURST", global_burst)
+
+    return configure
+
+
+@pytest.fixture
+def redis_pools(monkeypatch):
+    """Points utils at one fake Redis server per node URL ("default" when not
+    sharded) and returns those servers."""
+    import utils
+
+    servers = {}
+
+    def create_redis_pool(url=None):
+        server = servers.setdefault(url or "default", fakeredis.FakeServer())
+        return utils.TrackedConnectionPool(
+            connection_class=FAKE_CONNECTION,
+            server=server,
+            max_connections=utils.REDIS_POOL_SIZE,
+            timeout=utils.REDIS_POOL_TIMEOUT,
+        )
+
+    monkeypatch.setattr(utils, "create_redis_pool", create_redis_pool)
+    monkeypatch.setattr(utils, "redis_pool", None)
+    monkeypatch.setattr(utils, "redis_healthy", False)
+    monkeypatch.setattr(utils, "redis_node_pools", {})
+    monkeypatch.setattr(utils, "redis_node_health", {})
+    monkeypatch.setattr(utils, "_redis_pool_pid", None)
+    return servers
+
+
+@pytest.fixture
+def async_redis_pools(monkeypatch):
+    """The async_utils twin of redis_pools."""
+    import async_utils
+
+    servers = {}
+
+    def create_redis_pool(url=None):
+        server = servers.setdefault(url or "default", fakeredis.FakeServer())
+        return async_utils.TrackedConnectionPool(
+            connection_class=FAKE_ASYNC_CONNECTION,
+            server=server,
+            max_connections=async_utils.REDIS_POOL_SIZE,
+            timeout=async_utils.REDIS_POOL_TIMEOUT,
+        )
+
+    monkeypatch.setattr(async_utils, "create_redis_pool", create_redis_pool)
+    monkeypatch.setattr(async_utils, "redis_pool", None)
+    monkeypatch.setattr(async_utils, "redis_healthy", False)
+    monkeypatch.setattr(async_utils, "redis_node_pools", {})
+    monkeypatch.setattr(async_utils, "redis_node_health", {})
+    return servers
+
+
+@pytest.fixture
+def asgi_app(async_redis_pools, monkeypatch):
+    import asgi_app as app_module
+
+    async def is_human(token):
+        return True
+
+    monkeypatch.setattr(app_module, "is_human", is_human)
+    return app_module
+
+
+@pytest.fixture
+def asgi_client(asgi_app):
+    """Runs a coroutine against the Quart app between its startup and shutdown
+    hooks, passing it a test client."""
+
+    def run(scenario):
+        async def serve():
+            async with asgi_app.app.test_app() as test_app:
+                return await scenario(test_app.test_client())
+
+        return asyncio.run(serve())
+
+    return run
+
+
+@pytest.fixture
+def app(redis_pools, monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "is_human", lambda token: True)
+    return app_module
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+@pytest.fixture
+def auth():
+    def headers(user_id="u1", **extra):
+        token = jwt.encode(
+            {"userId": user_id}, os.environ["JWT_SECRET"], algorithm="HS512"
+        )
+        return {
+            "Authorization": f"Bearer {token}",
+            "X-Recaptcha-Token": "token",
+            **extra,
+        }
+
+    return headers
+
+
+@pytest.fixture
+def get(client):
+    """GETs /file/<share_id><path> the way the frontend does, with X-File-ID."""
+
+    def get_share(share_id, path="", headers=None):
+        return client.get(
+            f"/file/{share_id}{path}",
+            headers={"X-File-ID": share_id, **(headers or {})},
+        )
+
+    return get_share
+
+
+@pytest.fixture
+def upload(client, auth):
+    """Uploads a share through the route and returns its id."""
+
+    def upload_share(code="print(1)", user_id="u1", **fields):
+        data = {"code": code, "language": "python", "title": "t", "expiryTime": 10}
+        response = client.post(
+            "/temp-file-upload", json={**data, **fields}, headers=auth(user_id)
+        )
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()["fileUrl"].rsplit("/", 1)[1]
+
+    return upload_share
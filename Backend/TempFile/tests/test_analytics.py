@@ -0,0 +1,101 @@
+import json
+import uuid
+
+import pytest
+
+import analytics
+from shares import build_share, new_file_id
+from sharding import share_file_id, share_id_for_key
+from storage import RedisStorage
+from store import blob_hash
+
+CODE = "print('shared')\n" * 100
+
+
+def save(storage, code="x = 1", language="python", minutes=10, file_id=None):
+    data = {"code": code, "language": language, "title": "t", "expiryTime": minutes}
+    share = build_share(data, file_id or new_file_id(), "u1")
+    storage.save_share(share)
+    return share["key"]
+
+
+@pytest.fixture
+def shares(redis_client):
+    storage = RedisStorage(redis_client)
+    keys = [
+        save(storage),
+        save(storage, "fmt.Println(1)", "go", minutes=60),
+        save(storage, CODE),
+        save(storage, CODE),
+    ]
+    legacy = save(storage, language="rust", file_id=f"rust-{uuid.uuid4()}")
+    redis_client.delete(f"{legacy.removesuffix(':data')}:meta")
+    return keys + [legacy]
+
+
+def test_share_ids_for_keys():
+    legacy = f"python-{uuid.uuid4()}"
+
+    assert share_id_for_key("s:AbCdE12345") == "AbCdE12345"
+    assert share_id_for_key(f"file:{legacy}:data") == legacy
+    assert share_file_id(f"file:{legacy}:data") == legacy.split("-", 1)[1]
+
+
+def test_collect_measures_every_share(redis_client, shares):
+    measured, scanned, method = analytics.collect({"default": redis_client})
+
+    assert scanned == len(shares) == len(measured)
+    assert method in ("memory_usage", "dump")
+    assert sorted(language for language, _, _ in measured) == [
+        "go",
+        "python",
+        "python",
+        "python",
+        "rust",
+    ]
+
+
+def test_blob_shares_split_their_blob(redis_client):
+    storage = RedisStorage(redis_client)
+    save(storage, CODE)
+    alone, _, _ = analytics.collect({"default": redis_client})
+    save(storage, CODE)
+    shared, _, _ = analytics.collect({"default": redis_client})
+
+    assert redis_client.get(f"blob:{blob_hash(CODE)}:refs") == b"2"
+    assert [size for _, _, size in shared][0] < alone[0][2]
+
+
+def test_summary_groups_by_language_and_expiry(redis_client, shares):
+    measured, scanned, method = analytics.collect({"default": redis_client})
+
+    report = analytics.summarize(measured, scanned, method, horizon=3600)
+
+    assert report["shares"] == 5
+    assert report["bytes"] == sum(row["bytes"] for row in report["languages"].values())
+    assert report["languages"]["python"]["shares"] == 3
+    assert report["expiry"]["<=10m"]["shares"] == 4
+    assert report["expiry"]["<=60m"]["shares"] == 1
+    assert report["expiring"]["shares"] == 5
+    assert json.loads(json.dumps(report)) == report
+
+
+def test_sampling_scales_the_totals(redis_client, shares):
+    measured, scanned, method = analytics.collect(
+        {"default": redis_client}, sample=0.5, seed=1
+    )
+
+    report = analytics.summarize(measured, scanned, method, sample=0.5)
+
+    assert report["scanned"] == 5
+    assert report["shares"] == 2 * len(measured)
+
+
+def test_report_prints(redis_client, shares, capsys):
+    measured, scanned, method = analytics.collect({"default": redis_client})
+
+    analytics.print_report(analytics.summarize(measured, scanned, method))
+
+    output = capsys.readouterr().out
+    assert output.startswith("5 shares using")
+    assert "python" in output and "rust" in output
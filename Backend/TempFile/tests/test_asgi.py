@@ -0,0 +1,100 @@
+import async_utils
+
+SHARE = {"code": "print(1)", "language": "python", "title": "t", "expiryTime": 10}
+
+
+async def upload_share(client, headers, **fields):
+    response = await client.post(
+        "/temp-file-upload", json={**SHARE, **fields}, headers=headers
+    )
+    assert response.status_code == 200, await response.get_json()
+    return (await response.get_json())["fileUrl"].rsplit("/", 1)[1]
+
+
+async def get_share(client, share_id, path=""):
+    return await client.get(f"/file/{share_id}{path}", headers={"X-File-ID": share_id})
+
+
+def test_health_route_reports_the_pool(asgi_client):
+    async def scenario(client):
+        response = await client.get("/health/redis")
+        return response.status_code, await response.get_json()
+
+    status, stats = asgi_client(scenario)
+
+    assert status == 200
+    assert stats["healthy"]
+    assert stats["in_use"] == 0
+
+
+def test_health_route_fails_while_redis_is_down(asgi_client, async_redis_pools):
+    async def scenario(client):
+        async_redis_pools["default"].connected = False
+        await async_utils.check_redis_health()
+        return (await client.get("/health/redis")).status_code
+
+    assert asgi_client(scenario) == 503
+
+
+def test_shares_round_trip(asgi_client, auth):
+    async def scenario(client):
+        share_id = await upload_share(client, auth())
+        response = await get_share(client, share_id)
+        meta = await get_share(client, share_id, "/meta")
+        deleted = await client.delete(f"/file/{share_id}/delete", headers=auth())
+        return (
+            await response.get_json(),
+            await meta.get_json(),
+            deleted.status_code,
+            (await get_share(client, share_id)).status_code,
+        )
+
+    share, meta, deleted, after = asgi_client(scenario)
+
+    assert share["code"] == "print(1)"
+    assert meta["title"] == "t"
+    assert (deleted, after) == (200, 404)
+
+
+def test_routes_match_the_flask_app(asgi_client, auth, client, upload, get):
+    async def scenario(client):
+        share_id = await upload_share(client, auth())
+        return [
+            (response.status_code, await response.get_json())
+            for response in [
+                await get_share(client, "nodash"),
+                await client.delete("/file/nodash/delete", headers=auth()),
+                await client.delete(f"/file/{share_id}/delete", headers=auth("u2")),
+                await client.post(
+                    "/temp-file-upload", json={"code": "x"}, headers=auth()
+                ),
+            ]
+        ]
+
+    share_id = upload()
+    expected = [
+        (response.status_code, response.get_json())
+        for response in [
+            get("nodash"),
+            client.delete("/file/nodash/delete", headers=auth()),
+            client.delete(f"/file/{share_id}/delete", headers=auth("u2")),
+            client.post("/temp-file-upload", json={"code": "x"}, headers=auth()),
+        ]
+    ]
+
+    assert asgi_client(scenario) == expected
+    assert [status for status, _ in expected] == [400, 400, 403, 400]
+
+
+def test_uploads_are_rate_limited(asgi_client, auth, rate_limits):
+    rate_limits(0.001, 1, 0.001, 100)
+
+    async def scenario(client):
+        await upload_share(client, auth())
+        response = await client.post("/temp-file-upload", json=SHARE, headers=auth())
+        return response.status_code, response.headers.get("Retry-After")
+
+    status, retry_after = asgi_client(scenario)
+
+    assert status == 429
+    assert int(retry_after) >= 1
@@ -0,0 +1,93 @@
+import json
+
+import shares
+import store
+
+FILES = [
+    {"code": "print(1)", "language": "python", "title": "one", "expiryTime": 10},
+    {"code": "", "language": "python", "title": "empty", "expiryTime": 10},
+    {"code": "print(3)", "language": "python", "title": "three", "expiryTime": 10},
+]
+
+
+def upload_batch(client, auth, items, user_id="u1"):
+    return client.post("/temp-file-upload/batch", json=items, headers=auth(user_id))
+
+
+def batch_ids(response):
+    return [
+        result["fileUrl"].rsplit("/", 1)[1] if "fileUrl" in result else None
+        for result in response.get_json()["results"]
+    ]
+
+
+def test_batch_uploads_keep_their_order(client, auth, get):
+    response = upload_batch(client, auth, FILES)
+
+    assert response.status_code == 200
+    first, empty, third = batch_ids(response)
+    assert empty is None and "error" in response.get_json()["results"][1]
+    assert get(first).get_json()["title"] == "one"
+    assert get(third).get_json()["title"] == "three"
+    listed = client.get("/my-shares", headers=auth()).get_json()
+    assert {share["shareId"] for share in listed["shares"]} == {first, third}
+
+
+def test_taken_ids_are_retried(client, auth, get, upload, monkeypatch):
+    taken = upload("print('kept')")
+    fresh, retried = shares.new_file_id(), shares.new_file_id()
+    file_ids = iter([taken, fresh, retried])
+    monkeypatch.setattr(shares, "new_file_id", lambda: next(file_ids))
+
+    response = upload_batch(client, auth, [FILES[0], FILES[2]])
+
+    assert batch_ids(response) == [retried, fresh]
+    assert get(taken).get_json()["code"] == "print('kept')"
+    assert get(retried).get_json()["title"] == "one"
+
+
+def test_batch_uploads_are_bounded(client, auth, monkeypatch):
+    monkeypatch.setattr(shares, "SHARE_BATCH_MAX_SIZE", 2)
+
+    assert upload_batch(client, auth, FILES).status_code == 413
+    assert upload_batch(client, auth, []).status_code == 400
+    assert upload_batch(client, auth, {"code": "x"}).status_code == 400
+
+
+def get_batch(client, share_ids, header=None):
+    return client.post(
+        "/files/batch",
+        json={"shareIds": share_ids},
+        headers={"X-File-ID": ",".join(share_ids) if header is None else header},
+    )
+
+
+def batch_lines(response):
+    return [json.loads(line) for line in response.get_data().splitlines()]
+
+
+def test_batch_retrieval_streams_one_line_per_id(client, auth, upload, monkeypatch):
+    monkeypatch.setattr(store, "SHARE_CHUNK_THRESHOLD", 1024)
+    monkeypatch.setattr(store, "SHARE_CHUNK_SIZE", 500)
+    inline, blob = upload(), upload("print('shared')\n" * 50)
+    chunked = upload("print('chunked')\n" * 100)
+    deleted = upload()
+    client.delete(f"/file/{deleted}/delete", headers=auth())
+    share_ids = [blob, "nodash", inline, deleted, chunked]
+
+    response = get_batch(client, share_ids)
+
+    assert response.mimetype == "application/x-ndjson"
+    lines = batch_lines(response)
+    assert [line["shareId"] for line in lines] == share_ids
+    assert [line["status"] for line in lines] == [200, 400, 200, 404, 413]
+    assert lines[0]["file"]["code"] == "print('shared')\n" * 50
+    assert lines[2]["file"]["code"] == "print(1)"
+
+
+def test_batch_retrieval_checks_its_request(app, client, monkeypatch):
+    monkeypatch.setattr(app, "SHARE_BATCH_MAX_SIZE", 2)
+
+    assert get_batch(client, []).status_code == 400
+    assert get_batch(client, ["AbCdE12345"], header="other").status_code == 302
+    assert get_batch(client, ["AbCdE12345"] * 3).status_code == 413
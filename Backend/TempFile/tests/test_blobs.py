@@ -0,0 +1,160 @@
+import json
+
+import msgpack
+import pytest
+
+from cache import share_cache
+from codec import (
+    blob_fragment,
+    decode_blob,
+    decode_share,
+    decoded_body,
+    encode_blob,
+    encode_share,
+    render_loaded,
+    render_share,
+    share_blob_hash,
+    share_etag,
+)
+from scripts import SCRIPTS
+from shares import build_share, new_file_id
+from storage import RedisStorage
+from store import blob_hash, blob_key, blob_refs_key
+
+DIGEST = "ab" * 32
+CODE = 'print("héllo, \\"world\\"")\n\tif x < 1: pass\n' * 200
+
+
+def file_data(code=CODE):
+    return {
+        "title": "t",
+        "code": code,
+        "language": "python",
+        "expiry_time": "2030-01-01 00:00:00 UTC",
+    }
+
+
+def upload(storage, code=CODE, minutes=10):
+    data = {"code": code, "language": "python", "title": "t", "expiryTime": minutes}
+    share = build_share(data, new_file_id(), "u1")
+    storage.save_share(share)
+    return share["key"]
+
+
+@pytest.mark.parametrize("code", ["x = 1", CODE])
+def test_blob_round_trip(code):
+    blob = encode_blob(code)
+
+    assert decode_blob(blob) == code
+    assert blob_fragment(blob) == json.dumps(code, ensure_ascii=False)[1:-1].encode(
+        "utf-8"
+    )
+
+
+@pytest.mark.parametrize("code", ["x = 1", CODE])
+def test_blob_share_renders_like_an_inline_share(code):
+    raw = encode_share(file_data(code), blob_hash=DIGEST)
+    blob = encode_blob(code)
+
+    share = render_loaded(raw, "python", blob)
+
+    assert share_blob_hash(raw) == DIGEST
+    assert share.etag == share_etag(file_data(code))
+    assert decoded_body(share) == render_share(file_data(code))
+    assert decode_share(raw, "python", blob) == file_data(code)
+
+
+def test_blob_share_needs_its_blob():
+    raw = encode_share(file_data(), blob_hash=DIGEST)
+
+    with pytest.raises(ValueError):
+        render_loaded(raw, "python")
+
+
+def test_identical_uploads_share_one_blob(redis_client):
+    storage = RedisStorage(redis_client)
+    first = upload(storage, minutes=10)
+    second = upload(storage, minutes=30)
+    digest = blob_hash(CODE)
+
+    assert share_blob_hash(redis_client.get(first)) == digest
+    assert redis_client.get(blob_refs_key(digest)) == b"2"
+    # The blob outlives its longest-lived referrer, not just the first one.
+    assert redis_client.ttl(blob_key(digest)) > 10 * 60
+
+    for key in (first, second):
+        assert len(redis_client.get(key)) < 200
+        assert storage.load_share(key, "python")[0] is not None
+
+
+def test_deletes_release_the_blob_with_the_last_reference(redis_client):
+    storage = RedisStorage(redis_client)
+    first, second = upload(storage), upload(storage)
+    digest = blob_hash(CODE)
+
+    assert storage.delete_share(first)
+    assert redis_client.get(blob_refs_key(digest)) == b"1"
+    assert share_blob_hash(redis_client.get(second)) == digest
+
+    assert storage.delete_share(second)
+    assert not redis_client.exists(blob_key(digest), blob_refs_key(digest))
+    assert not storage.delete_share(second)
+
+
+def test_scripts_only_touch_the_keys_they_are_passed():
+    for name, (source, _) in SCRIPTS.items():
+        assert "'blob:'" not in source, name
+
+
+def test_blob_shares_load_with_their_blob(redis_client):
+    storage = RedisStorage(redis_client)
+    keys = [upload(storage), upload(storage, "x = 1"), upload(storage)]
+    digest = blob_hash(CODE)
+
+    loaded = storage.load_shares([(key, "python") for key in keys])
+    validator, _ = storage.load_share_etag(keys[0])
+    revision, _ = storage.load_revision(keys[0], "python", 0)
+
+    assert [json.loads(decoded_body(share))["code"] for share, _ in loaded] == [
+        CODE,
+        "x = 1",
+        CODE,
+    ]
+    assert validator.etag == loaded[0][0].etag
+    assert validator.encoding == loaded[0][0].encoding
+    assert revision["code"] == CODE
+
+    redis_client.delete(blob_key(digest))
+    share_cache.clear()
+    assert storage.load_share(keys[2], "python") == (None, -2)
+    assert [ttl for _, ttl in storage.load_shares([(keys[2], "python")])] == [-2]
+
+
+def test_small_code_is_stored_inline(redis_client):
+    storage = RedisStorage(redis_client)
+    key = upload(storage, "x = 1")
+
+    assert share_blob_hash(redis_client.get(key)) is None
+    assert redis_client.keys("blob:*") == []
+
+
+def test_deleting_a_version_1_blob_share_releases_its_blob(redis_client):
+    digest = blob_hash(CODE)
+    record = bytes((1, 0)) + msgpack.packb({"t": "t", "e": 2000000000, "b": digest})
+    redis_client.set("s:OldBlob123", record, ex=100)
+    redis_client.set(blob_key(digest), encode_blob(CODE), ex=100)
+    redis_client.set(blob_refs_key(digest), 1, ex=100)
+
+    assert RedisStorage(redis_client).delete_share("s:OldBlob123")
+    assert not redis_client.exists(blob_key(digest), blob_refs_key(digest))
+
+
+def test_upload_and_delete_through_the_routes(client, auth, get, upload, app):
+    share_ids = [upload(CODE), upload(CODE)]
+
+    assert [get(share_id).get_json()["code"] for share_id in share_ids] == [CODE] * 2
+
+    for share_id in share_ids:
+        response = client.delete(f"/file/{share_id}/delete", headers=auth())
+        assert response.status_code == 200
+    assert get(share_ids[0]).status_code == 404
@@ -0,0 +1,130 @@
+import time
+
+import fakeredis
+import redis
+
+import cache
+import utils
+from cache import (
+    INVALIDATION_CHANNEL,
+    ShareCache,
+    share_cache,
+    start_invalidation_listener,
+    subscriber_client,
+)
+from codec import RenderedShare
+from shares import build_share, new_file_id
+from storage import RedisStorage
+
+
+def rendered(size=10):
+    return RenderedShare(b"x" * size, "etag")
+
+
+def cached(share_cache, key):
+    return share_cache.get(key)[0] is not None
+
+
+def test_hits_and_misses_are_counted():
+    shares = ShareCache(10_000)
+    shares.set("a", rendered(), 60, shares.generation("a"))
+
+    assert shares.get("a")[0] == rendered()
+    assert 0 < shares.get("a")[1] <= 60
+    assert shares.get("b") == (None, None)
+    assert shares.stats()["hits"] == 2
+    assert shares.stats()["misses"] == 1
+
+
+def test_least_recently_used_shares_are_evicted():
+    entry = 100 + cache.SHARE_CACHE_ENTRY_OVERHEAD
+    shares = ShareCache(3 * entry)
+    for key in "abc":
+        shares.set(key, rendered(100), 60, shares.generation(key))
+    shares.get("a")
+
+    shares.set("d", rendered(100), 60, shares.generation("d"))
+
+    assert [cached(shares, key) for key in "abcd"] == [True, False, True, True]
+    assert shares.stats()["evictions"] == 1
+    assert shares.stats()["size_bytes"] == 3 * entry
+
+
+def test_shares_that_do_not_fit_are_not_cached():
+    shares = ShareCache(100)
+    shares.set("a", rendered(100), 60, shares.generation("a"))
+    shares.set("b", rendered(), 0, shares.generation("b"))
+
+    assert shares.stats()["entries"] == 0
+
+
+def test_reads_that_overlap_an_invalidation_are_dropped():
+    shares = ShareCache(10_000)
+    generation = shares.generation("a")
+
+    shares.invalidate("a")
+    shares.set("a", rendered(), 60, generation)
+    assert not cached(shares, "a")
+
+    shares.set("a", rendered(), 60, shares.generation("a"))
+    assert cached(shares, "a")
+
+
+def test_generations_are_bounded(monkeypatch):
+    monkeypatch.setattr(cache, "SHARE_CACHE_MAX_GENERATIONS", 3)
+    shares = ShareCache(10_000)
+    generation = shares.generation("a")
+
+    for key in "abcd":
+        shares.invalidate(key)
+
+    assert len(shares.generations) == 1
+    shares.set("a", rendered(), 60, generation)
+    assert not cached(shares, "a")
+
+
+def test_subscriber_has_its_own_connections():
+    pool = utils.TrackedConnectionPool(
+        connection_class=fakeredis.FakeRedisConnection, server=fakeredis.FakeServer()
+    )
+
+    subscriber = subscriber_client(redis.StrictRedis(connection_pool=pool))
+
+    assert type(subscriber.connection_pool) is redis.ConnectionPool
+    assert subscriber.ping()
+    assert pool.stats()["created"] == 0
+
+
+def test_deletes_elsewhere_are_published(redis_client):
+    storage = RedisStorage(redis_client)
+    data = {"code": "x = 1", "language": "python", "title": "t", "expiryTime": 10}
+    share = build_share(data, new_file_id(), "u1")
+    storage.save_share(share)
+    start_invalidation_listener(redis_client)
+    deadline = time.monotonic() + 5
+    while not redis_client.pubsub_numsub(INVALIDATION_CHANNEL)[0][1]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    storage.load_share(share["key"], "python")
+    assert cached(share_cache, share["key"])
+
+    # Another worker's delete only reaches this one through the channel.
+    redis_client.publish(INVALIDATION_CHANNEL, share["key"])
+    while cached(share_cache, share["key"]):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_routes_serve_repeat_reads_from_the_cache(client, get, upload, auth):
+    share_id = upload()
+
+    for _ in range(3):
+        assert get(share_id).status_code == 200
+
+    stats = client.get("/health/cache").get_json()
+    assert stats["entries"] == 1
+    assert stats["hits"] >= 2
+
+    client.delete(f"/file/{share_id}/delete", headers=auth())
+    assert get(share_id).status_code == 404
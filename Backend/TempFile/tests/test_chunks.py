@@ -0,0 +1,86 @@
+import pytest
+
+import store
+from shares import build_share, new_file_id
+from storage import RedisStorage
+from store import chunks_key
+
+# Multi-byte characters make chunk and range boundaries land inside them.
+CODE = "".join(f"line {index}: héllo → wörld\n" for index in range(200))
+BODY = CODE.encode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(store, "SHARE_CHUNK_THRESHOLD", 1024)
+    monkeypatch.setattr(store, "SHARE_CHUNK_SIZE", 500)
+
+
+def save(storage, code):
+    data = {"code": code, "language": "python", "title": "t", "expiryTime": 10}
+    share = build_share(data, new_file_id(), "u1")
+    storage.save_share(share)
+    return share["key"]
+
+
+def raw(get, share_id, byte_range=None):
+    headers = {"Range": f"bytes={byte_range}"} if byte_range else None
+    return get(share_id, "/raw", headers=headers)
+
+
+def test_large_shares_are_stored_in_chunks(redis_client):
+    storage = RedisStorage(redis_client)
+    key = save(storage, CODE)
+
+    file_data = storage.load_share(key, "python")[0]
+
+    assert file_data["size"] == len(BODY)
+    assert file_data["chunks"] == redis_client.hlen(chunks_key(key))
+    assert file_data["chunks"] == -(-len(BODY) // 500)
+    assert b"".join(storage.iter_share_body(key, file_data)) == BODY
+    assert b"".join(storage.iter_share_body(key, file_data, 450, 1050)) == (
+        BODY[450:1050]
+    )
+
+
+def test_chunked_shares_are_served_whole(get, upload):
+    share_id = upload(CODE)
+
+    response = get(share_id)
+
+    assert response.status_code == 200
+    assert response.get_json()["code"] == CODE
+    assert raw(get, share_id).get_data() == BODY
+
+
+@pytest.mark.parametrize(
+    "byte_range, start, stop",
+    [("0-99", 0, 100), ("450-1049", 450, 1050), ("-10", len(BODY) - 10, len(BODY))],
+)
+def test_ranges_are_served_partially(get, upload, byte_range, start, stop):
+    share_id = upload(CODE)
+
+    response = raw(get, share_id, byte_range)
+
+    assert response.status_code == 206
+    assert response.get_data() == BODY[start:stop]
+    assert response.headers["Content-Length"] == str(stop - start)
+    assert response.headers["Content-Range"] == f"bytes {start}-{stop - 1}/{len(BODY)}"
+
+
+def test_small_shares_support_ranges_too(get, upload):
+    share_id = upload("print(1)")
+
+    response = raw(get, share_id, "6-7")
+
+    assert response.status_code == 206
+    assert response.get_data() == b"1)"
+
+
+def test_unsatisfiable_ranges_are_rejected(get, upload):
+    share_id = upload(CODE)
+
+    response = raw(get, share_id, f"{len(BODY)}-")
+
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == f"bytes */{len(BODY)}"
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+import codec
+from codec import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    COMPRESSION_ZSTD,
+    decode_share,
+    decoded_body,
+    encode_share,
+    pack,
+    render_loaded,
+    render_share,
+    share_etag,
+    unpack,
+    unpack_header,
+)
+
+CODE = 'print("héllo, \\"world\\"")\n\tif x < 1: pass\n' * 200
+
+
+def file_data(code=CODE):
+    return {
+        "title": "t",
+        "code": code,
+        "language": "python",
+        "expiry_time": "2030-01-01 00:00:00 UTC",
+    }
+
+
+@pytest.mark.parametrize(
+    "payload, compression",
+    [(b"small", COMPRESSION_NONE), (b"x" * 5000, COMPRESSION_ZSTD)],
+)
+def test_pack_round_trip(payload, compression):
+    raw = pack(payload)
+
+    assert unpack_header(raw)[1] == compression
+    assert unpack(raw) == ({}, payload)
+
+
+def test_zlib_without_zstandard(monkeypatch):
+    monkeypatch.setattr(codec, "zstandard", None)
+    raw = pack(b"x" * 5000)
+
+    assert unpack_header(raw)[1] == COMPRESSION_ZLIB
+    assert unpack(raw)[1] == b"x" * 5000
+
+
+def test_unknown_versions_are_rejected():
+    with pytest.raises(ValueError):
+        unpack(bytes((99, 0)) + b"payload")
+
+
+@pytest.mark.parametrize("code", ["x = 1", CODE, ""])
+def test_share_round_trip(code):
+    raw = encode_share(file_data(code))
+
+    assert decode_share(raw, "python") == file_data(code)
+
+    share = render_loaded(raw, "python")
+    assert share.etag == share_etag(file_data(code))
+    assert decoded_body(share) == render_share(file_data(code))
+
+
+def test_large_shares_are_stored_compressed():
+    assert len(encode_share(file_data())) < len(CODE.encode("utf-8")) // 10
+
+
+def test_json_records_from_before_the_codec():
+    raw = json.dumps(file_data("x = 1")).encode("utf-8")
+
+    assert decode_share(raw, "python") == file_data("x = 1")
+
+
+@pytest.mark.parametrize("code", ["x = 1", CODE])
+def test_uploaded_code_reads_back_unchanged(get, upload, code):
+    share_id = upload(code)
+
+    response = get(share_id)
+
+    assert response.status_code == 200
+    assert response.get_json()["code"] == code
@@ -0,0 +1,129 @@
+import gzip
+import json
+import random
+import shutil
+import subprocess
+import zlib
+
+import pytest
+
+import codec
+from codec import (
+    COMPRESSION_DEFLATE,
+    COMPRESSION_GZIP,
+    JSON_CODE_PREFIX,
+    blob_fragment,
+    decoded_body,
+    encode_blob,
+    encode_share,
+    loads_json,
+    pack,
+    render_loaded,
+    render_share,
+    splice_gzip,
+    unpack,
+    unpack_header,
+)
+
+SMALL = 'print("héllo, \\"world\\"")\n\tif x < 1: pass\n' * 200
+TAIL = b'","expiry_time":"x","language":"python","title":"t"}'
+
+
+def varied_code(size, seed=0):
+    """Code that compresses into many deflate blocks, not one run."""
+    rng = random.Random(seed)
+    words = ["def", "return", "x", "ü", '"q"', "\\", "\t", "\n", "λ", "42", "if"]
+    text, length = [], 0
+    while length < size:
+        text.append(rng.choice(words) + rng.choice(" \n") + str(rng.random()))
+        length += len(text[-1])
+    return "".join(text)
+
+
+def file_data(code=SMALL):
+    return {
+        "title": "t",
+        "code": code,
+        "language": "python",
+        "expiry_time": "2030-01-01 00:00:00 UTC",
+    }
+
+
+def spliced(code):
+    blob = encode_blob(code)
+    _, compression, offset = unpack_header(blob)
+    assert compression == COMPRESSION_DEFLATE
+    return (
+        splice_gzip(blob[offset:], TAIL),
+        JSON_CODE_PREFIX + blob_fragment(blob) + TAIL,
+    )
+
+
+@pytest.mark.parametrize(
+    "method, compression",
+    [("content", COMPRESSION_GZIP), ("segment", COMPRESSION_DEFLATE)],
+)
+def test_pack_round_trip(method, compression):
+    raw = pack(b"x" * 5000, method=method)
+
+    assert unpack_header(raw)[1] == compression
+    assert unpack(raw) == ({}, b"x" * 5000)
+
+
+def test_large_share_is_served_in_its_content_encoding():
+    share = render_loaded(encode_share(file_data()), "python")
+
+    assert share.encoding == "gzip"
+    assert gzip.decompress(share.body) == render_share(file_data())
+
+
+def test_brotli_content_encoding(monkeypatch):
+    pytest.importorskip("brotli")
+    monkeypatch.setattr(codec, "SHARE_CONTENT_ENCODING", "br")
+
+    share = render_loaded(encode_share(file_data()), "python")
+
+    assert share.encoding == "br"
+    assert loads_json(decoded_body(share)) == file_data()
+
+
+@pytest.mark.parametrize("size", [2 * 1024, 300 * 1024, 900 * 1024])
+def test_spliced_body_is_one_valid_gzip_member(size):
+    body, expected = spliced(varied_code(size))
+
+    # gzip.decompress checks the spliced CRC-32 and length trailer.
+    assert gzip.decompress(body) == expected
+    assert json.loads(expected)["code"] == varied_code(size)
+
+    # A streaming client that reads one member at a time sees all of it.
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    pieces = [
+        decompressor.decompress(body[i : i + 4096]) for i in range(0, len(body), 4096)
+    ]
+    assert b"".join(pieces) + decompressor.flush() == expected
+    assert decompressor.eof and not decompressor.unused_data
+
+
+@pytest.mark.skipif(not shutil.which("gzip"), reason="gzip is not installed")
+def test_stock_gzip_accepts_the_spliced_body():
+    body, expected = spliced(varied_code(300 * 1024))
+
+    subprocess.run(["gzip", "-t"], input=body, check=True)
+    decoded = subprocess.run(
+        ["gzip", "-dc"], input=body, check=True, capture_output=True
+    )
+    assert decoded.stdout == expected
+
+
+@pytest.mark.parametrize("size", [2 * 1024, 300 * 1024])
+def test_blob_shares_are_served_gzipped(get, upload, size):
+    code = varied_code(size)
+    share_id = upload(code)
+
+    gzipped = get(share_id, headers={"Accept-Encoding": "gzip"})
+    plain = get(share_id, headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzipped.get_data()))["code"] == code
+    assert "Content-Encoding" not in plain.headers
+    assert plain.get_json()["code"] == code
@@ -0,0 +1,77 @@
+import pytest
+
+import store
+from storage import RedisStorage
+
+SHARES = {
+    "inline": "print(1)",
+    "blob": "print('shared')\n" * 100,
+    "chunked": "print('chunked')\n" * 200,
+}
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(store, "SHARE_CHUNK_THRESHOLD", 2048)
+    monkeypatch.setattr(store, "SHARE_CHUNK_SIZE", 1024)
+
+
+@pytest.fixture
+def unread_bodies(monkeypatch):
+    """Fails any request that reads a share body after this is requested."""
+
+    def load_share(self, key, language):
+        raise AssertionError(f"{key} was read")
+
+    def install():
+        monkeypatch.setattr(RedisStorage, "load_share", load_share)
+
+    return install
+
+
+@pytest.mark.parametrize("kind", SHARES)
+def test_matching_etags_are_not_modified(get, upload, unread_bodies, kind):
+    share_id = upload(SHARES[kind])
+    first = get(share_id, headers={"Accept-Encoding": "identity"})
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Vary"] == "Accept-Encoding"
+
+    unread_bodies()
+    response = get(share_id, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.get_data() == b""
+
+
+def test_stale_etags_get_the_share(get, upload):
+    share_id = upload()
+    other = get(upload("print(2)")).headers["ETag"]
+
+    response = get(share_id, headers={"If-None-Match": other})
+
+    assert response.status_code == 200
+    assert response.get_json()["code"] == "print(1)"
+    assert response.headers["ETag"] != other
+
+
+def test_encoded_responses_have_weak_etags(get, upload):
+    share_id = upload(SHARES["blob"])
+
+    gzipped = get(share_id, headers={"Accept-Encoding": "gzip"})
+    plain = get(share_id, headers={"Accept-Encoding": "identity"})
+
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzipped.headers["ETag"] == f"W/{plain.headers['ETag']}"
+    revalidated = get(share_id, headers={"If-None-Match": gzipped.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+def test_deleted_shares_are_not_revalidated(client, auth, get, upload):
+    share_id = upload()
+    etag = get(share_id).headers["ETag"]
+
+    client.delete(f"/file/{share_id}/delete", headers=auth())
+
+    assert get(share_id, headers={"If-None-Match": etag}).status_code == 404
@@ -0,0 +1,62 @@
+import uuid
+
+from codec import decode_metadata, encode_metadata, share_metadata
+from shares import build_share, new_file_id
+from storage import RedisStorage
+
+CODE = 'print("héllo")\n' * 100
+
+
+def file_data():
+    return {
+        "title": "t",
+        "code": CODE,
+        "language": "python",
+        "expiry_time": "2030-01-01 00:00:00 UTC",
+    }
+
+
+def test_metadata_round_trip():
+    metadata = share_metadata(file_data(), owner="u1")
+    fields = [value.encode("utf-8") for value in encode_metadata(metadata)]
+
+    assert decode_metadata(fields) == metadata
+    assert metadata["size"] == len(CODE.encode("utf-8"))
+
+
+def test_metadata_is_stored_with_the_share(storage):
+    data = {"code": CODE, "language": "python", "title": "t", "expiryTime": 10}
+    share = build_share(data, new_file_id(), "u1")
+    storage.save_share(share)
+
+    metadata, ttl = storage.load_share_meta(share["key"], "python")
+
+    assert metadata["owner"] == "u1"
+    assert metadata["size"] == len(CODE.encode("utf-8"))
+    assert 0 < ttl <= 600
+    assert storage.load_share_meta("s:missing0000", None) == (None, -2)
+
+
+def test_meta_route_skips_the_body(get, upload, monkeypatch):
+    share_id = upload(CODE, title="preview")
+
+    def load_share(self, key, language):
+        raise AssertionError(f"{key} was read")
+
+    monkeypatch.setattr(RedisStorage, "load_share", load_share)
+    response = get(share_id, "/meta")
+
+    assert response.status_code == 200
+    metadata = response.get_json()
+    assert sorted(metadata) == ["expiry_time", "language", "size", "title"]
+    assert metadata["title"] == "preview"
+    assert metadata["size"] == len(CODE.encode("utf-8"))
+    revalidated = get(
+        share_id, "/meta", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert revalidated.status_code == 304
+
+
+def test_meta_route_reports_missing_shares(get):
+    assert get("AbCdE12345", "/meta").status_code == 404
+    assert get(f"python-{uuid.uuid4()}", "/meta").status_code == 404
@@ -0,0 +1,46 @@
+import utils
+
+
+def test_routes_share_one_warm_pool(client, get, auth, upload):
+    share_id = upload()
+    pool = utils.redis_pool
+
+    assert get(share_id).status_code == 200
+    assert client.delete(f"/file/{share_id}/delete", headers=auth()).status_code == 200
+
+    stats = pool.stats()
+    assert utils.redis_pool is pool
+    assert stats["in_use"] == 0
+    assert stats["created"] <= stats["max_connections"]
+    assert stats["checkouts"] >= 3
+
+
+def test_pool_is_warmed_when_created(redis_pools):
+    utils.init_redis_pool()
+
+    assert utils.redis_healthy
+    assert utils.redis_pool.stats()["created"] == min(
+        utils.REDIS_POOL_WARM_SIZE, utils.REDIS_POOL_SIZE
+    )
+
+
+def test_health_route_reports_the_pool(client, redis_pools):
+    utils.init_redis_pool()
+
+    response = client.get("/health/redis")
+
+    assert response.status_code == 200
+    assert response.get_json()["healthy"]
+    assert response.get_json()["in_use"] == 0
+
+
+def test_routes_fail_with_503_while_redis_is_down(client, get, redis_pools):
+    utils.init_redis_pool()
+    redis_pools["default"].connected = False
+    utils.check_redis_health()
+
+    assert client.get("/health/redis").status_code == 503
+    assert get("AbCdE12345").status_code == 503
+
+    redis_pools["default"].connected = True
+    assert get("AbCdE12345").status_code == 404
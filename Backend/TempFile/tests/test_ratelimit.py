@@ -0,0 +1,140 @@
+import pytest
+
+import utils
+
+from ratelimit import admit, max_cost
+from shares import SHARE_BATCH_MAX_SIZE, upload_batch_limit
+
+SLOW = 0.001
+
+
+def test_user_bucket_admits_its_burst(storage, rate_limits):
+    rate_limits(SLOW, 3, SLOW, 100)
+
+    outcomes = [storage.take_tokens("u1", 1) for _ in range(4)]
+
+    assert [outcome["allowed"] for outcome in outcomes] == [True, True, True, False]
+    assert outcomes[-1]["limited_by"] == "user"
+    assert outcomes[-1]["retry_after"] >= 1
+    assert storage.take_tokens("u2", 1)["allowed"]
+
+
+def test_global_bucket_is_shared_by_all_users(storage, rate_limits):
+    rate_limits(SLOW, 10, SLOW, 2)
+
+    assert storage.take_tokens("u1", 1)["allowed"]
+    assert storage.take_tokens("u2", 1)["allowed"]
+
+    outcome = storage.take_tokens("u3", 1)
+    assert not outcome["allowed"]
+    assert outcome["limited_by"] == "global"
+
+
+def test_rejected_requests_take_no_tokens(storage, rate_limits):
+    rate_limits(SLOW, 1, SLOW, 5)
+    storage.take_tokens("u1", 1)
+
+    assert not storage.take_tokens("u1", 1)["allowed"]
+
+    buckets = storage.take_tokens("u2", 0)["buckets"]
+    assert buckets["global"]["tokens"] == pytest.approx(4, abs=0.01)
+
+
+def test_batches_pay_their_full_cost(storage, rate_limits):
+    rate_limits(SLOW, 5, SLOW, 100)
+
+    assert storage.take_tokens("u1", 5)["allowed"]
+    assert not storage.take_tokens("u1", 1)["allowed"]
+
+
+def test_zero_cost_only_reads(storage, rate_limits):
+    rate_limits(SLOW, 2, SLOW, 100)
+
+    for _ in range(3):
+        outcome = storage.take_tokens("u1", 0)
+        assert outcome["allowed"]
+        assert outcome["buckets"]["user"]["tokens"] == pytest.approx(2, abs=0.01)
+
+
+def test_disabled_buckets_admit_everything(storage, rate_limits):
+    rate_limits(0, 1, 0, 1)
+
+    outcomes = [storage.take_tokens("u1", 1) for _ in range(5)]
+
+    assert all(outcome["allowed"] for outcome in outcomes)
+    assert outcomes[-1]["buckets"]["user"]["tokens"] is None
+
+
+def test_admit_waits_for_the_slowest_bucket(rate_limits):
+    rate_limits(1, 10, 2, 10)
+
+    assert admit([5, 5], 5) == (True, 0, None)
+    assert admit([4, 0], 5) == (False, 2500, 1)
+    assert admit([0, 4], 5) == (False, 5000, 0)
+    assert admit([None, 0], 5) == (False, 2500, 1)
+
+
+def test_batch_limit_fits_the_smallest_burst(rate_limits):
+    rate_limits(SLOW, 7, SLOW, 1000)
+    assert max_cost() == 7
+    assert upload_batch_limit() == min(7, SHARE_BATCH_MAX_SIZE)
+
+    rate_limits(0, 7, 0, 1000)
+    assert max_cost() is None
+    assert upload_batch_limit() == SHARE_BATCH_MAX_SIZE
+
+
+def user_tokens():
+    return utils.get_storage().take_tokens("u1", 0)["buckets"]["user"]["tokens"]
+
+
+def test_uploads_are_limited_per_user(client, auth, rate_limits, upload):
+    rate_limits(SLOW, 1, SLOW, 100)
+    upload()
+
+    response = client.post(
+        "/temp-file-upload",
+        json={"code": "x", "language": "python", "title": "t", "expiryTime": 10},
+        headers=auth(),
+    )
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_rejected_uploads_are_not_charged(client, auth, rate_limits, upload):
+    rate_limits(SLOW, 1, SLOW, 100)
+
+    response = client.post("/temp-file-upload", json={"code": "x"}, headers=auth())
+
+    assert response.status_code == 400
+    assert user_tokens() == pytest.approx(1, abs=0.01)
+    upload()
+
+
+def test_rejected_revisions_are_not_charged(client, auth, rate_limits, upload):
+    rate_limits(SLOW, 2, SLOW, 100)
+    share_id = upload()
+
+    response = client.post(
+        f"/file/{share_id}/revisions", json={"code": 1}, headers=auth()
+    )
+
+    assert response.status_code == 400
+    assert user_tokens() == pytest.approx(1, abs=0.01)
+
+
+def test_batches_are_charged_for_their_valid_files(client, auth, rate_limits):
+    rate_limits(SLOW, 3, SLOW, 100)
+    valid = {"code": "x", "language": "python", "title": "t", "expiryTime": 10}
+
+    response = client.post(
+        "/temp-file-upload/batch", json=[valid, {"code": "x"}, {}], headers=auth()
+    )
+
+    assert ["fileUrl" in result for result in response.get_json()["results"]] == [
+        True,
+        False,
+        False,
+    ]
+    assert user_tokens() == pytest.approx(2, abs=0.01)
@@ -0,0 +1,71 @@
+import html
+
+import fakeredis
+import pytest
+
+import store
+from render import render_share_html
+from store import render_key
+
+CODE = 'def greet(name):\n    return f"héllo {name}" < 1\n'
+
+
+def app_redis(redis_pools):
+    return fakeredis.FakeStrictRedis(server=redis_pools["default"])
+
+
+def test_shares_are_rendered_once(app, redis_pools, get, upload, monkeypatch):
+    share_id = upload(CODE)
+    redis_client = app_redis(redis_pools)
+
+    first = get(share_id, "/html")
+    assert first.status_code == 200
+    assert first.mimetype == "text/html"
+    assert first.get_data() == render_share_html(CODE, "python")
+    key = f"s:{share_id}"
+    assert 0 < redis_client.ttl(render_key(key)) <= redis_client.ttl(key)
+
+    def render_share_html_again(code, language):
+        raise AssertionError("rendered twice")
+
+    monkeypatch.setattr(app, "render_share_html", render_share_html_again)
+    assert get(share_id, "/html").get_data() == first.get_data()
+
+
+def test_chunked_shares_are_rendered_whole(get, upload, monkeypatch):
+    monkeypatch.setattr(store, "SHARE_CHUNK_THRESHOLD", 1024)
+    monkeypatch.setattr(store, "SHARE_CHUNK_SIZE", 500)
+    code = "".join(f"line_{index} = 'wörld'\n" for index in range(200))
+    share_id = upload(code)
+
+    rendered = get(share_id, "/html").get_data().decode("utf-8")
+
+    assert "line_0" in rendered and "line_199" in rendered
+    assert html.escape("wörld") in rendered
+
+
+def test_renders_are_deleted_with_their_share(redis_pools, client, auth, get, upload):
+    share_id = upload(CODE)
+    redis_client = app_redis(redis_pools)
+    get(share_id, "/html")
+
+    client.delete(f"/file/{share_id}/delete", headers=auth())
+
+    assert not redis_client.exists(render_key(f"s:{share_id}"))
+    assert get(share_id, "/html").status_code == 404
+
+
+def test_large_shares_are_not_rendered(app, get, upload, monkeypatch):
+    monkeypatch.setattr(app, "SHARE_RENDER_MAX_SIZE", 10)
+
+    assert get(upload(CODE), "/html").status_code == 413
+
+
+def test_rendering_needs_pygments(app, client, get, upload, monkeypatch):
+    share_id = upload(CODE)
+    assert client.get("/highlight.css").mimetype == "text/css"
+
+    monkeypatch.setattr(app, "render_available", lambda: False)
+
+    assert get(share_id, "/html").status_code == 501
+    assert client.get("/highlight.css").status_code == 501
@@ -0,0 +1,152 @@
+import pytest
+
+import revisions
+from revisions import (
+    RevisionConflict,
+    apply_delta,
+    encode_revision,
+    line_delta,
+    revision_code,
+)
+from shares import build_share, new_file_id
+
+BASE = "".join(f"line {number}\n" for number in range(200))
+
+
+def edit(code, number):
+    lines = code.splitlines(keepends=True)
+    lines[number % len(lines)] = f"edited {number}\n"
+    return "".join(lines) + f"appended {number}\n"
+
+
+@pytest.mark.parametrize(
+    "code",
+    [edit(BASE, 3), "", BASE + "no newline at the end", "\n".join(reversed(BASE))],
+)
+def test_line_delta_round_trip(code):
+    assert apply_delta(BASE, line_delta(BASE, code)) == code
+
+
+def test_small_edits_are_stored_as_deltas():
+    record, full = encode_revision(edit(BASE, 5), BASE)
+
+    assert not full
+    assert len(record) < len(BASE)
+    assert revision_code(BASE, [record]) == edit(BASE, 5)
+
+
+def test_rewrites_are_stored_in_full():
+    code = "completely different\n" * 10
+    record, full = encode_revision(code, BASE)
+
+    assert full
+    assert revision_code(None, [record]) == code
+
+
+@pytest.fixture
+def share(storage):
+    data = {"code": BASE, "language": "python", "title": "t", "expiryTime": 10}
+    share = build_share(data, new_file_id(), "u1")
+    storage.save_share(share)
+    return share
+
+
+def test_revisions_rebuild_across_snapshots(storage, share, monkeypatch):
+    monkeypatch.setattr(revisions, "SHARE_REVISION_SNAPSHOT_INTERVAL", 4)
+    codes = [BASE]
+    for number in range(1, 11):
+        codes.append(edit(codes[-1], number))
+        info, _ = storage.save_revision(share["key"], "python", codes[-1])
+        assert info["revision"] == number
+
+    infos, _ = storage.list_revisions(share["key"])
+    assert [info["revision"] for info in infos] == list(range(1, 11))
+    assert [info["snapshot"] for info in infos] == [0, 0, 0, 4, 4, 4, 4, 8, 8, 8]
+
+    for number, code in enumerate(codes):
+        revision, _ = storage.load_revision(share["key"], "python", number)
+        assert revision["revision"] == number
+        assert revision["code"] == code
+
+    latest, _ = storage.load_revision(share["key"], "python", -1)
+    assert latest["code"] == codes[-1]
+
+
+def test_revision_titles_carry_over(storage, share):
+    storage.save_revision(share["key"], "python", edit(BASE, 1), "renamed")
+    storage.save_revision(share["key"], "python", edit(BASE, 2))
+
+    revision, _ = storage.load_revision(share["key"], "python", 2)
+    assert revision["title"] == "renamed"
+
+
+def test_revisions_are_capped(storage, share, monkeypatch):
+    monkeypatch.setattr(revisions, "SHARE_REVISION_MAX", 2)
+    storage.save_revision(share["key"], "python", edit(BASE, 1))
+    storage.save_revision(share["key"], "python", edit(BASE, 2))
+
+    with pytest.raises(RevisionConflict):
+        storage.save_revision(share["key"], "python", edit(BASE, 3))
+
+
+def test_missing_revisions(storage, share):
+    assert storage.load_revision(share["key"], "python", 1)[0] is None
+    assert storage.save_revision("s:0000000000", "python", BASE)[0] is None
+
+    storage.delete_share(share["key"])
+    assert storage.list_revisions(share["key"])[0] is None
+
+
+def revise(client, auth, share_id, code, user_id="u1", **fields):
+    return client.post(
+        f"/file/{share_id}/revisions",
+        json={"code": code, **fields},
+        headers=auth(user_id),
+    )
+
+
+def test_revisions_through_the_routes(client, auth, get, upload):
+    share_id = upload(BASE)
+    codes = [BASE, edit(BASE, 1), edit(edit(BASE, 1), 2)]
+
+    for number, code in enumerate(codes[1:], 1):
+        response = revise(client, auth, share_id, code)
+        assert response.status_code == 200
+        assert response.get_json()["revision"] == number
+        assert response.get_json()["fileUrl"].endswith(f"/revisions/{number}")
+
+    listed = get(share_id, "/revisions").get_json()
+    assert listed["latest"] == 2
+    assert [revision["revision"] for revision in listed["revisions"]] == [0, 1, 2]
+
+    for number, code in enumerate(codes):
+        response = get(share_id, f"/revisions/{number}")
+        assert response.status_code == 200
+        assert response.get_json()["code"] == code
+        revalidated = get(
+            share_id,
+            f"/revisions/{number}",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert revalidated.status_code == 304
+
+    assert get(share_id, "/revisions/3").status_code == 404
+    assert get(share_id).get_json()["code"] == BASE
+
+
+def test_only_the_owner_can_revise_a_share(client, auth, get, upload):
+    share_id = upload(BASE)
+
+    response = revise(client, auth, share_id, edit(BASE, 1), user_id="u2")
+
+    assert response.status_code == 403
+    assert get(share_id, "/revisions").get_json()["latest"] == 0
+
+
+def test_revising_missing_shares(client, auth, get, upload):
+    share_id = upload(BASE)
+    client.delete(f"/file/{share_id}/delete", headers=auth())
+
+    assert revise(client, auth, share_id, edit(BASE, 1)).status_code == 404
+    assert get(share_id, "/revisions").status_code == 404
+    assert revise(client, auth, "nodash", BASE).status_code == 400
@@ -0,0 +1,138 @@
+import fakeredis
+import pytest
+
+import rebalance
+import sharding
+import utils
+from sharding import HashRing, node_name, share_file_id, user_index_id
+from storage import NodeUnavailable
+from store import user_index_key
+
+URLS = ["redis://a:6379/0", "redis://b:6379/0", "redis://c:6379/0"]
+
+
+@pytest.fixture
+def shards(redis_pools, monkeypatch):
+    """Points utils at REDIS_NODES=nodes (and REDIS_NODES_PREVIOUS=previous)
+    and returns its sharded storage."""
+
+    def configure(nodes, previous=()):
+        monkeypatch.setattr(sharding, "REDIS_NODES", ",".join(nodes))
+        monkeypatch.setattr(sharding, "REDIS_NODES_PREVIOUS", ",".join(previous))
+        ring, previous_ring = sharding.build_rings()
+        monkeypatch.setattr(utils, "shard_ring", ring)
+        monkeypatch.setattr(utils, "previous_shard_ring", previous_ring)
+        monkeypatch.setattr(utils, "redis_pool", None)
+        utils.init_redis_pool()
+        return utils.get_storage()
+
+    return configure
+
+
+def node_client(redis_pools, url):
+    return fakeredis.FakeStrictRedis(server=redis_pools[url])
+
+
+def node_url(node):
+    return next(url for url in URLS if node_name(url) == node)
+
+
+def url_for(ring, key):
+    return node_url(ring.node_for_key(key))
+
+
+def test_share_file_ids():
+    assert share_file_id("s:AbCdE12345") == "AbCdE12345"
+    assert share_file_id("file:python-1234-abcd:data") == "1234-abcd"
+
+
+def test_ring_owners_are_stable_and_spread():
+    ring = HashRing(["a", "b", "c"])
+    owners = [ring.node_for(f"share-{index}") for index in range(300)]
+
+    assert owners == [
+        HashRing(["c", "b", "a"]).node_for(f"share-{index}") for index in range(300)
+    ]
+    assert {owner: owners.count(owner) > 50 for owner in "abc"} == dict.fromkeys(
+        "abc", True
+    )
+
+
+def test_shares_are_stored_on_their_node(shards, redis_pools, app, upload, get):
+    shards(URLS[:2])
+    share_ids = [upload(f"x = {index}") for index in range(10)]
+
+    for share_id in share_ids:
+        key = f"s:{share_id}"
+        owner = url_for(utils.shard_ring, key)
+        assert [node_client(redis_pools, url).exists(key) for url in URLS[:2]] == [
+            url == owner for url in URLS[:2]
+        ]
+        assert get(share_id).status_code == 200
+
+
+def test_an_unhealthy_node_only_fails_its_own_shares(
+    shards, redis_pools, app, upload, get
+):
+    shards(URLS[:2])
+    share_ids = [upload(f"x = {index}") for index in range(10)]
+    down = [
+        share_id
+        for share_id in share_ids
+        if url_for(utils.shard_ring, f"s:{share_id}") == URLS[1]
+    ]
+    assert 0 < len(down) < len(share_ids)
+
+    redis_pools[URLS[1]].connected = False
+    utils.check_redis_health()
+
+    assert {share_id: get(share_id).status_code for share_id in share_ids} == {
+        share_id: 503 if share_id in down else 200 for share_id in share_ids
+    }
+    with pytest.raises(NodeUnavailable):
+        utils.get_storage().load_share(f"s:{down[0]}", None)
+
+    # The node is checked again as soon as a request needs it.
+    redis_pools[URLS[1]].connected = True
+    assert get(down[0]).status_code == 200
+    assert utils.redis_healthy
+
+
+def moved_user(previous, ring):
+    return next(
+        f"u{index}"
+        for index in range(100)
+        if previous.node_for(user_index_id(f"u{index}"))
+        != ring.node_for(user_index_id(f"u{index}"))
+    )
+
+
+def test_rebalance_moves_shares_and_indexes(
+    shards, redis_pools, app, client, auth, upload, get
+):
+    previous = shards(URLS[:2]).ring
+    ring = HashRing(node_name(url) for url in URLS)
+    user_id = moved_user(previous, ring)
+    share_ids = [upload(f"x = {index}", user_id=user_id) for index in range(20)]
+
+    # Until the rebalance runs, shares and the user's index are read from
+    # their previous node.
+    shards(URLS, previous=URLS[:2])
+    assert all(get(share_id).status_code == 200 for share_id in share_ids)
+    listed = client.get("/my-shares?limit=50", headers=auth(user_id)).get_json()
+    assert {share["shareId"] for share in listed["shares"]} == set(share_ids)
+
+    assert rebalance.rebalance(dry_run=True)
+    moved = rebalance.rebalance()
+
+    shards(URLS)
+    assert sum(moved.values()) == sum(
+        url_for(previous, f"s:{share_id}") != url_for(ring, f"s:{share_id}")
+        for share_id in share_ids
+    )
+    assert all(get(share_id).status_code == 200 for share_id in share_ids)
+    index_url = node_url(ring.node_for(user_index_id(user_id)))
+    assert node_client(redis_pools, index_url).zcard(user_index_key(user_id)) == 20
+    listed = client.get("/my-shares?limit=50", headers=auth(user_id)).get_json()
+    assert listed["total"] == 20
+    assert rebalance.rebalance() == {}
@@ -0,0 +1,113 @@
+import uuid
+
+import pytest
+
+import utils
+
+from codec import share_document
+from shares import (
+    SHARE_ID_ALPHABET,
+    SHARE_ID_LENGTH,
+    build_share,
+    is_compact_share_id,
+    new_file_id,
+    parse_share_id,
+    share_key,
+    share_lookup,
+)
+from store import ShareIdTaken, chunks_key, meta_key, render_key, revisions_key
+
+LEGACY_ID = f"python-{uuid.uuid4()}"
+
+
+def upload(file_id, code="x = 1", owner="u1"):
+    data = {"code": code, "language": "python", "title": "t", "expiryTime": 10}
+    return build_share(data, file_id, owner)
+
+
+def test_new_ids_are_compact():
+    file_id = new_file_id()
+
+    assert len(file_id) == SHARE_ID_LENGTH
+    assert set(file_id) <= set(SHARE_ID_ALPHABET)
+    assert is_compact_share_id(file_id)
+
+
+def test_idempotent_ids_are_stable_per_attempt():
+    assert new_file_id("idem:u1:k") == new_file_id("idem:u1:k")
+    assert new_file_id("idem:u1:k") != new_file_id("idem:u1:k", 1)
+    assert is_compact_share_id(new_file_id("idem:u1:k", 1))
+
+
+def test_compact_id_keys():
+    key = share_key("AbCdE12345")
+
+    assert parse_share_id("AbCdE12345") == (None, "AbCdE12345")
+    assert key == "s:AbCdE12345"
+    assert [chunks_key(key), meta_key(key), render_key(key), revisions_key(key)] == [
+        "s:AbCdE12345:c",
+        "s:AbCdE12345:m",
+        "s:AbCdE12345:h",
+        "s:AbCdE12345:r",
+    ]
+
+
+def test_legacy_id_keys():
+    key = share_key(LEGACY_ID)
+    base = f"file:{LEGACY_ID}"
+
+    assert not is_compact_share_id(LEGACY_ID)
+    assert parse_share_id(LEGACY_ID) == ("python", LEGACY_ID.split("-", 1)[1])
+    assert key == f"{base}:data"
+    assert [chunks_key(key), meta_key(key), render_key(key), revisions_key(key)] == [
+        f"{base}:chunks",
+        f"{base}:meta",
+        f"{base}:html",
+        f"{base}:revisions",
+    ]
+
+
+def test_malformed_ids_have_no_key():
+    assert share_lookup("nodash") is None
+
+
+@pytest.mark.parametrize("file_id", [new_file_id(), LEGACY_ID])
+def test_share_round_trip(storage, file_id):
+    share = upload(file_id)
+
+    assert storage.save_share(share) is None
+
+    loaded, ttl = storage.load_share(share["key"], "python")
+    assert share_document(loaded) == share["file_data"]
+    assert 0 < ttl <= share["ttl"]
+
+    assert storage.delete_share(share["key"])
+    assert storage.load_share(share["key"], "python")[0] is None
+
+
+def test_taken_ids_are_reported(storage):
+    file_id = new_file_id()
+    storage.save_share(upload(file_id))
+
+    outcomes = storage.save_shares([upload(file_id), upload(new_file_id())])
+
+    assert isinstance(outcomes[0], ShareIdTaken)
+    assert outcomes[1] is None
+
+
+def test_routes_reject_malformed_ids(client, auth, get):
+    assert get("nodash").status_code == 400
+
+    response = client.delete("/file/nodash/delete", headers=auth())
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid 'shareId' format."}
+
+
+def test_routes_serve_legacy_ids(app, get):
+    utils.get_storage().save_share(upload(LEGACY_ID, "legacy = 1"))
+
+    response = get(LEGACY_ID)
+
+    assert response.status_code == 200
+    assert response.get_json()["code"] == "legacy = 1"
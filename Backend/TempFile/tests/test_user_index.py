@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+from shares import build_share, new_file_id
+from storage import RedisStorage
+from store import user_index_key
+
+
+def save_shares(storage, count, owner="u1", expires_at=None):
+    data = {"code": "x = 1", "language": "python", "title": "t", "expiryTime": 10}
+    shares = [build_share(data, new_file_id(), owner) for _ in range(count)]
+    for share in shares:
+        if expires_at:
+            share["expires_at"] = expires_at
+        storage.save_share(share)
+    storage.index_shares(owner, shares)
+    return shares
+
+
+def next_page(storage, cursor, limit):
+    """Lists a page and returns its next cursor the way /my-shares parses it."""
+    entries, last, total = storage.list_user_shares("u1", cursor, limit)
+    share_ids = [share_id for share_id, _, _ in entries]
+    return share_ids, (last[1], last[0]) if last else None, total
+
+
+def list_all(storage, limit):
+    listed, cursor = [], None
+    while True:
+        share_ids, cursor, total = next_page(storage, cursor, limit)
+        listed += share_ids
+        if cursor is None:
+            return listed, total
+
+
+@pytest.mark.parametrize("limit", [1, 3, 50])
+def test_pages_cover_every_share_once(storage, limit):
+    expires_at = int(time.time()) + 600
+    shares = save_shares(storage, 7, expires_at=expires_at)
+    shares += save_shares(storage, 3, expires_at=expires_at + 60)
+
+    listed, total = list_all(storage, limit)
+
+    tied = sorted(share["share_id"] for share in shares[:7])
+    later = sorted(share["share_id"] for share in shares[7:])
+    assert listed == tied + later
+    assert total == 10
+
+
+def test_paging_resumes_after_a_deleted_cursor_share(storage):
+    expires_at = int(time.time()) + 600
+    shares = save_shares(storage, 6, expires_at=expires_at)
+    share_ids = sorted(share["share_id"] for share in shares)
+
+    _, cursor, _ = next_page(storage, None, 2)
+    storage.delete_share(f"s:{cursor[1]}")
+    storage.unindex_share("u1", cursor[1])
+
+    assert next_page(storage, cursor, 2)[0] == share_ids[2:4]
+
+
+def test_paging_leaves_the_index_unchanged(redis_client):
+    storage = RedisStorage(redis_client)
+    save_shares(storage, 4, expires_at=int(time.time()) + 600)
+    before = redis_client.zrange(user_index_key("u1"), 0, -1, withscores=True)
+
+    list_all(storage, 1)
+
+    assert redis_client.zrange(user_index_key("u1"), 0, -1, withscores=True) == before
+
+
+def test_my_shares_pages_through_uploads(client, auth, upload):
+    share_ids = {upload() for _ in range(3)}
+    upload(user_id="u2")
+
+    first = client.get("/my-shares?limit=2", headers=auth()).get_json()
+    cursor = first["nextCursor"]
+    second = client.get(f"/my-shares?limit=2&cursor={cursor}", headers=auth())
+
+    listed = first["shares"] + second.get_json()["shares"]
+    assert {share["shareId"] for share in listed} == share_ids
+    assert first["total"] == 3
+    assert second.get_json()["nextCursor"] is None
+
+
+@pytest.mark.parametrize("query", ["limit=0", "limit=x", "cursor=nocolon"])
+def test_my_shares_rejects_bad_paging(client, auth, query):
+    assert client.get(f"/my-shares?{query}", headers=auth()).status_code == 400
+
+
+def test_only_the_owner_can_delete_a_share(client, auth, get, upload):
+    share_id = upload()
+
+    response = client.delete(f"/file/{share_id}/delete", headers=auth("u2"))
+    assert response.status_code == 403
+    assert get(share_id).status_code == 200
+
+    response = client.delete(f"/file/{share_id}/delete", headers=auth())
+    assert response.status_code == 200
+    assert client.get("/my-shares", headers=auth()).get_json()["total"] == 0
+    assert client.delete(f"/file/{share_id}/delete", headers=auth()).status_code == 404
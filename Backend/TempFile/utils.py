@@ -1,44 +1,278 @@
 import os
 import jwt
+import time
 import redis
 import requests
 import logging
+from structured_logging import setup_logging
+import threading
 from functools import wraps
 from flask import request, jsonify
 from dotenv import load_dotenv
+from metrics import observe_recaptcha
+from storage import (
+    STORAGE_BACKEND,
+    RedisStorage,
+    ShardedRedisStorage,
+    init_sqlite_storage,
+)
+from sharding import build_rings, node_urls
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(module)s - %(message)s"
-)
+setup_logging()
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv("JWT_SECRET")
 RECAPTCHA_SECRET_KEY = os.getenv("RECAPTCHA_SECRET_KEY")
+ADMIN_USER_IDS = set(filter(None, os.getenv("ADMIN_USER_IDS", "").split(",")))
 
 
-def get_redis_connection():
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "20"))
+REDIS_POOL_WARM_SIZE = int(os.getenv("REDIS_POOL_WARM_SIZE", "4"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "15"))
+REDIS_POOL_SATURATION_WARNING = float(os.getenv("REDIS_POOL_SATURATION_WARNING", "0.8"))
+
+
+class TrackedConnectionPool(redis.BlockingConnectionPool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+
+    def get_connection(self, *args, **kwargs):
+        try:
+            connection = super().get_connection(*args, **kwargs)
+        except redis.ConnectionError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+
+        with self._stats_lock:
+            self.in_use += 1
+            self.checkouts += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return connection
+
+    def release(self, connection):
+        try:
+            super().release(connection)
+        finally:
+            with self._stats_lock:
+                self.in_use = max(self.in_use - 1, 0)
+
+    def stats(self):
+        with self._stats_lock:
+            return pool_stats(self, len(self._connections))
+
+
+def pool_stats(pool, created):
+    return {
+        "max_connections": pool.max_connections,
+        "created": created,
+        "in_use": pool.in_use,
+        "peak_in_use": pool.peak_in_use,
+        "checkouts": pool.checkouts,
+        "timeouts": pool.timeouts,
+        "saturation": round(pool.in_use / pool.max_connections, 3),
+    }
+
+
+redis_pool = None
+redis_healthy = False
+redis_node_pools = {}
+redis_node_health = {}
+shard_ring, previous_shard_ring = build_rings()
+_redis_pool_lock = threading.Lock()
+_redis_pool_pid = None
+
+
+def create_redis_pool(url=None):
+    if url:
+        return TrackedConnectionPool.from_url(
+            url,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=REDIS_POOL_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            socket_keepalive=True,
+        )
+
+    return TrackedConnectionPool(
+        connection_class=redis.SSLConnection,
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        password=os.getenv("REDIS_PASSWORD"),
+        max_connections=REDIS_POOL_SIZE,
+        timeout=REDIS_POOL_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        socket_keepalive=True,
+    )
+
+
+def check_node_health(name, pool):
+    healthy = redis_node_health.get(name, False)
+    try:
+        redis.StrictRedis(connection_pool=pool).ping()
+        if not healthy:
+            logger.info("Successfully connected to Redis node %s.", name)
+        healthy = True
+    except redis.RedisError as e:
+        if healthy:
+            logger.error("Redis health check failed for node %s: %s", name, e)
+        healthy = False
+
+    stats = pool.stats()
+    if stats["saturation"] >= REDIS_POOL_SATURATION_WARNING:
+        logger.warning(
+            "Redis connection pool for node %s is close to saturation: %s", name, stats
+        )
+
+    redis_node_health[name] = healthy
+    return healthy
+
+
+# A failed node is checked again when a request needs it, like the single
+# pool in get_redis_connection.
+def redis_node_healthy(name):
+    global redis_healthy
+    if redis_node_health.get(name, False):
+        return True
+
+    healthy = check_node_health(name, redis_node_pools[name])
+    redis_healthy = all(redis_node_health.values())
+    return healthy
+
+
+def check_redis_health():
+    global redis_healthy
+    healthy = [check_node_health(name, pool) for name, pool in all_redis_pools()]
+    redis_healthy = all(healthy)
+    return redis_healthy
+
+
+def all_redis_pools():
+    if redis_node_pools:
+        return list(redis_node_pools.items())
+    return [("default", redis_pool)]
+
+
+def warm_redis_pool(pool):
+    connections = []
     try:
-        redis_client = redis.StrictRedis(
-            host=os.getenv("REDIS_HOST"),
-            port=int(os.getenv("REDIS_PORT")),
-            password=os.getenv("REDIS_PASSWORD"),
-            ssl=True,
+        for _ in range(min(REDIS_POOL_WARM_SIZE, REDIS_POOL_SIZE)):
+            connection = pool.get_connection()
+            connections.append(connection)
+            connection.send_command("PING")
+            connection.read_response()
+        logger.info(
+            "Warmed Redis connection pool with %s connections.", len(connections)
         )
-        redis_client.ping()
-        logging.info("Successfully connected to Redis.")
-        return redis_client
-    except redis.ConnectionError as e:
-        logging.error(f"Redis connection error: {e}")
+    except redis.RedisError as e:
+        logger.error("Failed to warm Redis connection pool: %s", e)
+    finally:
+        for connection in connections:
+            pool.release(connection)
+
+
+def redis_health_loop():
+    while True:
+        time.sleep(REDIS_HEALTH_CHECK_INTERVAL)
+        try:
+            check_redis_health()
+        except Exception as e:
+            logger.error("Unexpected error in Redis health check: %s", e)
+
+
+def init_redis_pool():
+    global redis_pool, redis_node_pools, _redis_pool_pid
+    with _redis_pool_lock:
+        if redis_pool is not None and _redis_pool_pid == os.getpid():
+            return redis_pool
+
+        try:
+            redis_node_pools = {
+                name: create_redis_pool(url) for name, url in node_urls().items()
+            }
+            redis_pool = (
+                next(iter(redis_node_pools.values()))
+                if redis_node_pools
+                else create_redis_pool()
+            )
+        except Exception as e:
+            logger.error("Failed to create Redis connection pool: %s", e)
+            return None
+
+        _redis_pool_pid = os.getpid()
+        for _, pool in all_redis_pools():
+            warm_redis_pool(pool)
+        check_redis_health()
+        threading.Thread(
+            target=redis_health_loop, name="redis-health-check", daemon=True
+        ).start()
+        return redis_pool
+
+
+def get_redis_connection():
+    if init_redis_pool() is None:
         return None
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while connecting to Redis: {e}")
+
+    if not redis_healthy and not check_redis_health():
         return None
 
+    return redis.StrictRedis(connection_pool=redis_pool)
+
+
+# Opens and warms the connections of the configured backend up front; gunicorn
+# calls this in each worker after forking, since the preloaded master never
+# serves requests.
+def init_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return init_sqlite_storage()
+    return init_redis_pool()
+
+
+def get_storage():
+    if STORAGE_BACKEND == "sqlite":
+        return init_sqlite_storage()
+
+    if shard_ring is not None:
+        if init_redis_pool() is None:
+            return None
+        clients = {
+            name: redis.StrictRedis(connection_pool=pool)
+            for name, pool in redis_node_pools.items()
+        }
+        return ShardedRedisStorage(
+            clients, shard_ring, previous_shard_ring, redis_node_healthy
+        )
+
+    redis_client = get_redis_connection()
+    return RedisStorage(redis_client) if redis_client else None
+
+
+def get_redis_pool_stats():
+    if redis_pool is None:
+        return {"healthy": False}
+
+    stats = {"healthy": redis_healthy, **redis_pool.stats()}
+    if redis_node_pools:
+        stats["nodes"] = {
+            name: {"healthy": redis_node_health.get(name, False), **pool.stats()}
+            for name, pool in redis_node_pools.items()
+        }
+    return stats
+
 
 def is_human(recaptcha_token):
+    started = time.perf_counter()
     if not recaptcha_token or not RECAPTCHA_SECRET_KEY:
-        logging.warning("reCAPTCHA check failed: Token or secret key is missing.")
+        logger.warning("reCAPTCHA check failed: Token or secret key is missing.")
+        observe_recaptcha("missing", started)
         return False
 
     payload = {"secret": RECAPTCHA_SECRET_KEY, "response": recaptcha_token}
@@ -51,16 +285,23 @@ def is_human(recaptcha_token):
         result = response.json()
 
         if result.get("success") and result.get("score", 0) > 0.5:
-            logging.info(
-                f"reCAPTCHA verification successful. Score: {result.get('score')}"
+            logger.info(
+                "reCAPTCHA verification successful. Score: %s", result.get("score")
             )
+            observe_recaptcha("passed", started)
             return True
         else:
-            logging.warning(f"reCAPTCHA verification failed. Result: {result}")
+            logger.warning(
+                "reCAPTCHA verification failed. Score: %s, errors: %s",
+                result.get("score"),
+                result.get("error-codes"),
+            )
+            observe_recaptcha("failed", started)
             return False
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"reCAPTCHA request to Google failed: {e}")
+        logger.error("reCAPTCHA request to Google failed: %s", e)
+        observe_recaptcha("error", started)
         return False
 
 
@@ -74,17 +315,29 @@ def token_required(f):
                 token = auth_header.split(" ")[1]
 
         if not token:
-            logging.warning("Access attempt without an Authorization token.")
+            logger.warning("Access attempt without an Authorization token.")
             return jsonify({"message": "Token is missing!"}), 403
 
         try:
             decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS512"])
             request.user_data = decoded
-            logging.info("Token successfully decoded.")
+            logger.info("Token successfully decoded.")
         except jwt.InvalidTokenError as e:
-            logging.warning(f"Invalid token received: {e}")
+            logger.warning("Invalid token received: %s", e)
             return jsonify({"message": "Invalid token!"}), 401
 
         return f(*args, **kwargs)
 
     return decorator
+
+
+def admin_required(f):
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        if request.user_data.get("userId") not in ADMIN_USER_IDS:
+            logger.warning("Non-admin access attempt to an admin endpoint.")
+            return jsonify({"message": "Admin access required!"}), 403
+
+        return f(*args, **kwargs)
+
+    return decorator
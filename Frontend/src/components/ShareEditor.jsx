@@ -58,10 +58,11 @@ const languageIcons = {
   kotlin: TbBrandKotlin,
 };
 
-const isUUIDMatch = (inputString) => {
-  const regex =
+const isShareIdMatch = (inputString) => {
+  const regex = /^[0-9A-Za-z]{10}$/;
+  const legacyRegex =
     /(c|cpp|csharp|dart|go|htmlcssjs|java|javascript|julia|kotlin|mongodb|perl|python|ruby|rust|scala|sql|swift|typescript|verilog)-([a-f0-9]{8}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{4}-[a-f0-9]{12})/;
-  return regex.test(inputString);
+  return regex.test(inputString) || legacyRegex.test(inputString);
 };
 
 const ShareEditor = ({ isDarkMode }) => {
@@ -233,7 +234,7 @@ const ShareEditor = ({ isDarkMode }) => {
   };
 
   useEffect(() => {
-    if (!isUUIDMatch(shareId)) {
+    if (!isShareIdMatch(shareId)) {
       setState({
         code: "",
         language: "",